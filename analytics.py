@@ -0,0 +1,216 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from config import ANALYTICS_INTERVAL_MS, ANALYTICS_BATCH, ANALYTICS_TOP_TOPICS
+from cpu_tasks import noun_phrases_many
+from executors import run_cpu
+from metrics import Counter
+from storage import storage
+
+ANALYTICS_ROWS = Counter("analytics_rows_total", "Conversation rows folded into the analytics tables")
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # SQLite CURRENT_TIMESTAMP, UTC
+
+
+def hour_bucket(timestamp: str):
+    return timestamp[:13] + ":00:00"
+
+
+class AnalyticsWorker:
+    """
+    Folds new conversations rows into the analytics tables in the background.
+    Each pass reads the rows after the analytics_state watermark, extracts topics
+    for the user turns in one process-pool job, and writes the hourly
+    aggregates, topic counts, sentiment points and the new watermark in one
+    transaction. The watermark update is compare-and-set, so with several
+    worker processes each row is still counted exactly once.
+    """
+    def __init__(self, interval_ms: float = ANALYTICS_INTERVAL_MS, batch: int = ANALYTICS_BATCH):
+        self.interval = interval_ms / 1000.0
+        self.batch = batch
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancels the worker and waits for it, so no pass is still writing when storage closes."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def notify(self):
+        """New turns were queued; fold them in soon instead of at the next interval."""
+        self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.catch_up()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Analytics update failed: {e!r}")
+
+    async def catch_up(self):
+        """Processes batches until no unprocessed rows remain. Returns the number of rows folded in."""
+        # Turns queued on this worker should be committed before we look
+        await storage.flush()
+        total = 0
+        while True:
+            processed, more = await self._process_batch()
+            total += processed
+            if not more:
+                return total
+
+    async def _process_batch(self):
+        (last_id,) = await storage.fetchone("SELECT last_conversation_id FROM analytics_state WHERE id = 1")
+        rows = await storage.fetchall(
+            "SELECT id, user_id, role, content, timestamp, sentiment_score, latency_ms FROM conversations WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, self.batch),
+        )
+        if not rows:
+            return 0, False
+
+        user_rows = [row for row in rows if row[2] == "user"]
+        try:
+            phrases = await run_cpu(noun_phrases_many, [row[3] for row in user_rows]) if user_rows else []
+        except Exception as e:
+            # Latency and sentiment must not stall behind the NLP stack (e.g. missing corpora)
+            print(f"⚠️ Topic extraction failed, folding {len(user_rows)} turns without topics: {e.__class__.__name__}")
+            phrases = []
+        topics_by_id = {row[0]: topics for row, topics in zip(user_rows, phrases)}
+        new_last_id = rows[-1][0]
+
+        async with storage.transaction() as db:
+            cursor = await db.execute(
+                "UPDATE analytics_state SET last_conversation_id = ? WHERE id = 1 AND last_conversation_id = ?",
+                (new_last_id, last_id),
+            )
+            if cursor.rowcount == 0:
+                return 0, True  # Another worker folded these rows in first; start over from its watermark
+
+            # Rows deleted since we read them (/reset-memory) must not be counted
+            async with db.execute("SELECT id FROM conversations WHERE id > ? AND id <= ?", (last_id, new_last_id)) as cursor:
+                present = {row[0] for row in await cursor.fetchall()}
+
+            hourly, topics, sentiment = {}, defaultdict(int), []
+            for row_id, user_id, role, _, timestamp, score, latency in rows:
+                if row_id not in present:
+                    continue
+                bucket = hour_bucket(timestamp)
+                entry = hourly.setdefault((user_id, bucket), [0, 0.0, 0, 0, 0, 0, None])
+                if role == "user":
+                    entry[0] += 1
+                    if score is not None:
+                        entry[1] += score
+                        entry[2] += 1
+                        sentiment.append((row_id, user_id, timestamp, score))
+                    for topic in topics_by_id.get(row_id, ()):
+                        topics[(user_id, bucket, topic)] += 1
+                elif role == "assistant":
+                    entry[3] += 1
+                    if latency is not None:
+                        entry[4] += latency
+                        entry[5] += 1
+                        entry[6] = latency if entry[6] is None else max(entry[6], latency)
+
+            await db.executemany(
+                """
+                INSERT INTO analytics_hourly (user_id, bucket, user_turns, sentiment_sum, sentiment_count, replies, latency_sum_ms, latency_count, latency_max_ms)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, bucket) DO UPDATE SET
+                    user_turns = user_turns + excluded.user_turns,
+                    sentiment_sum = sentiment_sum + excluded.sentiment_sum,
+                    sentiment_count = sentiment_count + excluded.sentiment_count,
+                    replies = replies + excluded.replies,
+                    latency_sum_ms = latency_sum_ms + excluded.latency_sum_ms,
+                    latency_count = latency_count + excluded.latency_count,
+                    latency_max_ms = MAX(COALESCE(latency_max_ms, excluded.latency_max_ms), COALESCE(excluded.latency_max_ms, latency_max_ms))
+                """,
+                [(user_id, bucket, *entry) for (user_id, bucket), entry in hourly.items()],
+            )
+            await db.executemany(
+                "INSERT INTO analytics_topics (user_id, bucket, topic, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id, bucket, topic) DO UPDATE SET count = count + excluded.count",
+                [(*key, count) for key, count in topics.items()],
+            )
+            await db.executemany(
+                "INSERT OR REPLACE INTO analytics_sentiment (conversation_id, user_id, timestamp, score) VALUES (?, ?, ?, ?)",
+                sentiment,
+            )
+
+        ANALYTICS_ROWS.inc(len(present))
+        return len(rows), len(rows) == self.batch
+
+
+def parse_window_bound(value: str):
+    """ISO 8601 time (naive means UTC) -> SQLite timestamp text. Raises ValueError."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+async def read_analytics(user_id: int, since: str = None, until: str = None, resolution: str = "turn", points: int = 500):
+    """
+    Dashboard analytics for [since, until) from the pre-aggregated tables.
+    Latency and topics cover the whole window at hourly granularity. The
+    sentiment trend has one point per turn (newest `points` of the window) or,
+    with resolution="hour", one averaged point per hour.
+    """
+    since = since or "0000-01-01 00:00:00"
+    until = until or "9999-12-31 23:59:59"
+    # An hour bucket belongs to the window if any of its hour does
+    bucket_since = hour_bucket(since)
+
+    async def latency():
+        return await storage.fetchone(
+            "SELECT COALESCE(SUM(user_turns), 0), COALESCE(SUM(latency_sum_ms), 0), COALESCE(SUM(latency_count), 0), MAX(latency_max_ms) "
+            "FROM analytics_hourly WHERE user_id = ? AND bucket >= ? AND bucket < ?",
+            (user_id, bucket_since, until),
+        )
+
+    async def topics():
+        return await storage.fetchall(
+            "SELECT topic, SUM(count) AS total FROM analytics_topics WHERE user_id = ? AND bucket >= ? AND bucket < ? "
+            "GROUP BY topic ORDER BY total DESC, topic LIMIT ?",
+            (user_id, bucket_since, until, ANALYTICS_TOP_TOPICS),
+        )
+
+    async def trend():
+        if resolution == "hour":
+            return await storage.fetchall(
+                "SELECT bucket, sentiment_sum / sentiment_count FROM analytics_hourly "
+                "WHERE user_id = ? AND bucket >= ? AND bucket < ? AND sentiment_count > 0 ORDER BY bucket",
+                (user_id, bucket_since, until),
+            )
+        rows = await storage.fetchall(
+            "SELECT timestamp, score FROM analytics_sentiment WHERE user_id = ? AND timestamp >= ? AND timestamp < ? "
+            "ORDER BY timestamp DESC, conversation_id DESC LIMIT ?",
+            (user_id, since, until, points),
+        )
+        return rows[::-1]
+
+    (turns, latency_sum, latency_count, latency_max), top_topics, sentiment = await asyncio.gather(latency(), topics(), trend())
+    return {
+        "sentiment_trend": [{"time": time, "score": score} for time, score in sentiment],
+        "avg_latency": int(latency_sum / latency_count) if latency_count else 0,
+        "max_latency": latency_max or 0,
+        "turns": turns,
+        "topics": [{"topic": topic, "count": count} for topic, count in top_topics],
+    }
+
+
+analytics = AnalyticsWorker()
@@ -0,0 +1,70 @@
+BYTES_PER_MS = 32  # 16kHz mono PCM16
+
+
+class PreRollRing:
+    """
+    Fixed-size ring holding the most recent uplink audio.
+    Every frame is written into it, so the speech that VAD needed to confirm an
+    onset (and the soft attack before it) can be spliced in front of the utterance.
+    """
+    def __init__(self, duration_ms: float):
+        self.capacity = int(duration_ms * BYTES_PER_MS) & ~1  # Whole samples only
+        self.buffer = bytearray(self.capacity)
+        self.position = 0
+        self.filled = 0
+
+    def write(self, data: bytes):
+        if self.capacity == 0:
+            return
+        data = memoryview(data)[-self.capacity:]  # Older bytes would be overwritten anyway
+        n = len(data)
+        first = min(n, self.capacity - self.position)
+        self.buffer[self.position:self.position + first] = data[:first]
+        if first < n:
+            self.buffer[:n - first] = data[first:]
+        self.position = (self.position + n) % self.capacity
+        self.filled = min(self.capacity, self.filled + n)
+
+    def drain_into(self, utterance):
+        """Appends the ring contents to `utterance`, oldest first, and empties the ring."""
+        start = (self.position - self.filled) % self.capacity if self.capacity else 0
+        view = memoryview(self.buffer)
+        if start + self.filled <= self.capacity:
+            utterance.extend(view[start:start + self.filled])
+        else:
+            utterance.extend(view[start:])
+            utterance.extend(view[:self.position])
+        self.filled = 0
+
+
+class UtteranceBuffer:
+    """
+    Preallocated buffer for one user utterance, capped at max_ms.
+    Appending copies into the existing allocation; audio past the cap is dropped
+    and `full` tells the caller to force an endpoint.
+    """
+    def __init__(self, max_ms: float):
+        self.buffer = bytearray(int(max_ms * BYTES_PER_MS) & ~1)
+        self.length = 0
+
+    @property
+    def full(self):
+        return self.length >= len(self.buffer)
+
+    def extend(self, data):
+        n = min(len(data), len(self.buffer) - self.length)
+        self.buffer[self.length:self.length + n] = memoryview(data)[:n]
+        self.length += n
+
+    def view(self):
+        """Zero-copy view of the audio so far; only valid until the next reset."""
+        return memoryview(self.buffer)[:self.length]
+
+    def take(self):
+        """Returns a copy of the utterance and resets the buffer for the next one."""
+        pcm = bytes(self.view())
+        self.length = 0
+        return pcm
+
+    def reset(self):
+        self.length = 0
@@ -0,0 +1,254 @@
+import io
+import math
+import struct
+import numpy as np
+
+# Internal pipeline format: 16kHz mono PCM16. Everything on the wire is
+# converted to/from it per stream by StreamTranscoder.
+PIPELINE_RATE = 16000
+
+
+# --- G.711 tables -----------------------------------------------------------
+# Decoding is a 256-entry lookup; encoding is a 65536-entry lookup indexed by the
+# int16 sample reinterpreted as uint16, so both directions are one NumPy gather.
+
+def _mulaw_decode_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    sign = codes & 0x80
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(sign, -magnitude, magnitude).astype(np.int16)
+
+
+def _alaw_decode_table():
+    codes = np.arange(256, dtype=np.int32) ^ 0x55
+    sign = codes & 0x80
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = np.where(exponent == 0, (mantissa << 4) + 8, ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0))
+    return np.where(sign, magnitude, -magnitude).astype(np.int16)
+
+
+def _mulaw_encode_table():
+    # Reference G.711 algorithm on 14-bit magnitudes (same output as audioop.lin2ulaw)
+    samples = np.arange(65536, dtype=np.int64).astype(np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(samples < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(samples), 8159) + 33
+    segment = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), magnitude)
+    code = np.where(segment >= 8, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    return (code ^ mask).astype(np.uint8)
+
+
+def _alaw_encode_table():
+    samples = np.arange(65536, dtype=np.int64).astype(np.uint16).view(np.int16).astype(np.int32)
+    sign = np.where(samples >= 0, 0x80, 0x00)
+    magnitude = np.minimum(np.where(samples < 0, -samples - 1, samples), 32767) >> 3
+    exponent = np.where(magnitude < 32, 0, np.floor(np.log2(np.maximum(magnitude, 1))).astype(np.int32) - 4)
+    mantissa = np.where(exponent == 0, magnitude >> 1, magnitude >> exponent) & 0x0F
+    return ((sign | (exponent << 4) | mantissa) ^ 0x55).astype(np.uint8)
+
+
+MULAW_DECODE = _mulaw_decode_table()
+MULAW_ENCODE = _mulaw_encode_table()
+ALAW_DECODE = _alaw_decode_table()
+ALAW_ENCODE = _alaw_encode_table()
+
+
+def mulaw_decode(data: bytes):
+    return MULAW_DECODE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def mulaw_encode(pcm):
+    return MULAW_ENCODE[np.asarray(pcm, dtype=np.int16).view(np.uint16)]
+
+
+def alaw_decode(data: bytes):
+    return ALAW_DECODE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def alaw_encode(pcm):
+    return ALAW_ENCODE[np.asarray(pcm, dtype=np.int16).view(np.uint16)]
+
+
+# --- Resampling --------------------------------------------------------------
+
+class PolyphaseResampler:
+    """
+    Streaming rational resampler (in_rate -> out_rate) for one audio stream.
+    A Kaiser-windowed sinc low-pass is split into L polyphase branches; every
+    output sample is one dot product of taps_per_phase input samples with one
+    branch, computed for a whole chunk at once. The last input samples and the
+    output phase are carried between chunks, so consecutive chunks join without
+    clicks or drift.
+    """
+    def __init__(self, in_rate: int, out_rate: int, taps_per_phase: int = 32, beta: float = 8.0):
+        g = math.gcd(in_rate, out_rate)
+        self.up = out_rate // g
+        self.down = in_rate // g
+        self.taps = taps_per_phase
+
+        # Prototype low-pass at the upsampled rate, cut just below the lower Nyquist
+        n = self.taps * self.up
+        cutoff = 0.5 / max(self.up, self.down) * 0.92
+        t = np.arange(n) - (n - 1) / 2.0
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(n, beta)
+        prototype *= self.up / prototype.sum()  # Unity passband gain after zero-stuffing
+        # branches[p, j] = h[p + j*L]; reversed so it lines up with ascending input windows
+        self.branches = prototype.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32)
+
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.next_out = 0     # Index of the next output sample
+        self.consumed = 0     # Input samples seen so far
+
+    def process(self, pcm):
+        """Resamples a chunk of int16 samples and returns int16 samples."""
+        x = np.asarray(pcm, dtype=np.int16).astype(np.float32)
+        if self.up == self.down:
+            return x.astype(np.int16)
+
+        buffer = np.concatenate((self.history, x))
+        base = self.consumed - (self.taps - 1)   # Input index of buffer[0]
+        total = self.consumed + x.size
+
+        # Outputs whose newest input sample has arrived: floor(n*M/L) < total
+        last = -(-total * self.up // self.down)
+        outputs = np.arange(self.next_out, last, dtype=np.int64)
+        if outputs.size:
+            position = outputs * self.down
+            newest = position // self.up - base
+            phase = position % self.up
+            window = newest[:, None] - np.arange(self.taps - 1, -1, -1)[None, :]
+            y = np.einsum("ij,ij->i", buffer[window], self.branches[phase])
+        else:
+            y = np.zeros(0, dtype=np.float32)
+
+        self.next_out = int(last)
+        self.consumed = total
+        self.history = buffer[-(self.taps - 1):].copy()
+
+        # Keep the counters small on long calls: shifting k*M inputs and k*L
+        # outputs together leaves every phase unchanged
+        if self.consumed >= 1 << 20:
+            k = min(self.consumed // self.down, self.next_out // self.up)
+            self.consumed -= k * self.down
+            self.next_out -= k * self.up
+
+        return np.clip(np.rint(y), -32768, 32767).astype(np.int16)
+
+
+# --- Codecs -----------------------------------------------------------------
+
+class Codec:
+    def __init__(self, codec_id: int, name: str, sample_rate: int, encode, decode, bytes_per_sample: int):
+        self.id = codec_id
+        self.name = name
+        self.sample_rate = sample_rate
+        self.encode = encode    # int16 samples -> wire bytes (numpy array)
+        self.decode = decode    # wire bytes -> int16 samples
+        self.bytes_per_sample = bytes_per_sample
+
+
+def _pcm16_encode(pcm):
+    return np.asarray(pcm, dtype=np.int16)
+
+
+def _pcm16_decode(data: bytes):
+    return np.frombuffer(data, dtype=np.int16)
+
+
+CODEC_PCM16_16K = Codec(1, "pcm16_16k", 16000, _pcm16_encode, _pcm16_decode, 2)
+CODEC_PCM16_8K = Codec(2, "pcm16_8k", 8000, _pcm16_encode, _pcm16_decode, 2)
+CODEC_MULAW = Codec(3, "mulaw", 8000, mulaw_encode, mulaw_decode, 1)
+CODEC_ALAW = Codec(4, "alaw", 8000, alaw_encode, alaw_decode, 1)
+
+CODECS = {codec.name: codec for codec in (CODEC_PCM16_16K, CODEC_PCM16_8K, CODEC_MULAW, CODEC_ALAW)}
+CODECS_BY_ID = {codec.id: codec for codec in CODECS.values()}
+
+
+class StreamTranscoder:
+    """
+    Converts one session's wire audio to/from the 16kHz PCM16 pipeline format.
+    Uplink and downlink each keep their own resampler state.
+    """
+    def __init__(self, codec: Codec):
+        self.codec = codec
+        self.passthrough = codec is CODEC_PCM16_16K
+        if not self.passthrough:
+            self.uplink = PolyphaseResampler(codec.sample_rate, PIPELINE_RATE)
+            self.downlink = PolyphaseResampler(PIPELINE_RATE, codec.sample_rate)
+
+    def decode(self, payload: bytes):
+        """Wire payload -> 16kHz PCM16 bytes."""
+        if self.passthrough:
+            return payload
+        return self.uplink.process(self.codec.decode(payload)).tobytes()
+
+    def encode(self, pcm16_16k: bytes):
+        """16kHz PCM16 bytes -> wire payload."""
+        if self.passthrough:
+            return pcm16_16k
+        samples = self.downlink.process(np.frombuffer(pcm16_16k, dtype=np.int16))
+        return self.codec.encode(samples).tobytes()
+
+
+class StreamingMp3Decoder:
+    """
+    Incremental in-process MP3 decoder for one TTS stream.
+    Bytes go in as they arrive from the network; 16kHz mono PCM16 comes out as
+    soon as complete MP3 frames have been parsed. Decoding runs inside
+    libavcodec via PyAV (no ffmpeg subprocess, no temp files) and the streaming
+    resampler is built from the sample rate of the first decoded frame.
+    """
+    def __init__(self, out_rate: int = PIPELINE_RATE):
+        import av  # Deferred: only TTS workers need libavcodec
+        self.codec = av.CodecContext.create("mp3", "r")
+        self.out_rate = out_rate
+        self.resampler = None
+
+    def feed(self, data: bytes):
+        """Decodes whatever complete frames `data` finishes. Returns PCM16 bytes (possibly empty)."""
+        return self._decode(self.codec.parse(data))
+
+    def flush(self):
+        """Drains the parser and decoder at end of stream."""
+        pcm = self._decode(self.codec.parse(None))
+        tail = [self._convert(frame) for frame in self.codec.decode(None)]
+        return pcm + b"".join(tail)
+
+    def _decode(self, packets):
+        return b"".join(self._convert(frame) for packet in packets for frame in self.codec.decode(packet))
+
+    def _convert(self, frame):
+        samples = frame.to_ndarray()
+        if not frame.format.is_planar:
+            # Packed audio comes back as (1, samples * channels)
+            samples = samples.reshape(-1, len(frame.layout.channels)).T
+        if samples.dtype.kind == "f":
+            samples = np.clip(samples * 32768.0, -32768, 32767)
+        mono = samples.mean(axis=0) if samples.shape[0] > 1 else samples[0]
+        mono = mono.astype(np.int16)
+
+        if self.resampler is None:
+            self.resampler = PolyphaseResampler(frame.sample_rate, self.out_rate)
+        return self.resampler.process(mono).tobytes()
+
+
+WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+
+def pcm16_to_wav(pcm, sample_rate: int = PIPELINE_RATE):
+    """
+    Wraps mono PCM16 in an in-memory WAV file (BytesIO, rewound).
+    The PCM is copied exactly once, straight from the caller's buffer.
+    """
+    size = len(pcm)
+    wav = io.BytesIO()
+    wav.write(WAV_HEADER.pack(
+        b"RIFF", 36 + size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", size,
+    ))
+    wav.write(pcm)
+    wav.seek(0)
+    return wav
@@ -1,25 +1,330 @@
-import torch
+import os
+import asyncio
+import time
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+from config import VAD_MODEL_PATH, VAD_TORCH_THREADS, VAD_TICK_MS, VAD_MAX_BATCH, VAD_PREGATE, VAD_PREGATE_SPECTRAL, VAD_PREGATE_MARGIN_DB
+from metrics import Counter
+
+# torch is imported inside VADEngine, so importing this module stays cheap and
+# the ~2s torch import happens during background warm-up, not process start.
+
+SAMPLE_RATE = 16000
+WINDOW_SAMPLES = 512   # Silero's native window at 16kHz (32ms)
+CONTEXT_SAMPLES = 64   # Samples of the previous window Silero prepends to each input
+STATE_SHAPE = (2, 1, 128)
+
+VAD_FRAMES = Counter("vad_frames_total", "VAD windows seen, by outcome", ["outcome"])
+VAD_STATE_RESETS = Counter("vad_state_resets_total", "Silero stream states reset because a run of gated windows ended")
+VAD_BATCHES = Counter("vad_batches_total", "Batched Silero forward passes")
+VAD_INFERENCE_SECONDS = Counter("vad_inference_seconds_total", "Wall time spent in batched Silero forward passes")
+
+
+class EnergyGate:
+    """
+    Cheap NumPy pre-gate in front of Silero, one per session.
+    A window is declared silence without touching torch when its RMS sits within
+    margin_db of an adaptive noise-floor estimate (or below digital silence), or
+    when it is a low-level hum with almost no zero crossings. The optional
+    spectral check lets quiet frames through if most of their energy sits in the
+    150-3400 Hz speech band. After any frame that Silero scores as speech, the
+    gate stays open for a hangover period so soft word endings are never clipped.
+    """
+    SILENCE_DB = -70.0       # Below this, a frame is silence regardless of the floor
+    SPEECH_PROB = 0.5        # Silero score that counts as speech for floor tracking
+    HANGOVER_WINDOWS = 8     # ~256ms of ungated frames after speech
+    FLOOR_RISE = 0.05        # Floor creeps up slowly on non-speech frames...
+    FLOOR_FALL = 0.5         # ...and drops quickly when the room gets quieter
+
+    def __init__(self, margin_db: float = VAD_PREGATE_MARGIN_DB, spectral: bool = VAD_PREGATE_SPECTRAL):
+        self.margin_db = margin_db
+        self.spectral = spectral
+        # Start low so the first words of a call are never gated while the floor settles
+        self.noise_floor_db = self.SILENCE_DB
+        self.hangover = 0
+        self.frames_seen = 0
+        self.frames_skipped = 0
+
+    def features(self, windows):
+        """Vectorized per-window features for an (N, 512) float32 array."""
+        rms = np.sqrt(np.mean(np.square(windows), axis=1))
+        rms_db = 20.0 * np.log10(rms + 1e-9)
+        signs = np.signbit(windows)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (windows.shape[1] - 1)
+        if self.spectral:
+            spectrum = np.square(np.abs(np.fft.rfft(windows, axis=1)))
+            freqs = np.fft.rfftfreq(windows.shape[1], 1.0 / SAMPLE_RATE)
+            band = (freqs >= 150) & (freqs <= 3400)
+            band_ratio = spectrum[:, band].sum(axis=1) / (spectrum.sum(axis=1) + 1e-12)
+        else:
+            band_ratio = np.full(windows.shape[0], np.nan)
+        return rms_db, zcr, band_ratio
+
+    def is_silence(self, rms_db: float, zcr: float, band_ratio: float):
+        """Decides one window; updates the noise floor when it is gated."""
+        self.frames_seen += 1
+        if self.hangover > 0:
+            self.hangover -= 1
+            return False
+
+        threshold = self.noise_floor_db + self.margin_db
+        silent = rms_db < self.SILENCE_DB or rms_db < threshold
+        if silent and self.spectral and band_ratio > 0.6 and zcr < 0.25:
+            silent = False  # Quiet but voiced-looking: let Silero decide
+        if not silent and zcr < 0.01 and rms_db < threshold + self.margin_db:
+            silent = True   # Mains hum / DC drift
+
+        if silent:
+            self.frames_skipped += 1
+            self._track_floor(rms_db)
+        return silent
+
+    def observe(self, rms_db: float, speech_prob: float):
+        """Feeds back Silero's verdict for a window the gate let through."""
+        if speech_prob >= self.SPEECH_PROB:
+            self.hangover = self.HANGOVER_WINDOWS
+        else:
+            self._track_floor(rms_db)
+
+    def _track_floor(self, rms_db: float):
+        rate = self.FLOOR_FALL if rms_db < self.noise_floor_db else self.FLOOR_RISE
+        self.noise_floor_db += rate * (max(rms_db, self.SILENCE_DB) - self.noise_floor_db)
+
+
+def resolve_vad_model_path():
+    """
+    Finds the Silero VAD TorchScript weights on local disk; never touches the network.
+    Order: VAD_MODEL_PATH, the artifact bundled with the silero-vad package, then
+    a torch.hub cache left behind by older versions of this app.
+    """
+    if VAD_MODEL_PATH:
+        if not os.path.isfile(VAD_MODEL_PATH):
+            raise FileNotFoundError(f"VAD_MODEL_PATH={VAD_MODEL_PATH} does not exist")
+        return VAD_MODEL_PATH
+
+    candidates = []
+    spec = importlib.util.find_spec("silero_vad")
+    if spec is not None and spec.submodule_search_locations:
+        candidates.append(os.path.join(spec.submodule_search_locations[0], "data", "silero_vad.jit"))
+    hub_dir = os.path.join(os.getenv("TORCH_HOME", os.path.expanduser("~/.cache/torch")), "hub")
+    candidates.append(os.path.join(hub_dir, "snakers4_silero-vad_master", "src", "silero_vad", "data", "silero_vad.jit"))
+
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError("Silero VAD weights not found: pip install silero-vad or set VAD_MODEL_PATH")
+
+
 class VADEngine:
-    def __init__(self):
-        self.model, utils = torch.hub.load(
-            repo_or_dir='snakers4/silero-vad',
-            model='silero_vad',
-            force_reload=False,
-            trust_repo=True
-        )
+    def __init__(self, model_path: str = None):
+        import torch
+        # Batches are small; more intra-op threads only contend with other workers
+        torch.set_num_threads(VAD_TORCH_THREADS)
+        self.model_path = model_path or resolve_vad_model_path()
+        self.model = torch.jit.load(self.model_path, map_location="cpu")
         self.model.eval()
-        print("✅ Silero VAD Loaded")
+        # Recurrent state for the standalone process() helper
+        self._state, self._context = self.initial_state()
+        print(f"✅ Silero VAD Loaded ({self.model_path})")
+
+    def warm_up(self):
+        """Runs a dummy window so the first caller doesn't pay for TorchScript's first-call optimization."""
+        state, context = self.initial_state()
+        for _ in range(2):
+            self.infer_batch(np.zeros((1, WINDOW_SAMPLES), dtype=np.float32), [state], [context])
+
+    @staticmethod
+    def initial_state():
+        """Fresh recurrent state for one stream: (LSTM state, audio context)."""
+        import torch
+        return torch.zeros(STATE_SHAPE), torch.zeros(1, CONTEXT_SAMPLES)
+
+    def infer_batch(self, windows, states, contexts):
+        """
+        Runs one forward pass over B independent streams.
+        windows: float32 array (B, 512); states/contexts: per-stream recurrent state.
+        Silero keeps its recurrent state on the module, so we load every stream's
+        state into it, run the batch, and slice the updated state back out.
+        Returns (probabilities, new_states, new_contexts).
+        """
+        import torch
+        batch_size = windows.shape[0]
+        with torch.no_grad():
+            self.model._state = torch.cat(states, dim=1)
+            self.model._context = torch.cat(contexts, dim=0)
+            self.model._last_sr = SAMPLE_RATE
+            self.model._last_batch_size = batch_size
+            probs = self.model(torch.from_numpy(windows), SAMPLE_RATE)[:, 0].tolist()
+            new_state = self.model._state
+            new_context = self.model._context
+        return (
+            probs,
+            [new_state[:, i:i + 1] for i in range(batch_size)],
+            [new_context[i:i + 1] for i in range(batch_size)],
+        )
 
     def process(self, pcm_int16_bytes):
-        """Processes raw 16-bit PCM audio directly from the browser."""
+        """Processes one 512-sample frame of raw 16-bit PCM (single stream, blocking)."""
         # Convert bytes directly to Int16 numpy array
         audio_int16 = np.frombuffer(pcm_int16_bytes, dtype=np.int16)
         # Normalize to Float32 for Silero
         audio_float32 = audio_int16.astype(np.float32) / 32768.0
-        
-        tensor = torch.from_numpy(audio_float32)
-        # We are now running at a high-quality 16000Hz sample rate!
-        speech_prob = self.model(tensor, 16000).item() 
-        return speech_prob
\ No newline at end of file
+
+        probs, states, contexts = self.infer_batch(audio_float32[None, :], [self._state], [self._context])
+        self._state, self._context = states[0], contexts[0]
+        return probs[0]
+
+
+class VADSession:
+    """
+    One caller's view of the shared VAD service.
+    Owns the Silero recurrent state for this stream, so concurrent callers never
+    share hidden state, and re-frames arbitrary chunk sizes into 512-sample windows.
+    Windows the energy gate skips never reach Silero, so its state and context
+    would describe audio from before the gap; the first window after a gated run
+    starts from a fresh state instead.
+    """
+    def __init__(self, service):
+        self.service = service
+        self.state, self.context = VADEngine.initial_state()
+        self.remainder = np.zeros(0, dtype=np.float32)
+        self.last_prob = 0.0
+        self.gate = EnergyGate() if VAD_PREGATE else None
+        self.gated = False  # The previous window was skipped by the gate
+
+    async def process(self, pcm_int16_bytes):
+        """Returns the highest speech probability among the complete windows in this chunk."""
+        audio = np.frombuffer(pcm_int16_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+        if self.remainder.size:
+            audio = np.concatenate((self.remainder, audio))
+
+        n_windows = audio.size // WINDOW_SAMPLES
+        self.remainder = audio[n_windows * WINDOW_SAMPLES:].copy()
+        if n_windows == 0:
+            return self.last_prob
+
+        windows = audio[:n_windows * WINDOW_SAMPLES].reshape(n_windows, WINDOW_SAMPLES)
+        if self.gate is not None:
+            rms_db, zcr, band_ratio = self.gate.features(windows)
+
+        best = 0.0
+        for i, window in enumerate(windows):
+            if self.gate is not None and self.gate.is_silence(rms_db[i], zcr[i], band_ratio[i]):
+                VAD_FRAMES.inc(outcome="skipped")
+                self.gated = True
+                continue
+            if self.gated:
+                self.state, self.context = VADEngine.initial_state()
+                self.gated = False
+                VAD_STATE_RESETS.inc()
+            # Windows of one stream are sequential (recurrent state); streams are batched
+            prob = await self.service.submit(self, window)
+            if self.gate is not None:
+                self.gate.observe(rms_db[i], prob)
+            best = max(best, prob)
+        self.last_prob = best
+        return best
+
+    def reset(self):
+        self.state, self.context = VADEngine.initial_state()
+        self.remainder = np.zeros(0, dtype=np.float32)
+        self.last_prob = 0.0
+        self.gated = False
+        if self.gate is not None:
+            self.gate = EnergyGate()
+
+
+class VADService:
+    """
+    Batches VAD windows from every active session.
+    The first pending window opens a short tick (VAD_TICK_MS); everything that
+    arrives within it runs as a single Silero forward pass on a dedicated worker
+    thread, and the probabilities are scattered back to the waiting sessions.
+    """
+    def __init__(self, engine: VADEngine, tick_ms: float = VAD_TICK_MS, max_batch: int = VAD_MAX_BATCH):
+        self.engine = engine
+        self.tick = tick_ms / 1000.0
+        self.max_batch = max_batch
+        self.pending = asyncio.Queue()
+        # One thread: batches must not interleave while the model holds their state
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vad")
+        self.runner = None
+
+        # Stats
+        self.frames_processed = 0
+        self.batches_run = 0
+        self.inference_seconds = 0.0
+
+    def create_session(self):
+        return VADSession(self)
+
+    async def start(self):
+        if self.runner is None:
+            self.runner = asyncio.create_task(self._run())
+            print(f"✅ VAD batching service running (tick {self.tick * 1000:.0f}ms, max batch {self.max_batch})")
+
+    async def stop(self):
+        if self.runner is not None:
+            self.runner.cancel()
+            self.runner = None
+        self.worker.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, session: VADSession, window):
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((session, window, future))
+        return await future
+
+    def stats(self):
+        return {
+            "frames_processed": self.frames_processed,
+            "frames_skipped": int(VAD_FRAMES.get(outcome="skipped")),
+            # Each gated run ends with a fresh Silero state, so it re-warms on the first frames after it
+            "state_resets": int(VAD_STATE_RESETS.get()),
+            "batches_run": self.batches_run,
+            "avg_batch_size": self.frames_processed / self.batches_run if self.batches_run else 0.0,
+            "avg_inference_us_per_frame": self.inference_seconds * 1e6 / self.frames_processed if self.frames_processed else 0.0,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            await asyncio.sleep(self.tick)
+            while len(batch) < self.max_batch and not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+
+            # Sessions whose caller hung up mid-tick no longer need an answer
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+
+            sessions = [session for session, _, _ in batch]
+            windows = np.stack([window for _, window, _ in batch])
+            started = time.perf_counter()
+            try:
+                probs, states, contexts = await loop.run_in_executor(
+                    self.worker,
+                    self.engine.infer_batch,
+                    windows,
+                    [session.state for session in sessions],
+                    [session.context for session in sessions],
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - started
+            self.inference_seconds += elapsed
+            VAD_INFERENCE_SECONDS.inc(elapsed)
+            self.frames_processed += len(batch)
+            self.batches_run += 1
+            VAD_FRAMES.inc(len(batch), outcome="inferred")
+            VAD_BATCHES.inc()
+
+            for (session, _, future), prob, state, context in zip(batch, probs, states, contexts):
+                session.state, session.context = state, context
+                if not future.done():
+                    future.set_result(prob)
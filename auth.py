@@ -1,10 +1,16 @@
 import os
+import time
+import hashlib
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 
+from config import AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL_S
+from metrics import Counter
+
 load_dotenv()
 
 # Secret settings
@@ -12,8 +18,11 @@ SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey123") # In prod, use a stron
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 3000 # Long expiry for convenience
 
+AUTH_TOKEN_LOOKUPS = Counter("auth_token_lookups_total", "Token checks by outcome (cached, verified, rejected)", ["outcome"])
+
 pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
 
+# Both take ~100ms of CPU: call them through executors.run_hashing, never on the event loop
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -30,9 +39,56 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+
+class TokenCache:
+    """
+    Bounded LRU of verified token subjects, keyed by the token's SHA-256.
+    An entry lives for at most `ttl` seconds and never past the token's "exp".
+    Only valid tokens are cached, so garbage tokens cannot push real ones out.
+    """
+    def __init__(self, size: int = AUTH_TOKEN_CACHE_SIZE, ttl: float = AUTH_TOKEN_CACHE_TTL_S):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # digest -> (subject, valid until as a Unix time)
+
+    def get(self, digest: bytes):
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            del self.entries[digest]
+            return None
+        self.entries.move_to_end(digest)
+        return entry[0]
+
+    def put(self, digest: bytes, subject: str, expires_at: Optional[float] = None):
+        if self.size <= 0:
+            return
+        valid_until = time.time() + self.ttl
+        if expires_at is not None:
+            valid_until = min(valid_until, expires_at)
+        self.entries[digest] = (subject, valid_until)
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+token_cache = TokenCache()
+
 def decode_token(token: str):
+    # Every authenticated request and WebSocket connect lands here; repeats skip the signature check
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    subject = token_cache.get(digest)
+    if subject is not None:
+        AUTH_TOKEN_LOOKUPS.inc(outcome="cached")
+        return subject
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub")
     except JWTError:
+        AUTH_TOKEN_LOOKUPS.inc(outcome="rejected")
         return None
+    subject = payload.get("sub")
+    if subject is not None:
+        token_cache.put(digest, subject, payload.get("exp"))
+    AUTH_TOKEN_LOOKUPS.inc(outcome="verified")
+    return subject
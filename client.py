@@ -1,13 +1,23 @@
+import os
+import sys
 import asyncio
 import websockets
 import json
 import base64
 import wave
-import audioop
+import numpy as np
+
+from audio_codecs import PolyphaseResampler, mulaw_encode, mulaw_decode
 
 FILE_1 = "test_speech.wav"
 FILE_2 = "interrupt.wav" # Ensure this file exists in your folder!
 
+# Telephony leg: 8kHz G.711 u-law in 20ms frames, like a Twilio media stream.
+# Get a token from POST /token and pass it as AGENT_TOKEN or the first argument.
+SERVER = os.getenv("AGENT_SERVER", "ws://localhost:8000")
+CODEC = "mulaw"
+OUT_RATE = 8000
+
 async def listen_to_server(websocket):
     """Background task to catch the AI's response."""
     ai_audio_buffer = bytearray()
@@ -15,17 +25,19 @@ async def listen_to_server(websocket):
         while True:
             data = await websocket.recv()
             message = json.loads(data)
-            
+
             if message.get("event") == "media":
                 payload = message["media"]["payload"]
                 chunk = base64.b64decode(payload)
-                pcm_chunk = audioop.ulaw2lin(chunk, 2)
+                pcm_chunk = mulaw_decode(chunk).tobytes()
                 ai_audio_buffer.extend(pcm_chunk)
-                
+
                 print("🔊", end="", flush=True)
-                
+            elif message.get("event") == "clear":
+                print("🛑", end="", flush=True)
+
     except websockets.exceptions.ConnectionClosed:
-        pass 
+        pass
     except Exception as e:
         print(f"\n❌ Listener Error: {e}")
     finally:
@@ -33,16 +45,16 @@ async def listen_to_server(websocket):
             with wave.open("server_response.wav", "wb") as wf:
                 wf.setnchannels(1)
                 wf.setsampwidth(2)
-                wf.setframerate(8000)
+                wf.setframerate(OUT_RATE)
                 wf.writeframes(ai_audio_buffer)
             print("\n💾 Saved combined AI responses to server_response.wav")
 
 async def send_silence(websocket, duration_seconds):
     """Helper to send exact amounts of telecom silence."""
     frames = int(duration_seconds / 0.02)
-    silence_bytes = b'\xff' * 160 
+    silence_bytes = b'\xff' * 160
     payload = base64.b64encode(silence_bytes).decode("utf-8")
-    
+
     for _ in range(frames):
         message = {"event": "media", "media": {"payload": payload}}
         await websocket.send(json.dumps(message))
@@ -53,70 +65,72 @@ async def stream_file(filename, websocket):
     try:
         wf = wave.open(filename, 'rb')
         in_rate = wf.getframerate()
-        out_rate = 8000
-        
-        print(f"\n🎵 Streaming {filename} (Sample Rate: {in_rate}Hz -> {out_rate}Hz)...")
-        chunk_size = int(in_rate * 0.02) 
-        rate_state = None
+        channels = wf.getnchannels()
+
+        print(f"\n🎵 Streaming {filename} (Sample Rate: {in_rate}Hz -> {OUT_RATE}Hz)...")
+        chunk_size = int(in_rate * 0.02)
+        resampler = PolyphaseResampler(in_rate, OUT_RATE)
 
         while True:
             frames = wf.readframes(chunk_size)
             if not frames:
                 break
 
-            if wf.getnchannels() == 2:
-                frames = audioop.tomono(frames, 2, 0.5, 0.5)
-            if in_rate != out_rate:
-                frames_8k, rate_state = audioop.ratecv(frames, 2, 1, in_rate, out_rate, rate_state)
-            else:
-                frames_8k = frames
+            samples = np.frombuffer(frames, dtype=np.int16)
+            if channels == 2:
+                samples = samples.reshape(-1, 2).mean(axis=1).astype(np.int16)
+            frames_8k = resampler.process(samples)
 
-            mu_law_data = audioop.lin2ulaw(frames_8k, 2)
+            mu_law_data = mulaw_encode(frames_8k).tobytes()
             payload = base64.b64encode(mu_law_data).decode("utf-8")
-            
+
             message = {"event": "media", "media": {"payload": payload}}
             await websocket.send(json.dumps(message))
-            await asyncio.sleep(0.02) 
+            await asyncio.sleep(0.02)
 
     except FileNotFoundError:
         print(f"\n❌ Error: Could not find '{filename}'. Did you create it?")
 
-async def run_barge_in_test():
-    uri = "ws://localhost:8000/ws"
-    
+async def run_barge_in_test(token):
+    uri = f"{SERVER}/ws/web?token={token}&codec={CODEC}"
+
     async with websockets.connect(uri) as websocket:
-        print(f"✅ Connected to Server at {uri}")
-        
+        print(f"✅ Connected to Server at {SERVER}/ws/web [{CODEC}]")
+
         # 1. Start the Ear
         asyncio.create_task(listen_to_server(websocket))
-        
+
         # 2. Send the first message
         await stream_file(FILE_1, websocket)
-        
+
         # 3. Trigger the AI to think and respond
         print("🤐 User went silent. Waiting for AI to process...")
         await send_silence(websocket, duration_seconds=1.5)
-        
+
         # 4. Give the AI time to generate TTS and start speaking
         print("⏳ Letting AI talk for a moment...")
         await send_silence(websocket, duration_seconds=2.0)
-        
+
         # 5. THE INTERRUPTION
         print("\n💥 BARGE-IN! User interrupts the AI mid-sentence!")
         await stream_file(FILE_2, websocket)
-        
+
         # 6. Trigger AI's second response
         print("🤐 User went silent again. Waiting for AI's reaction...")
         await send_silence(websocket, duration_seconds=1.5)
-        
+
         # 7. Stay on the line to hear the final response
         print("📞 Staying on the line for 5 seconds to catch audio...")
         await send_silence(websocket, duration_seconds=5.0)
-        
+
         print("\n📞 Test complete. Hanging up.")
 
 if __name__ == "__main__":
+    token = sys.argv[1] if len(sys.argv) > 1 else os.getenv("AGENT_TOKEN")
+    if not token:
+        print("❌ Pass an access token (from POST /token) as an argument or AGENT_TOKEN.")
+        sys.exit(1)
     try:
-        asyncio.run(run_barge_in_test())
+        asyncio.run(run_barge_in_test(token))
     except KeyboardInterrupt:
-        print("\n🛑 Stopped by user.")
\ No newline at end of file
+        print("\n🛑 Stopped by user.")
@@ -0,0 +1,161 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Turn pipeline: "streaming" speaks sentence-by-sentence while the LLM is still
+# generating, "batch" waits for the full reply before synthesizing it.
+TURN_MODE = os.getenv("TURN_MODE", "streaming")
+
+# Server processes: each worker loads its own VAD model and serves up to
+# MAX_SESSIONS_PER_WORKER calls; /health reports per-worker load.
+WORKERS = int(os.getenv("WORKERS", "1"))
+MAX_SESSIONS_PER_WORKER = int(os.getenv("MAX_SESSIONS_PER_WORKER", "50"))
+# Intra-op threads for the VAD forward pass; 1 keeps workers from fighting over cores
+VAD_TORCH_THREADS = int(os.getenv("VAD_TORCH_THREADS", "1"))
+
+# Upstream services: "groq" (Groq STT/LLM + edge-tts) or "stub" (local
+# stand-ins with synthetic delays, see stub_backend.py; for load tests and CI).
+BRAIN_BACKEND = os.getenv("BRAIN_BACKEND", "groq")
+STUB_STT_MS = float(os.getenv("STUB_STT_MS", "150"))
+STUB_LLM_FIRST_TOKEN_MS = float(os.getenv("STUB_LLM_FIRST_TOKEN_MS", "200"))
+STUB_LLM_TOKEN_MS = float(os.getenv("STUB_LLM_TOKEN_MS", "15"))
+STUB_TTS_FIRST_BYTE_MS = float(os.getenv("STUB_TTS_FIRST_BYTE_MS", "150"))
+STUB_TTS_SPEEDUP = float(os.getenv("STUB_TTS_SPEEDUP", "4"))  # MP3 bytes arrive this much faster than real time
+
+# Voice & models
+TTS_VOICE = os.getenv("TTS_VOICE", "en-US-ChristopherNeural")
+STT_MODEL = os.getenv("STT_MODEL", "whisper-large-v3")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+
+# TTS cache (tts_cache.py): decoded 16kHz PCM of short phrases, keyed on
+# normalized text, voice and output format. A phrase is admitted once it has
+# been synthesized TTS_CACHE_ADMIT_AFTER times; hits skip synthesis and decode.
+# TTS_CACHE_DIR adds an on-disk store shared by all workers (memory-mapped on
+# read); empty keeps the cache in memory only.
+TTS_CACHE_MEMORY_MB = float(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")
+TTS_CACHE_DISK_MB = float(os.getenv("TTS_CACHE_DISK_MB", "256"))
+TTS_CACHE_MAX_CHARS = int(os.getenv("TTS_CACHE_MAX_CHARS", "160"))  # Longer segments are never cached
+TTS_CACHE_ADMIT_AFTER = int(os.getenv("TTS_CACHE_ADMIT_AFTER", "2"))
+# Filler phrases ("|"-separated, e.g. "One moment.|Let me check.") are rendered
+# into the cache at start-up; one is played when a turn has produced no audio
+# TTS_FILLER_AFTER_MS after the user stopped talking. Empty: no fillers.
+TTS_FILLER_PHRASES = [p.strip() for p in os.getenv("TTS_FILLER_PHRASES", "").split("|") if p.strip()]
+TTS_FILLER_AFTER_MS = float(os.getenv("TTS_FILLER_AFTER_MS", "1500"))
+
+# Execution layer: blocking I/O runs on a bounded thread pool, CPU-bound
+# decode/NLP on a process pool, so no turn can starve other sessions' VAD.
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "16"))
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# Password hashing (argon2/bcrypt on /register and /token) gets its own small
+# thread pool, so a burst of logins queues there instead of on the shared pool.
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", "2"))
+# Verified JWT claims are cached per worker (keyed by token digest) for at most
+# AUTH_TOKEN_CACHE_TTL_S, and never past the token's own expiry.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL_S = float(os.getenv("AUTH_TOKEN_CACHE_TTL_S", "300"))
+# Max concurrent HTTP connections to Groq per worker
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32"))
+# Upstream scheduling per worker (upstream.py): concurrent calls per stage,
+# queued by priority and round-robin across users; HTTP 429s are retried with
+# jittered exponential backoff (or the server's Retry-After).
+UPSTREAM_STT_CONCURRENCY = int(os.getenv("UPSTREAM_STT_CONCURRENCY", "16"))
+UPSTREAM_LLM_CONCURRENCY = int(os.getenv("UPSTREAM_LLM_CONCURRENCY", "16"))
+UPSTREAM_TTS_CONCURRENCY = int(os.getenv("UPSTREAM_TTS_CONCURRENCY", "24"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE_MS = float(os.getenv("UPSTREAM_BACKOFF_BASE_MS", "250"))
+UPSTREAM_BACKOFF_MAX_MS = float(os.getenv("UPSTREAM_BACKOFF_MAX_MS", "4000"))
+
+# Silero VAD weights (TorchScript). Empty: use the copy bundled with the
+# silero-vad package. The model is always loaded from disk, never downloaded.
+VAD_MODEL_PATH = os.getenv("VAD_MODEL_PATH", "")
+
+# VAD batching: frames from all sessions arriving within one tick share a
+# single Silero forward pass.
+VAD_TICK_MS = float(os.getenv("VAD_TICK_MS", "4"))
+VAD_MAX_BATCH = int(os.getenv("VAD_MAX_BATCH", "256"))
+
+# VAD pre-gate: skip Silero on frames that are clearly silence.
+VAD_PREGATE = os.getenv("VAD_PREGATE", "1") == "1"
+VAD_PREGATE_SPECTRAL = os.getenv("VAD_PREGATE_SPECTRAL", "0") == "1"  # Adds a speech-band energy check
+VAD_PREGATE_MARGIN_DB = float(os.getenv("VAD_PREGATE_MARGIN_DB", "6"))  # Headroom above the noise floor
+
+# Debugging: when set, each turn's utterance and reply are written as WAV files
+# under DEBUG_AUDIO_DIR/<session id>/. Off by default; the pipeline itself never
+# touches the disk.
+DEBUG_AUDIO_DIR = os.getenv("DEBUG_AUDIO_DIR", "")
+# When set, every session's uplink frames, VAD probabilities and turn states are
+# logged to VAD_LOG_DIR/<session id>.vadlog for offline replay (vad_replay.py).
+VAD_LOG_DIR = os.getenv("VAD_LOG_DIR", "")
+
+# Storage: SQLite file (load tests point this at a scratch file), long-lived
+# connections for reads, one background writer that groups turn inserts into a
+# single transaction per batch.
+DB_PATH = os.getenv("DB_PATH", "storage.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "256"))
+DB_WRITE_INTERVAL_MS = float(os.getenv("DB_WRITE_INTERVAL_MS", "50"))
+# A batch that hits a locked database (another worker is writing) is retried
+# with exponential backoff before each queued turn is committed on its own.
+DB_WRITE_RETRIES = int(os.getenv("DB_WRITE_RETRIES", "3"))
+DB_WRITE_BACKOFF_MS = float(os.getenv("DB_WRITE_BACKOFF_MS", "100"))
+
+
+# Conversation context: each user's newest turns are cached in memory and
+# trimmed to an estimated token budget; the whole cache is capped across users.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_CACHE_MAX_TOKENS = int(os.getenv("CONTEXT_CACHE_MAX_TOKENS", "2000000"))
+CONTEXT_LOAD_ROWS = int(os.getenv("CONTEXT_LOAD_ROWS", "50"))  # Unsummarized rows loaded into the prompt (and folded per summary)
+
+# Rolling summarization: once a user has more than SUMMARY_TRIGGER_MESSAGES
+# verbatim turns in context, all but the newest SUMMARY_KEEP_MESSAGES are
+# folded into a per-user summary in the background after the reply is spoken.
+# Turns the token budget pushed out of the prompt are always folded first.
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "12"))
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "6"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", LLM_MODEL)
+
+# Analytics: a background pass folds new turns into per-hour aggregates, topic
+# counts and a sentiment series (analytics.py), so /analytics is a plain read.
+ANALYTICS_INTERVAL_MS = float(os.getenv("ANALYTICS_INTERVAL_MS", "2000"))
+ANALYTICS_BATCH = int(os.getenv("ANALYTICS_BATCH", "500"))  # Conversation rows per pass
+ANALYTICS_TOP_TOPICS = int(os.getenv("ANALYTICS_TOP_TOPICS", "10"))
+
+# Endpointing, in milliseconds of audio (independent of the client's frame size).
+ENDPOINT_SPEECH_PROB = float(os.getenv("ENDPOINT_SPEECH_PROB", "0.6"))  # VAD probability above which a frame counts as speech
+ENDPOINT_SPEECH_MS = float(os.getenv("ENDPOINT_SPEECH_MS", "60"))    # Speech that starts a user turn / barge-in
+ENDPOINT_SILENCE_MS = float(os.getenv("ENDPOINT_SILENCE_MS", "500"))  # Silence that ends a user turn
+# Speculative endpointing: after this much trailing silence STT starts on the
+# audio so far; it is discarded if the user resumes and committed at the full
+# silence threshold. 0 disables it. SPECULATIVE_LLM also opens the LLM stream early.
+ENDPOINT_SPECULATE_MS = float(os.getenv("ENDPOINT_SPECULATE_MS", "200"))
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "0") == "1"
+
+# Uplink buffering: the last PREROLL_MS of audio is kept in a ring and put in
+# front of each utterance (VAD only confirms speech after it started); an
+# utterance longer than MAX_UTTERANCE_MS is cut with a forced endpoint.
+PREROLL_MS = float(os.getenv("PREROLL_MS", "400"))
+MAX_UTTERANCE_MS = float(os.getenv("MAX_UTTERANCE_MS", "30000"))
+
+# Outbound audio: reply chunks are paced against a playback clock and sent at
+# most OUTBOUND_LEAD_MS ahead; at most OUTBOUND_MAX_QUEUED_MS waits server-side
+# before TTS is held back.
+OUTBOUND_CHUNK_MS = float(os.getenv("OUTBOUND_CHUNK_MS", "100"))
+OUTBOUND_LEAD_MS = float(os.getenv("OUTBOUND_LEAD_MS", "150"))
+OUTBOUND_MAX_QUEUED_MS = float(os.getenv("OUTBOUND_MAX_QUEUED_MS", "2000"))
+# Streaming turns: each segment's decoded PCM may run at most this far ahead of
+# the consumer before its TTS stream is paused, so the outbound backpressure
+# reaches the decoder instead of the whole reply piling up in memory.
+TTS_SEGMENT_BUFFER_MS = float(os.getenv("TTS_SEGMENT_BUFFER_MS", "1000"))
+
+# Echo-aware barge-in: uplink frames that correlate with the agent's own recent
+# output (within ECHO_MAX_DELAY_MS of playback-to-mic delay) and are almost all
+# echo (what is left after subtracting the aligned playback is at most
+# ECHO_MAX_RESIDUAL of the frame's energy) get a VAD probability of 0, so
+# playback leaking into the mic is not a barge-in. A user talking over the
+# agent leaves a large residual and keeps the full probability.
+ECHO_SUPPRESSION = os.getenv("ECHO_SUPPRESSION", "1") == "1"
+ECHO_MAX_DELAY_MS = float(os.getenv("ECHO_MAX_DELAY_MS", "500"))
+ECHO_MIN_CORRELATION = float(os.getenv("ECHO_MIN_CORRELATION", "0.4"))
+ECHO_MAX_RESIDUAL = float(os.getenv("ECHO_MAX_RESIDUAL", "0.25"))
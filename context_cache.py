@@ -0,0 +1,236 @@
+import asyncio
+from collections import OrderedDict
+
+from config import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_CACHE_MAX_TOKENS, CONTEXT_LOAD_ROWS,
+    SUMMARY_TRIGGER_MESSAGES, SUMMARY_KEEP_MESSAGES,
+)
+from metrics import Counter, Gauge
+from storage import storage
+
+CONTEXT_LOOKUPS = Counter("context_cache_lookups_total", "Conversation context lookups", ["outcome"])
+CONTEXT_TOKENS = Gauge("context_cache_tokens", "Estimated prompt tokens held by the context cache")
+
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators added by the chat template
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English); no tokenizer needed."""
+    return len(text) // 4 + 1 + MESSAGE_OVERHEAD_TOKENS
+
+
+class ConversationContext:
+    """
+    The newest turns of one user's conversation, trimmed to a token budget,
+    plus the rolling summary of everything before them. Turns trimmed out of
+    the budget wait in `pending` until compaction folds them into the summary.
+    """
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+        self.messages = []  # (message dict, tokens), oldest first
+        self.tokens = 0
+        self.sessions = 0   # Open WebSockets; pinned contexts are never evicted
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summary_rows = 0  # Rows the summary covers; pending[0] is the next one
+        self.pending = []  # Message dicts out of the prompt but not summarized yet, oldest first
+        self.first_row = 0  # Position of messages[0] in the user's full history
+        self.generation = 0  # Bumped on reset so in-flight compactions are discarded
+        self.compacting = False
+
+    def append(self, role: str, content: str):
+        tokens = estimate_tokens(content)
+        self.messages.append(({"role": role, "content": content}, tokens))
+        self.tokens += tokens
+        self._trim()
+
+    def history(self):
+        """Copy of the summary and cached turns, ready to prepend the system prompt to."""
+        history = []
+        if self.summary:
+            history.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        history.extend(dict(message) for message, _ in self.messages)
+        return history
+
+    def set_summary(self, summary: str, covered_rows: int):
+        """Replaces the summary with one covering the first covered_rows turns and drops those turns."""
+        del self.pending[:max(0, covered_rows - self.summary_rows)]
+        self.summary_rows = max(self.summary_rows, covered_rows)
+        while self.messages and self.first_row < covered_rows:
+            _, tokens = self.messages.pop(0)
+            self.tokens -= tokens
+            self.first_row += 1
+        self.tokens -= self.summary_tokens
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(summary) if summary else 0
+        self.tokens += self.summary_tokens
+
+    def clear(self):
+        self.messages.clear()
+        self.tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summary_rows = 0
+        self.pending.clear()
+        self.first_row = 0
+        self.generation += 1
+
+    def _trim(self):
+        # Safety net behind compaction: the oldest turns leave the prompt (the newest
+        # one always stays) and are summarized by the next compaction
+        while self.tokens > self.budget and len(self.messages) > 1:
+            message, tokens = self.messages.pop(0)
+            self.pending.append(message)
+            self.tokens -= tokens
+            self.first_row += 1
+
+
+class ContextCache:
+    """
+    Process-wide cache of conversation contexts keyed by user id.
+    A context is loaded from SQLite once (normally when the WebSocket connects),
+    then kept current in memory as turns complete, so a turn never queries the
+    database for its history. Contexts are evicted least-recently-used once the
+    total estimated tokens exceed max_tokens; contexts with an open session stay.
+    """
+    def __init__(self, max_tokens: int = CONTEXT_CACHE_MAX_TOKENS):
+        self.max_tokens = max_tokens
+        self.contexts = OrderedDict()
+        self.loading = {}
+        self.tokens = 0
+
+    async def acquire(self, user_id: int):
+        """Loads and pins the user's context for the lifetime of a session."""
+        context = self.contexts.get(user_id)
+        if context is not None and context.sessions == 0:
+            # The user may have talked to another worker since; start from the database
+            del self.contexts[user_id]
+            self._account(-context.tokens)
+        context = await self.get(user_id)
+        context.sessions += 1
+        return context
+
+    def release(self, user_id: int):
+        context = self.contexts.get(user_id)
+        if context is not None:
+            context.sessions = max(0, context.sessions - 1)
+            self._evict()
+
+    async def get(self, user_id: int):
+        context = self.contexts.get(user_id)
+        if context is not None:
+            CONTEXT_LOOKUPS.inc(outcome="hit")
+            self.contexts.move_to_end(user_id)
+            return context
+
+        # Concurrent misses for the same user share one load
+        pending = self.loading.get(user_id)
+        if pending is None:
+            CONTEXT_LOOKUPS.inc(outcome="miss")
+            pending = self.loading[user_id] = asyncio.ensure_future(self._load(user_id))
+            pending.add_done_callback(lambda _: self.loading.pop(user_id, None))
+        return await asyncio.shield(pending)
+
+    async def history(self, user_id: int):
+        return (await self.get(user_id)).history()
+
+    def append(self, user_id: int, role: str, content: str):
+        """Records a finished turn. A user with no cached context is left to the next load."""
+        context = self.contexts.get(user_id)
+        if context is None:
+            return
+        before = context.tokens
+        context.append(role, content)
+        self._account(context.tokens - before)
+        self.contexts.move_to_end(user_id)
+        self._evict()
+
+    def compaction_candidate(self, user_id: int):
+        """
+        Returns (context, generation, turns to fold, covered rows) when the user has
+        turns trimmed out of the prompt or more than SUMMARY_TRIGGER_MESSAGES verbatim
+        turns, otherwise None. Trimmed turns are folded first, at most
+        CONTEXT_LOAD_ROWS per summary; once none are left, all but the newest
+        SUMMARY_KEEP_MESSAGES verbatim turns are folded too.
+        """
+        context = self.contexts.get(user_id)
+        if context is None or context.compacting:
+            return None
+        turns = [dict(message) for message in context.pending[:CONTEXT_LOAD_ROWS]]
+        if len(turns) == len(context.pending) and len(context.messages) > SUMMARY_TRIGGER_MESSAGES:
+            fold = len(context.messages) - SUMMARY_KEEP_MESSAGES
+            turns.extend(dict(message) for message, _ in context.messages[:fold])
+        if not turns:
+            return None
+        # Only rows that are in `turns` count as covered
+        return context, context.generation, turns, context.summary_rows + len(turns)
+
+    def apply_summary(self, user_id: int, context: ConversationContext, generation: int, summary: str, covered_rows: int):
+        """Installs a finished summary. Returns False if the user's memory was reset meanwhile."""
+        if context.generation != generation:
+            return False
+        before = context.tokens
+        context.set_summary(summary, covered_rows)
+        if self.contexts.get(user_id) is context:
+            self._account(context.tokens - before)
+        return True
+
+    def reset(self, user_id: int):
+        """Forgets the user's turns (e.g. after /reset-memory) without unpinning open sessions."""
+        context = self.contexts.get(user_id)
+        if context is not None:
+            self._account(-context.tokens)
+            context.clear()
+
+    async def _load(self, user_id: int):
+        # Turns queued for the background writer must be visible to the query
+        try:
+            await storage.flush()
+        except Exception as e:
+            # Whatever failed is not in the database either way; load what is
+            print(f"⚠️ Loading context for user {user_id} after a failed write: {e!r}")
+        summary = await storage.fetchone("SELECT summary, covered_rows FROM conversation_summaries WHERE user_id = ?", (user_id,))
+        summary, covered_rows = summary or ("", 0)
+        # Every turn the summary does not cover yet; normally no more than compaction leaves behind
+        rows = await storage.fetchall(
+            "SELECT role, content FROM conversations WHERE user_id = ? ORDER BY timestamp, id LIMIT -1 OFFSET ?",
+            (user_id, covered_rows),
+        )
+        context = ConversationContext()
+        context.summary_rows = context.first_row = covered_rows
+        context.set_summary(summary, covered_rows)
+        # Only the newest CONTEXT_LOAD_ROWS are candidates for the prompt; older ones wait for compaction
+        older = max(0, len(rows) - CONTEXT_LOAD_ROWS)
+        context.pending = [{"role": role, "content": content} for role, content in rows[:older]]
+        context.first_row += older
+        for role, content in rows[older:]:
+            context.append(role, content)
+
+        # Another load may have finished first (e.g. after an eviction race)
+        existing = self.contexts.get(user_id)
+        if existing is not None:
+            return existing
+        self.contexts[user_id] = context
+        self._account(context.tokens)
+        self._evict()
+        return context
+
+    def _account(self, delta: int):
+        self.tokens += delta
+        CONTEXT_TOKENS.set(self.tokens)
+
+    def _evict(self):
+        if self.tokens <= self.max_tokens:
+            return
+        # The most recently used context is never the one to go
+        for user_id in list(self.contexts)[:-1]:
+            if self.tokens <= self.max_tokens:
+                break
+            context = self.contexts[user_id]
+            if context.sessions:
+                continue
+            del self.contexts[user_id]
+            self._account(-context.tokens)
+
+
+context_cache = ContextCache()
@@ -0,0 +1,29 @@
+"""
+CPU-bound jobs that run inside the process pool (see executors.py).
+Everything here must be a picklable top-level function, and heavy imports stay
+inside the functions so pool workers only pay for what they use.
+"""
+
+
+def sentiment_polarity(text: str):
+    """TextBlob polarity in [-1, 1]."""
+    from textblob import TextBlob
+    return TextBlob(text).sentiment.polarity
+
+
+def noun_phrases(text: str):
+    """TextBlob noun phrases, used for analytics topics."""
+    from textblob import TextBlob
+    return list(TextBlob(text).noun_phrases)
+
+
+def noun_phrases_many(texts):
+    """noun_phrases() for a batch of texts in one pool job."""
+    return [noun_phrases(text) for text in texts]
+
+
+def warm_up():
+    """Imports the NLP stack in a pool worker ahead of the first job."""
+    from textblob import TextBlob
+    TextBlob("warm up").sentiment
+    return True
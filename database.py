@@ -1,10 +1,36 @@
 import aiosqlite
 import asyncio
 
-DB_NAME = "storage.db"
+from config import DB_PATH
+
+DB_NAME = DB_PATH
+
+# Applied to every connection. WAL lets readers run while the background writer
+# commits; synchronous=NORMAL is durable across app crashes in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # 16MB page cache
+    "PRAGMA mmap_size=134217728",    # 128MB memory-mapped reads
+    "PRAGMA foreign_keys=ON",
+)
+
+async def configure_connection(db):
+    for pragma in PRAGMAS:
+        await db.execute(pragma)
+
+async def add_column(db, table: str, column: str, definition: str):
+    """Adds a column that databases created by an older version lack."""
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
 async def init_db():
     async with aiosqlite.connect(DB_NAME) as db:
+        await configure_connection(db)
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,10 +48,93 @@ async def init_db():
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 sentiment_score REAL,
                 latency_ms INTEGER,
+                turn_id TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        """)
+        # Shared with turn_traces.turn_id: both rows of a turn and its latency trace
+        await add_column(db, "conversations", "turn_id", "TEXT")
+
+        # Rolling summary of each user's older turns; covered_rows counts the
+        # user's conversations rows (oldest first) that it stands in for
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL,
+                covered_rows INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        """)
+
+        # Per-turn latency breakdown (see tracing.py); every stage is measured in
+        # ms from the moment the user stopped speaking
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS turn_traces (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                outcome TEXT NOT NULL,
+                total_ms INTEGER,
+                speech_end_detected_ms INTEGER,
+                stt_done_ms INTEGER,
+                llm_first_token_ms INTEGER,
+                tts_first_byte_ms INTEGER,
+                tts_first_pcm_ms INTEGER,
+                first_audio_sent_ms INTEGER,
+                turn_id TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        """)
+        await add_column(db, "turn_traces", "turn_id", "TEXT")
+
+        # Analytics, maintained incrementally by analytics.py. analytics_state
+        # holds the last conversations row folded in, so every row counts once
+        # (existing history is folded in on first start). Aggregates are per hour
+        # bucket ('YYYY-MM-DD HH:00:00', UTC, like CURRENT_TIMESTAMP).
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_conversation_id INTEGER NOT NULL
+            )
+        """)
+        await db.execute("INSERT OR IGNORE INTO analytics_state (id, last_conversation_id) VALUES (1, 0)")
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_hourly (
+                user_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                user_turns INTEGER NOT NULL DEFAULT 0,
+                sentiment_sum REAL NOT NULL DEFAULT 0,
+                sentiment_count INTEGER NOT NULL DEFAULT 0,
+                replies INTEGER NOT NULL DEFAULT 0,
+                latency_sum_ms INTEGER NOT NULL DEFAULT 0,
+                latency_count INTEGER NOT NULL DEFAULT 0,
+                latency_max_ms INTEGER,
+                PRIMARY KEY (user_id, bucket),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            ) WITHOUT ROWID
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_topics (
+                user_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, bucket, topic),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            ) WITHOUT ROWID
+        """)
+        # Sentiment time series, one point per user turn
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_sentiment (
+                conversation_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                score REAL NOT NULL,
                 FOREIGN KEY(user_id) REFERENCES users(id)
             )
         """)
-        
+
         # Migration for existing tables
         try:
             await db.execute("ALTER TABLE conversations ADD COLUMN sentiment_score REAL")
@@ -35,12 +144,19 @@ async def init_db():
             # Columns likely already exist
             pass
 
+        # History and analytics always filter by user and order by time
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_time ON conversations (user_id, timestamp, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_turn_traces_user_time ON turn_traces (user_id, created_at)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_turn_traces_turn ON turn_traces (turn_id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_analytics_sentiment_user_time ON analytics_sentiment (user_id, timestamp, conversation_id)")
+
         await db.commit()
-        await db.commit()
-        print("✅ Database initialized (storage.db)")
+        print(f"✅ Database initialized ({DB_NAME})")
 
 async def get_db_connection():
-    return await aiosqlite.connect(DB_NAME)
+    db = await aiosqlite.connect(DB_NAME)
+    await configure_connection(db)
+    return db
 
 if __name__ == "__main__":
     asyncio.run(init_db())
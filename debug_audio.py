@@ -0,0 +1,30 @@
+import os
+import wave
+
+from config import DEBUG_AUDIO_DIR
+from executors import run_blocking
+
+
+def _write_wav(path: str, pcm: bytes, sample_rate: int):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2) # 16-bit
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+
+
+class DebugAudioSpill:
+    """Optionally writes one session's per-turn audio to DEBUG_AUDIO_DIR/<session_id>/."""
+    def __init__(self, session_id: str, directory: str = DEBUG_AUDIO_DIR):
+        self.directory = os.path.join(directory, session_id) if directory else ""
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    async def save(self, turn_id: int, role: str, pcm, sample_rate: int = 16000):
+        if not self.enabled or not pcm:
+            return
+        path = os.path.join(self.directory, f"turn{turn_id:04d}_{role}.wav")
+        await run_blocking(_write_wav, path, bytes(pcm), sample_rate)
@@ -0,0 +1,129 @@
+import time
+import numpy as np
+
+from config import ECHO_MAX_DELAY_MS, ECHO_MIN_CORRELATION, ECHO_MAX_RESIDUAL
+from metrics import Counter
+
+SAMPLE_RATE = 16000
+HISTORY_SECONDS = 2.0   # Outbound audio kept for matching
+SEARCH_MARGIN = 800     # Samples searched around a locked delay (50ms)
+
+ECHO_FRAMES = Counter("echo_frames_total", "Uplink frames checked against the outbound echo reference, by outcome", ["outcome"])
+
+
+class EchoReference:
+    """
+    Server-side echo check for one session.
+    Every reply chunk is recorded on a sample timeline at the moment the client
+    is expected to play it. Each uplink frame is cross-correlated (FFT, NumPy)
+    against that timeline over 0..max_delay_ms of playback-to-mic delay. When the
+    best normalized correlation is high, the aligned reference (scaled to its
+    least-squares gain) is subtracted from the frame. Only if the residual is at
+    most max_residual of the frame's energy is the frame treated as pure echo and
+    its VAD probability gated to 0. A user talking over the agent (double talk)
+    leaves their own voice in the residual and keeps the full probability, so a
+    real barge-in is never weakened. The delay of confident matches is tracked so
+    later frames only search a narrow window around it.
+    """
+    def __init__(self, max_delay_ms: float = ECHO_MAX_DELAY_MS, min_correlation: float = ECHO_MIN_CORRELATION,
+                 max_residual: float = ECHO_MAX_RESIDUAL):
+        self.max_delay = int(max_delay_ms * SAMPLE_RATE / 1000)
+        self.min_correlation = min_correlation
+        self.max_residual = max_residual
+        self.size = int(HISTORY_SECONDS * SAMPLE_RATE)
+        self.ring = np.zeros(self.size, dtype=np.float32)
+        self.end = None          # Absolute sample index just past the newest reference sample
+        self.delay = None        # Smoothed playback-to-mic delay in samples, once locked
+        self.last_correlation = 0.0
+        self.last_residual = 1.0  # Share of the last frame's energy the echo did not explain
+
+    @staticmethod
+    def _index(t: float):
+        return int(round(t * SAMPLE_RATE))
+
+    def write(self, pcm16: bytes, play_at: float):
+        """Records an outbound chunk that the client starts playing at monotonic time play_at."""
+        samples = np.frombuffer(pcm16, dtype=np.int16).astype(np.float32)[-self.size:]
+        start = self._index(play_at)
+        if self.end is not None and start > self.end:
+            self._fill(self.end, np.zeros(min(start - self.end, self.size), dtype=np.float32))
+        self._fill(start, samples)
+        self.end = max(self.end or 0, start + len(samples))
+
+    def truncate(self, at: float):
+        """Forgets reference audio scheduled after `at` (the client was told to clear)."""
+        if self.end is None:
+            return
+        cut = self._index(at)
+        if cut < self.end:
+            self._fill(cut, np.zeros(min(self.end - cut, self.size), dtype=np.float32))
+            self.end = cut
+
+    def _fill(self, start: int, samples):
+        offset = start % self.size
+        first = min(len(samples), self.size - offset)
+        self.ring[offset:offset + first] = samples[:first]
+        if first < len(samples):
+            self.ring[:len(samples) - first] = samples[first:]
+
+    def _segment(self, start: int, end: int):
+        """Reference samples for absolute indices [start, end); zeros outside the history."""
+        out = np.zeros(end - start, dtype=np.float32)
+        lo = max(start, (self.end or 0) - self.size)
+        hi = min(end, self.end or 0)
+        if hi > lo:
+            idx = np.arange(lo, hi) % self.size
+            out[lo - start:hi - start] = self.ring[idx]
+        return out
+
+    def adjust(self, pcm16: bytes, speech_prob: float, received_at: float = None):
+        """Returns speech_prob, or 0 if the frame is (almost) only recent outbound audio."""
+        if self.end is None:
+            return speech_prob
+        mic = np.frombuffer(pcm16, dtype=np.int16).astype(np.float32)
+        n = len(mic)
+        frame_end = self._index(time.monotonic() if received_at is None else received_at)
+        if n == 0 or frame_end - n - self.max_delay >= self.end:
+            return speech_prob  # Nothing was playing during the searchable window
+
+        if self.delay is None:
+            min_delay, max_delay = 0, self.max_delay
+        else:
+            min_delay = max(0, self.delay - SEARCH_MARGIN)
+            max_delay = min(self.max_delay, self.delay + SEARCH_MARGIN)
+        # ref[k:k + n] lines up with the mic frame at delay max_delay - k
+        ref = self._segment(frame_end - n - max_delay, frame_end - min_delay)
+        mic_energy = float(np.dot(mic, mic))
+        if mic_energy <= 0.0 or not ref.any():
+            return speech_prob
+
+        size = 1 << int(len(ref) + n - 1).bit_length()
+        corr = np.fft.irfft(np.fft.rfft(ref, size) * np.conj(np.fft.rfft(mic, size)), size)[:len(ref) - n + 1]
+        energy = np.cumsum(np.concatenate(([0.0], np.square(ref, dtype=np.float64))))
+        window_energy = energy[n:] - energy[:-n]
+        # Lags where the reference is (near) digital silence cannot be echo
+        rho = np.where(window_energy > n, np.abs(corr) / np.sqrt(mic_energy * np.maximum(window_energy, 1.0)), 0.0)
+        best = int(np.argmax(rho))
+        correlation = float(rho[best])
+        self.last_correlation = correlation
+        self.last_residual = 1.0
+
+        if correlation < self.min_correlation:
+            ECHO_FRAMES.inc(outcome="passed")
+            if self.delay is not None and correlation < self.min_correlation / 2:
+                self.delay = None  # Lost the lock (e.g. the client changed output device)
+            return speech_prob
+
+        delay = max_delay - best
+        self.delay = delay if self.delay is None else int(0.8 * self.delay + 0.2 * delay)
+
+        # Subtract the echo as it reached the mic (least-squares gain at the best lag)
+        aligned = ref[best:best + n]
+        echo = aligned * (float(corr[best]) / max(float(window_energy[best]), 1.0))
+        residual = mic - echo
+        self.last_residual = float(np.dot(residual, residual)) / mic_energy
+        if self.last_residual > self.max_residual:
+            ECHO_FRAMES.inc(outcome="double_talk")
+            return speech_prob
+        ECHO_FRAMES.inc(outcome="suppressed")
+        return 0.0
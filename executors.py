@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from config import THREAD_POOL_SIZE, PROCESS_POOL_SIZE, PASSWORD_HASH_CONCURRENCY
+
+_thread_pool = None
+_process_pool = None
+_hash_pool = None
+
+
+def get_thread_pool():
+    """Bounded pool for blocking I/O (file access, sync SDKs)."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="blocking")
+    return _thread_pool
+
+
+def get_hash_pool():
+    """Small pool for password hashing: argon2/bcrypt release the GIL, but each call takes ~100ms of a core."""
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="hashing")
+    return _hash_pool
+
+
+def get_process_pool():
+    """Pool for CPU-bound work (MP3 decode, NLP) that would otherwise hold the GIL."""
+    global _process_pool
+    if _process_pool is None:
+        # forkserver: never fork a parent that already runs torch/aiosqlite threads
+        context = multiprocessing.get_context("forkserver")
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE, mp_context=context)
+    return _process_pool
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call on the thread pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def run_hashing(func, *args):
+    """Runs a password hash or verification off the event loop, at most PASSWORD_HASH_CONCURRENCY at a time."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_pool(), func, *args)
+
+
+async def run_cpu(func, *args):
+    """Runs a picklable CPU-bound function (see cpu_tasks.py) on the process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+
+def _noop():
+    return None
+
+
+async def start_executors(warm_up=_noop):
+    """
+    Creates both pools up front so the first caller doesn't pay for worker start-up.
+    warm_up (a picklable top-level function) runs once in every pool process.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(get_thread_pool())
+    pool = get_process_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, warm_up) for _ in range(PROCESS_POOL_SIZE)))
+    print(f"✅ Executors ready ({THREAD_POOL_SIZE} threads, {PROCESS_POOL_SIZE} processes)")
+
+
+def shutdown_executors():
+    global _thread_pool, _process_pool, _hash_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
@@ -1,96 +1,655 @@
 import os
+import re
+import random
 import asyncio
 import time
-import edge_tts
-import aiosqlite
-from groq import Groq
 from dotenv import load_dotenv
-from textblob import TextBlob
+
+from config import BRAIN_BACKEND, TTS_VOICE, TTS_FILLER_PHRASES, TTS_SEGMENT_BUFFER_MS, STT_MODEL, LLM_MODEL, SUMMARY_MODEL, UPSTREAM_MAX_CONNECTIONS
+from executors import run_blocking, run_cpu
+from audio_codecs import StreamingMp3Decoder, pcm16_to_wav
+from cpu_tasks import sentiment_polarity
+from metrics import Counter, Histogram
+from storage import storage
+from context_cache import context_cache
+from analytics import analytics
+from tts_cache import tts_cache, cache_key
+from upstream import upstream, PRIORITY_INTERACTIVE, PRIORITY_SPECULATIVE, PRIORITY_BACKGROUND
 
 load_dotenv()
 
+SYSTEM_PROMPT = "You are a witty, ultra-fast AI voice assistant. Keep your answers strictly under 2 sentences. Speak naturally. Do not use asterisks or formatting."
+
+SUMMARY_PROMPT = "You maintain the memory of a voice assistant. Merge the existing summary and the new conversation turns into one updated summary. Keep names, preferences, facts and open requests about the user. Write plain prose, at most 120 words, and reply with the summary only."
+
+# A sentence ends with terminal punctuation (plus optional closing quotes/brackets) followed by whitespace.
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s')
+# A clause ends with a comma, semicolon, colon or dash followed by whitespace.
+CLAUSE_END = re.compile(r'[,;:—]\s')
+# Words whose trailing period does not end a sentence.
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "vs", "etc", "e.g", "i.e", "approx"}
+
+PCM_CHUNK_BYTES = 6400  # 200ms of 16kHz 16-bit audio
+SEGMENT_QUEUE_CHUNKS = max(1, int(TTS_SEGMENT_BUFFER_MS // (PCM_CHUNK_BYTES / 32)))  # Decoded chunks a segment may hold ahead of playback
+
+TTS_FIRST_CHUNK = Histogram(
+    "tts_first_chunk_seconds", "Time from TTS request to the first decoded PCM chunk, per turn",
+    [0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0],
+)
+TTS_PEAK_BYTES = Histogram(
+    "tts_peak_buffered_bytes", "Peak MP3 + PCM bytes held in memory by TTS, per turn",
+    [16384, 65536, 131072, 262144, 524288, 1048576, 4194304],
+)
+
+SPECULATIVE_TURNS = Counter("speculative_turns_total", "Speculative STT/LLM starts by outcome", ["outcome"])
+
+
+class TtsTurnStats:
+    """
+    Per-turn TTS measurements: time to first PCM chunk and peak bytes held in memory.
+    First MP3 byte and first PCM chunk are also marked on the turn's trace, if any.
+    """
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.first_chunk_seconds = None
+        self.buffered = 0
+        self.peak = 0
+
+    def hold(self, nbytes: int):
+        self.buffered += nbytes
+        self.peak = max(self.peak, self.buffered)
+
+    def release(self, nbytes: int):
+        self.buffered -= nbytes
+
+    def first_byte(self):
+        if self.trace is not None:
+            self.trace.mark("tts_first_byte")
+
+    def first_chunk(self):
+        if self.trace is not None:
+            self.trace.mark("tts_first_pcm")
+        if self.first_chunk_seconds is None:
+            self.first_chunk_seconds = time.perf_counter() - self.started
+            TTS_FIRST_CHUNK.observe(self.first_chunk_seconds)
+
+    def finish(self):
+        TTS_PEAK_BYTES.observe(self.peak)
+        if self.first_chunk_seconds is not None:
+            print(f"📈 TTS first chunk {self.first_chunk_seconds * 1000:.0f}ms, peak buffer {self.peak / 1024:.0f}KB")
+
+
+class SentenceSegmenter:
+    """
+    Cuts a stream of LLM tokens into speakable segments.
+    Sentences are cut as soon as they end; long sentences are additionally cut at
+    clause boundaries so the first audio can start before the sentence is complete.
+    """
+    def __init__(self, min_sentence_chars=8, first_clause_chars=20, min_clause_chars=40):
+        self.min_sentence_chars = min_sentence_chars  # Avoids cutting on "Dr." or "Hi."
+        self.first_clause_chars = first_clause_chars  # Cut the very first segment early
+        self.min_clause_chars = min_clause_chars
+        self.buffer = ""
+        self.emitted = 0
+
+    def feed(self, text: str):
+        """Adds a token and returns every segment that is now complete."""
+        self.buffer += text
+        segments = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            segment = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:]
+            if segment:
+                segments.append(segment)
+                self.emitted += 1
+        return segments
+
+    def flush(self):
+        """Returns whatever is left once the LLM stream ends."""
+        segment = self.buffer.strip()
+        self.buffer = ""
+        if segment:
+            self.emitted += 1
+            return [segment]
+        return []
+
+    def _find_cut(self):
+        for match in SENTENCE_END.finditer(self.buffer):
+            if match.end() < self.min_sentence_chars:
+                continue
+            words = self.buffer[:match.start()].split()
+            if words and words[-1].lower() in ABBREVIATIONS:
+                continue
+            return match.end()
+
+        limit = self.first_clause_chars if self.emitted == 0 else self.min_clause_chars
+        if len(self.buffer) >= limit:
+            for match in CLAUSE_END.finditer(self.buffer):
+                if match.end() >= limit:
+                    return match.end()
+        return None
+
+
+class SpeculativeTurn:
+    """
+    STT (and optionally the LLM request) started on an utterance before the
+    endpoint is final. The turn either commits it by passing it to
+    process_turn/stream_turn, or calls cancel() when the user keeps talking.
+    """
+    def __init__(self, brain, utterance_wav, user_id: int, with_llm: bool = False):
+        self.brain = brain
+        self.user_id = user_id
+        # Nobody is waiting yet, so these queue behind turns that have already endpointed
+        self.transcript = asyncio.create_task(brain.transcribe(utterance_wav, user_id, PRIORITY_SPECULATIVE))
+        self.reply = asyncio.create_task(self._open_reply(user_id)) if with_llm else None
+        self.committed = False
+        self.cancelled = False
+
+    async def _open_reply(self, user_id: int):
+        history = await self.brain._load_history(user_id)
+        user_text = await asyncio.shield(self.transcript)
+        history.append({"role": "user", "content": user_text})
+        return await self.brain._open_reply_stream(history, user_id, PRIORITY_SPECULATIVE)
+
+    def commit(self):
+        self.committed = True
+        upstream.promote(self.user_id)
+        SPECULATIVE_TURNS.inc(outcome="committed")
+
+    def cancel(self):
+        """
+        Drops the speculative work; an LLM stream that was already opened is closed.
+        Safe to call more than once: whoever owns the speculation calls it when done.
+        """
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if not self.committed:
+            SPECULATIVE_TURNS.inc(outcome="discarded")
+        for task in (self.transcript, self.reply):
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None and task is self.reply:
+                self.brain._spawn(task.result().close())
+
+
 class BrainEngine:
-    def __init__(self):
-        # Groq client automatically picks up GROQ_API_KEY from your .env
-        self.client = Groq()
-        
-    async def process_turn(self, audio_file_path: str, user_id: int):
+    def __init__(self, backend: str = BRAIN_BACKEND):
+        # "groq" for the real services, "stub" for local stand-ins (stub_backend.py)
+        self.backend = backend
+        # Fire-and-forget persistence tasks (kept referenced until they finish)
+        self.background_tasks = set()
+        # user id -> _save_turns tasks that have not queued their rows yet
+        self.persisting = {}
+        self._async_client = None
+        # Pre-rendered filler phrases (memoryviews of cached PCM), see prerender_fillers()
+        self.fillers = []
+
+    @property
+    def async_client(self):
         """
-        Executes the STT -> LLM -> TTS pipeline with history.
+        Groq client, created (and the SDK imported) on first use or by warm_up().
+        It automatically picks up GROQ_API_KEY from your .env.
+        The async client keeps the event loop free and lets a barge-in cancel
+        in-flight STT/LLM requests.
+        Its connection pool is capped so a burst of turns queues instead of
+        opening unbounded sockets.
         """
-        start_time = time.time()
-        print(f"\n--- 🧠 COGNITIVE PIPELINE STARTED (User ID: {user_id}) ---")
-        
-        # 0. Load History
-        history = []
-        async with aiosqlite.connect("storage.db") as db:
-            async with db.execute("SELECT role, content FROM conversations WHERE user_id = ? ORDER BY timestamp ASC LIMIT 20", (user_id,)) as cursor:
-                rows = await cursor.fetchall()
-                for role, content in rows:
-                    history.append({"role": role, "content": content})
-        
-        # 1. STT: Whisper on Groq
-        print("👂 Transcribing audio...")
-        with open(audio_file_path, "rb") as file:
-            transcription = self.client.audio.transcriptions.create(
-              file=(audio_file_path, file.read()),
-              model="whisper-large-v3",
-              response_format="text"
+        if self._async_client is None and self.backend == "stub":
+            from stub_backend import StubGroqClient
+            self._async_client = StubGroqClient()
+        if self._async_client is None:
+            import httpx
+            from groq import AsyncGroq, DefaultAsyncHttpxClient
+            self._async_client = AsyncGroq(
+                # 429s are retried by the upstream scheduler, outside the concurrency slot
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS)
+                )
             )
+        return self._async_client
+
+    def warm_up(self):
+        """Pays for the SDK imports ahead of the first turn (blocking; run off the event loop)."""
+        if self.backend == "stub":
+            from stub_backend import mp3_clip
+            mp3_clip()
+        else:
+            import edge_tts  # noqa: F401
+        self.async_client
+        tts_cache.load_index()
+
+    @property
+    def voice(self):
+        """TTS voice, as part of the cache key (stub audio must never be served for the real voice)."""
+        return "stub" if self.backend == "stub" else TTS_VOICE
+
+    def _tts_chunks(self, text: str):
+        """edge-tts style stream of {"type": ..., "data": ...} chunks for `text`."""
+        if self.backend == "stub":
+            from stub_backend import tts_stream
+            return tts_stream(text)
+        import edge_tts
+        return edge_tts.Communicate(text, TTS_VOICE).stream()
+
+    async def _load_history(self, user_id: int):
+        # Served from memory; SQLite is only read the first time a user is seen
+        return await context_cache.history(user_id)
+
+    def speculate(self, utterance_wav, user_id: int, with_llm: bool = False):
+        """Starts transcribing (and optionally answering) an utterance that may not be over yet."""
+        return SpeculativeTurn(self, utterance_wav, user_id, with_llm)
+
+    def _spawn(self, coro):
+        """Runs coro as a fire-and-forget task, kept referenced until it finishes."""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+        return task
+
+    async def _user_text(self, utterance_wav, user_id: int, speculation):
+        """The committed speculative transcript if there is one, otherwise a fresh transcription."""
+        if speculation is not None:
+            speculation.commit()
+            try:
+                return await asyncio.shield(speculation.transcript)
+            except Exception as e:
+                print(f"⚠️ Speculative transcription failed ({e!r}), transcribing again")
+        return await self.transcribe(utterance_wav, user_id)
+
+    async def _open_reply_stream(self, history, user_id: int = None, priority: int = PRIORITY_INTERACTIVE):
+        """Opens a streaming completion; the returned stream holds an LLM slot until it is consumed or closed."""
+        return await upstream.call("llm", user_id, priority, lambda: self.async_client.chat.completions.create(
+            messages=self._build_messages(history),
+            model=LLM_MODEL,
+            stream=True,
+        ), hold=True)
+
+    async def transcribe(self, utterance_wav, user_id: int = None, priority: int = PRIORITY_INTERACTIVE):
+        print("👂 Transcribing audio...")
+        # Async client so a barge-in can cancel the upload mid-flight
+        transcription = await upstream.call("stt", user_id, priority, lambda: self.async_client.audio.transcriptions.create(
+          file=("utterance.wav", utterance_wav),
+          model=STT_MODEL,
+          response_format="text"
+        ))
         user_text = transcription.strip()
         print(f"👤 USER: \"{user_text}\"")
+        return user_text
 
-        # Analyze Sentiment
-        user_sentiment = TextBlob(user_text).sentiment.polarity
+    def _save_turns(self, user_id: int, user_text: str, ai_text: str, latency_ms: int, trace=None):
+        """
+        Persists the user and AI turns together once the reply exists.
+        Runs in the background: sentiment scoring and the insert never delay TTS,
+        and turns cancelled by a barge-in before this point never reach the database.
+        The in-memory context is updated right away so the next turn already sees them.
+        Both rows carry the trace's turn_id, which links them to its turn_traces row.
+        """
+        turn_id = trace.turn_id if trace is not None else None
+        context_cache.append(user_id, "user", user_text)
+        context_cache.append(user_id, "assistant", ai_text)
+
+        async def persist():
+            # Analyze Sentiment (CPU-bound NLP, off the event loop)
+            user_sentiment = await run_cpu(sentiment_polarity, user_text)
+            # One group: both rows of the turn are written, or neither
+            storage.enqueue_many([
+                ("INSERT INTO conversations (user_id, role, content, sentiment_score, turn_id) VALUES (?, ?, ?, ?, ?)", (user_id, "user", user_text, user_sentiment, turn_id)),
+                ("INSERT INTO conversations (user_id, role, content, latency_ms, turn_id) VALUES (?, ?, ?, ?, ?)", (user_id, "assistant", ai_text, latency_ms, turn_id)),
+            ])
+            # Topics and aggregates are folded in by the analytics worker
+            analytics.notify()
+
+        task = self._spawn(persist())
+        pending = self.persisting.setdefault(user_id, set())
+        pending.add(task)
+
+        def done(task):
+            pending.discard(task)
+            if not pending and self.persisting.get(user_id) is pending:
+                del self.persisting[user_id]
+        task.add_done_callback(done)
+
+    async def wait_persisted(self, user_id: int):
+        """Waits until every turn of the user that has finished is queued for the database."""
+        pending = self.persisting.get(user_id)
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def schedule_compaction(self, user_id: int):
+        """
+        Folds older turns into the user's rolling summary in the background.
+        Called once the reply has been spoken, so it never competes with a live turn.
+        """
+        candidate = context_cache.compaction_candidate(user_id)
+        if candidate is None:
+            return
+        context, generation, turns, covered_rows = candidate
+        context.compacting = True
+
+        async def compact():
+            try:
+                transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+                completion = await upstream.call("llm", user_id, PRIORITY_BACKGROUND, lambda: self.async_client.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": f"Existing summary: {context.summary or '(none)'}\n\nNew turns:\n{transcript}"},
+                    ],
+                    model=SUMMARY_MODEL,
+                ))
+                summary = completion.choices[0].message.content.strip()
+                if context_cache.apply_summary(user_id, context, generation, summary, covered_rows):
+                    storage.enqueue(
+                        "INSERT INTO conversation_summaries (user_id, summary, covered_rows) VALUES (?, ?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET summary = excluded.summary, covered_rows = excluded.covered_rows, updated_at = CURRENT_TIMESTAMP",
+                        (user_id, summary, covered_rows),
+                    )
+                    print(f"🗜️ Folded {len(turns)} turns into the summary for user {user_id}")
+            except Exception as e:
+                print(f"❌ Summarization failed for user {user_id}: {e!r}")
+            finally:
+                context.compacting = False
+
+        self._spawn(compact())
+
+    def _build_messages(self, history):
+        return [{"role": "system", "content": SYSTEM_PROMPT}] + history
 
-        # Save User Turn
-        async with aiosqlite.connect("storage.db") as db:
-            await db.execute("INSERT INTO conversations (user_id, role, content, sentiment_score) VALUES (?, ?, ?, ?)", (user_id, "user", user_text, user_sentiment))
-            await db.commit()
-            
+    async def process_turn(self, utterance_wav, user_id: int, speculation: SpeculativeTurn = None, trace=None):
+        """
+        Executes the STT -> LLM -> TTS pipeline with history.
+        utterance_wav is an in-memory WAV file (see audio_codecs.pcm16_to_wav).
+        A committed speculation supplies the transcript that is already in flight.
+        Stage timings are marked on `trace` (a tracing.TurnTrace), if given.
+        """
+        start_time = time.time()
+        print(f"\n--- 🧠 COGNITIVE PIPELINE STARTED (User ID: {user_id}) ---")
+
+        try:
+            # 0. Load History (newest turns, within the token budget)
+            history = await self._load_history(user_id)
+
+            # 1. STT: Whisper on Groq (possibly started during trailing silence)
+            user_text = await self._user_text(utterance_wav, user_id, speculation)
+            if trace is not None:
+                trace.mark("stt_done")
+        finally:
+            if speculation is not None:
+                speculation.cancel()  # Batch mode never uses a speculative LLM stream
         history.append({"role": "user", "content": user_text})
 
         # 2. LLM: Llama 3 on Groq
         print("⚡ Generating response...")
-        
-        messages = [
-            {
-                "role": "system",
-                "content": "You are a witty, ultra-fast AI voice assistant. Keep your answers strictly under 2 sentences. Speak naturally. Do not use asterisks or formatting."
-            }
-        ] + history
-
-        chat_completion = self.client.chat.completions.create(
-            messages=messages,
-            model="llama-3.1-8b-instant",
-        )
+        chat_completion = await upstream.call("llm", user_id, PRIORITY_INTERACTIVE, lambda: self.async_client.chat.completions.create(
+            messages=self._build_messages(history),
+            model=LLM_MODEL,
+        ))
         ai_text = chat_completion.choices[0].message.content.strip()
+        if trace is not None:
+            trace.mark("llm_first_token")  # Not streamed: the whole reply arrives at once
         print(f"🤖 AI: \"{ai_text}\"")
 
         # Calculate Latency
         end_time = time.time()
         latency_ms = int((end_time - start_time) * 1000)
 
-        # Save AI Turn
-        async with aiosqlite.connect("storage.db") as db:
-            await db.execute("INSERT INTO conversations (user_id, role, content, latency_ms) VALUES (?, ?, ?, ?)", (user_id, "assistant", ai_text, latency_ms))
-            await db.commit()
+        # Save both turns (in the background)
+        self._save_turns(user_id, user_text, ai_text, latency_ms, trace)
 
-        # 3. TTS: Microsoft Edge Neural Voices
+        # 3. TTS: Microsoft Edge Neural Voices, decoded in-process as it streams
         print("🗣️ Synthesizing voice...")
-        output_file = "ai_response.mp3"
-        communicate = edge_tts.Communicate(ai_text, "en-US-ChristopherNeural")
-        await communicate.save(output_file)
-        
-        print("✅ Pipeline Complete. Response saved to ai_response.mp3\n")
-        
-        return user_text, ai_text, output_file
+        print("✅ Pipeline Complete. Streaming audio...\n")
+
+        return user_text, ai_text, self.synthesize_stream(ai_text, TtsTurnStats(trace), owns_stats=True, user_id=user_id)
+
+    async def synthesize_stream(self, text: str, stats: TtsTurnStats = None, owns_stats: bool = None, user_id: int = None,
+                                priority: int = PRIORITY_INTERACTIVE):
+        """
+        Streams TTS for `text` as 16kHz mono PCM16 chunks of ~200ms.
+        Short phrases are served from the TTS cache (tts_cache.py) when present,
+        as zero-copy memoryview slices; otherwise MP3 bytes from edge-tts are
+        decoded incrementally in memory as they arrive, and a phrase that has
+        been said often enough is stored once its stream completes.
+        The edge-tts stream holds a TTS slot (upstream.py) for its whole length.
+        """
+        if owns_stats is None:
+            owns_stats = stats is None
+        if stats is None:
+            stats = TtsTurnStats()
+        key = cache_key(text, self.voice) if tts_cache.cacheable(text) else None
+        cached = await tts_cache.get(key) if key is not None else None
+        if cached is not None:
+            try:
+                stats.first_byte()
+                for i in range(0, len(cached), PCM_CHUNK_BYTES):
+                    stats.first_chunk()
+                    yield cached[i:i + PCM_CHUNK_BYTES]
+            finally:
+                if owns_stats:
+                    stats.finish()
+            return
+
+        rendered = bytearray() if key is not None and tts_cache.admit(key) else None
+        decoder = StreamingMp3Decoder()
+        pending = bytearray()
+        try:
+            async for chunk in upstream.stream("tts", user_id, priority, lambda: self._tts_chunks(text)):
+                if chunk["type"] != "audio":
+                    continue
+                data = chunk["data"]
+                stats.first_byte()
+                stats.hold(len(data))
+                pcm = await run_blocking(decoder.feed, data)
+                stats.release(len(data))
+                stats.hold(len(pcm))
+                pending.extend(pcm)
+                if len(pending) >= PCM_CHUNK_BYTES:
+                    stats.first_chunk()
+                    stats.release(len(pending))
+                    if rendered is not None:
+                        rendered.extend(pending)
+                    yield bytes(pending)
+                    pending.clear()
+
+            tail = await run_blocking(decoder.flush)
+            stats.hold(len(tail))
+            pending.extend(tail)
+            if rendered is not None:
+                # Only a stream that ran to the end is a complete phrase
+                rendered.extend(pending)
+                tts_cache.put(key, bytes(rendered))
+            if pending:
+                stats.first_chunk()
+                stats.release(len(pending))
+                yield bytes(pending)
+        finally:
+            if owns_stats:
+                stats.finish()
+
+    async def prerender_fillers(self, phrases=TTS_FILLER_PHRASES):
+        """Renders the filler phrases into the TTS cache (pinned) so filler() can play them instantly."""
+        for phrase in phrases:
+            key = cache_key(phrase, self.voice)
+            try:
+                pcm = await tts_cache.get(key)
+                if pcm is None:
+                    pcm = b"".join([chunk async for chunk in self.synthesize_stream(phrase, priority=PRIORITY_BACKGROUND)])
+                tts_cache.put(key, pcm, pin=True)
+                if pcm:
+                    self.fillers.append(memoryview(pcm))
+            except Exception as e:
+                print(f"⚠️ Filler \"{phrase}\" not rendered: {e!r}")
+        if self.fillers:
+            print(f"💬 {len(self.fillers)} filler phrases ready")
+
+    def filler(self):
+        """PCM of a random pre-rendered filler phrase, or None if there are none."""
+        return random.choice(self.fillers) if self.fillers else None
+
+    def _start_segment(self, text: str, stats: TtsTurnStats, user_id: int = None):
+        """
+        Starts synthesizing one segment in the background; returns (task, chunk queue).
+        The queue is bounded, so a segment that runs ahead of playback stops
+        pulling (and decoding) from its TTS stream until the consumer catches up.
+        None marks the end of the segment (the task holds any TTS error).
+        """
+        chunks = asyncio.Queue(maxsize=SEGMENT_QUEUE_CHUNKS)
+
+        async def run():
+            try:
+                async for pcm in self.synthesize_stream(text, stats, user_id=user_id):
+                    # Held until the consumer takes it, so it counts towards peak memory
+                    stats.hold(len(pcm))
+                    await chunks.put(pcm)
+            except asyncio.CancelledError:
+                raise  # The consumer is gone; nobody waits for the end marker
+            except BaseException:
+                await chunks.put(None)
+                raise
+            await chunks.put(None)
+
+        return asyncio.create_task(run()), chunks
+
+    async def stream_turn(self, utterance_wav, user_id: int, speculation: SpeculativeTurn = None, trace=None):
+        """
+        Streaming variant of process_turn.
+        Yields ("user_text", str), then ("audio", pcm_bytes) chunks of every
+        segment in order as soon as they are decoded, and finally ("ai_text", str).
+        Each segment is sent to TTS the moment it is cut, so later sentences are
+        still being generated and synthesized while the first one is playing.
+        A committed speculation supplies the transcript and, if it opened one,
+        the LLM stream that are already in flight.
+        Stage timings are marked on `trace` (a tracing.TurnTrace), if given.
+        """
+        start_time = time.time()
+        print(f"\n--- 🧠 STREAMING PIPELINE STARTED (User ID: {user_id}) ---")
+
+        try:
+            history = await self._load_history(user_id)
+            user_text = await self._user_text(utterance_wav, user_id, speculation)
+            if trace is not None:
+                trace.mark("stt_done")
+            yield "user_text", user_text
+        except BaseException:
+            # Includes the consumer closing us at the yield (GeneratorExit)
+            if speculation is not None:
+                speculation.cancel()
+            raise
+
+        history.append({"role": "user", "content": user_text})
+
+        # Ordered queue of (task, chunk queue) per segment, followed by the full
+        # reply text (or the LLM error)
+        tts_tasks = asyncio.Queue()
+        stats = TtsTurnStats(trace)
+        started_segments = []
+
+        async def generate():
+            try:
+                print("⚡ Streaming response...")
+                segmenter = SentenceSegmenter()
+                reply_parts = []
+                stream = None
+                if speculation is not None and speculation.reply is not None:
+                    try:
+                        stream = await asyncio.shield(speculation.reply)
+                    except Exception as e:
+                        print(f"⚠️ Speculative LLM request failed ({e!r}), asking again")
+                if stream is None:
+                    stream = await self._open_reply_stream(history, user_id)
+                async for chunk in stream:
+                    token = chunk.choices[0].delta.content if chunk.choices else None
+                    if not token:
+                        continue
+                    if trace is not None and not reply_parts:
+                        trace.mark("llm_first_token")
+                    reply_parts.append(token)
+                    for segment in segmenter.feed(token):
+                        await tts_tasks.put(self._start_segment(segment, stats, user_id))
+                for segment in segmenter.flush():
+                    await tts_tasks.put(self._start_segment(segment, stats, user_id))
+
+                ai_text = "".join(reply_parts).strip()
+                print(f"🤖 AI: \"{ai_text}\"")
+                latency_ms = int((time.time() - start_time) * 1000)
+                self._save_turns(user_id, user_text, ai_text, latency_ms, trace)
+                await tts_tasks.put(ai_text)
+            except Exception as e:
+                await tts_tasks.put(e)
+
+        generator_task = asyncio.create_task(generate())
+        try:
+            while True:
+                item = await tts_tasks.get()
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, str):
+                    yield "ai_text", item
+                    break
+                segment_task, chunks = item
+                started_segments.append(segment_task)
+                while (pcm_bytes := await chunks.get()) is not None:
+                    stats.release(len(pcm_bytes))
+                    yield "audio", pcm_bytes
+                segment_task.result()  # Re-raise TTS errors
+            print("✅ Streaming Pipeline Complete.\n")
+        finally:
+            # Stop generating and synthesizing if the caller walked away (e.g. barge-in)
+            generator_task.cancel()
+            if speculation is not None:
+                speculation.cancel()
+            for segment_task in started_segments:
+                segment_task.cancel()
+            while not tts_tasks.empty():
+                item = tts_tasks.get_nowait()
+                if isinstance(item, tuple):
+                    item[0].cancel()
+            stats.finish()
 
 # Quick standalone test block
 if __name__ == "__main__":
-    # If you run this file directly, it will test the pipeline using your last captured utterance.
-    brain = BrainEngine()
-    if os.path.exists("captured_utterance.wav"):
-        asyncio.run(brain.process_turn("captured_utterance.wav"))
+    # If you run this file directly, it will test the pipeline on a PCM16 WAV (default: test_speech.wav),
+    # downmixed to mono and resampled to 16kHz like the uplink.
+    import sys
+    import wave
+    import numpy as np
+    from audio_codecs import PolyphaseResampler, PIPELINE_RATE
+    path = sys.argv[1] if len(sys.argv) > 1 else "test_speech.wav"
+    if os.path.exists(path):
+        with wave.open(path, "rb") as wf:
+            if wf.getsampwidth() != 2:
+                sys.exit(f"❌ {path} is not 16-bit PCM.")
+            channels, rate = wf.getnchannels(), wf.getframerate()
+            samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        if rate != PIPELINE_RATE:
+            samples = PolyphaseResampler(rate, PIPELINE_RATE).process(samples)
+        pcm = samples.tobytes()
+        brain = BrainEngine()
+
+        async def main():
+            await storage.start()
+            try:
+                # Turns are stored for the first account (foreign keys are on); a fresh database gets a demo one
+                row = await storage.fetchone("SELECT id FROM users ORDER BY id LIMIT 1")
+                user_id = row[0] if row else await storage.execute(
+                    "INSERT INTO users (email, password_hash) VALUES (?, ?)", ("demo@localhost", "!"))
+                user_text, ai_text, pcm_stream = await brain.process_turn(pcm16_to_wav(pcm), user_id)
+                async for _ in pcm_stream:
+                    pass
+                # Let the background insert of the turn reach the writer
+                await asyncio.gather(*brain.background_tasks)
+            finally:
+                await storage.close()
+
+        asyncio.run(main())
     else:
-        print("❌ No captured_utterance.wav found. Run main.py and client.py first!")
\ No newline at end of file
+        print(f"❌ No {path} found. Pass a PCM16 WAV file.")
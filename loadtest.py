@@ -0,0 +1,327 @@
+"""
+Offline load test for /ws/web.
+
+Opens many concurrent sessions (binary frames, 16kHz PCM16) that each replay
+test_speech.wav at real-time pace, wait for the reply, barge in with
+interrupt.wav and wait for the second reply. Reports time-to-first-audio and
+barge-in reaction percentiles measured on the client, plus VAD CPU per frame
+and event-loop lag scraped from the server's /metrics.
+
+With --spawn the server is started locally with BRAIN_BACKEND=stub and a
+scratch database, so the whole run needs no network access:
+
+    python loadtest.py --spawn --sessions 200 --max-ttfa-p95-ms 1500
+
+Exits non-zero when a --max-* threshold is exceeded or sessions fail, for CI.
+"""
+import os
+import sys
+import json
+import time
+import wave
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+import httpx
+import websockets
+
+from audio_codecs import CODECS, PolyphaseResampler
+from protocol import pack_audio
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000 * 2
+CODEC_ID = CODECS["pcm16_16k"].id
+SILENCE = bytes(FRAME_BYTES)
+PASSWORD = "loadtest-password"
+
+
+def load_frames(path: str):
+    """Reads a WAV file as 20ms frames of 16kHz mono PCM16."""
+    with wave.open(path, "rb") as wf:
+        rate, channels = wf.getframerate(), wf.getnchannels()
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    if channels == 2:
+        samples = samples.reshape(-1, 2).mean(axis=1).astype(np.int16)
+    if rate != SAMPLE_RATE:
+        samples = PolyphaseResampler(rate, SAMPLE_RATE).process(samples)
+    pcm = samples.astype(np.int16).tobytes()
+    pcm += bytes(-len(pcm) % FRAME_BYTES)
+    return [pcm[i:i + FRAME_BYTES] for i in range(0, len(pcm), FRAME_BYTES)]
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"count": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+
+class Session:
+    """
+    One simulated caller. A sender task streams a frame every 20ms for the whole
+    call (queued speech, otherwise silence) so the server's endpointing sees a
+    continuous microphone; a receiver task timestamps reply audio and events.
+    """
+    def __init__(self, uri: str, speech, interrupt, barge_after: float, reply_timeout: float):
+        self.uri = uri
+        self.speech = speech
+        self.interrupt = interrupt
+        self.barge_after = barge_after
+        self.reply_timeout = reply_timeout
+        self.pending = []
+        self.spoken = None
+        self.audio = asyncio.Event()
+        self.cleared = asyncio.Event()
+        self.cleared_at = None
+        self.last_audio = 0.0
+        self.results = {}
+
+    async def _send(self, ws):
+        sequence = 0
+        next_at = time.monotonic()
+        while True:
+            if self.pending:
+                frame = self.pending.pop(0)
+                if not self.pending:
+                    self.spoken.set_result(time.monotonic())
+            else:
+                frame = SILENCE
+            await ws.send(pack_audio(sequence, sequence * FRAME_MS, CODEC_ID, frame))
+            sequence += 1
+            next_at += FRAME_MS / 1000
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    async def _receive(self, ws):
+        async for message in ws:
+            if isinstance(message, bytes):
+                self.last_audio = time.monotonic()
+                self.audio.set()
+            elif json.loads(message).get("event") == "clear" and self.cleared_at is None:
+                self.cleared_at = time.monotonic()
+                self.cleared.set()
+
+    async def say(self, frames):
+        """Queues an utterance; returns the times its first and last frames were sent."""
+        self.spoken = asyncio.get_running_loop().create_future()
+        started = time.monotonic()
+        self.pending = list(frames)
+        return started, await self.spoken
+
+    async def first_audio_after(self, since: float):
+        self.audio.clear()
+        await asyncio.wait_for(self.audio.wait(), self.reply_timeout)
+        return self.last_audio - since
+
+    async def run(self):
+        async with websockets.connect(self.uri, max_size=None) as ws:
+            tasks = [asyncio.create_task(self._send(ws)), asyncio.create_task(self._receive(ws))]
+            try:
+                _, speech_end = await self.say(self.speech)
+                self.results["ttfa"] = await self.first_audio_after(speech_end)
+
+                # Let the reply play for a while, then talk over it
+                await asyncio.sleep(self.barge_after)
+                self.cleared_at = None
+                self.cleared.clear()
+                barge_start, barge_end = await self.say(self.interrupt)
+                # The clear normally arrives while the interrupt is still streaming
+                await asyncio.wait_for(self.cleared.wait(), max(0.001, barge_start + self.reply_timeout - time.monotonic()))
+                self.results["barge_in"] = self.cleared_at - barge_start
+                self.results["ttfa_after_barge_in"] = await self.first_audio_after(barge_end)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.05):
+    """Client-side loop lag: if this grows, the client, not the server, is the bottleneck."""
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.monotonic() - expected))
+
+
+async def get_tokens(http: httpx.AsyncClient, count: int, concurrency: int = 8):
+    """Registers (or reuses) loadtest-N accounts and logs them in."""
+    limit = asyncio.Semaphore(concurrency)
+
+    async def token(i):
+        credentials = {"email": f"loadtest-{i}@loadtest.local", "password": PASSWORD}
+        async with limit:
+            await http.post("/register", json=credentials)  # 400 if it already exists
+            response = await http.post("/token", json=credentials)
+            response.raise_for_status()
+            return response.json()["access_token"]
+
+    return await asyncio.gather(*(token(i) for i in range(count)))
+
+
+async def wait_ready(http: httpx.AsyncClient, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await http.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise TimeoutError(f"Server not ready after {timeout:.0f}s")
+
+
+def parse_metrics(text: str):
+    """Prometheus text -> {(name, frozenset(labels)): value}."""
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, _, value = line.rpartition(" ")
+        name, _, labels = series.partition("{")
+        pairs = [pair.split("=", 1) for pair in labels.rstrip("}").split(",") if pair]
+        values[(name, frozenset((k, v.strip('"')) for k, v in pairs))] = float(value)
+    return values
+
+
+def server_report(metrics: dict):
+    def value(name, **labels):
+        return metrics.get((name, frozenset(labels.items())), 0.0)
+
+    frames = value("vad_frames_total", outcome="inferred")
+    skipped = value("vad_frames_total", outcome="skipped")
+    return {
+        "vad_us_per_inferred_frame": round(value("vad_inference_seconds_total") / frames * 1e6, 1) if frames else None,
+        "vad_frames_inferred": frames,
+        "vad_frames_skipped": skipped,
+        "event_loop_lag_ms": {f"p{int(q * 100)}": round(value("event_loop_lag_seconds", quantile=str(q)) * 1000, 1) for q in (0.5, 0.95, 0.99)},
+        "first_audio_sent_ms": {f"p{int(q * 100)}": round(value("turn_stage_latency_seconds", stage="first_audio_sent", quantile=str(q)) * 1000, 1) for q in (0.5, 0.95, 0.99)},
+    }
+
+
+def spawn_server(port: int, workers: int):
+    """Starts main.py with the stub backend and a scratch database."""
+    scratch = tempfile.mkdtemp(prefix="voice-loadtest-")
+    env = dict(
+        os.environ,
+        BRAIN_BACKEND="stub",
+        DB_PATH=os.path.join(scratch, "storage.db"),
+        GROQ_API_KEY=os.getenv("GROQ_API_KEY", "stub"),
+        SECRET_KEY=os.getenv("SECRET_KEY", "loadtest"),
+        WORKERS=str(workers),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+
+
+async def run(args):
+    http_url = args.server.replace("ws://", "http://").replace("wss://", "https://")
+    ws_url = http_url.replace("http://", "ws://").replace("https://", "wss://")
+    speech, interrupt = load_frames(args.speech), load_frames(args.interrupt)
+
+    async with httpx.AsyncClient(base_url=http_url, timeout=30) as http:
+        await wait_ready(http, args.ready_timeout)
+        tokens = await get_tokens(http, args.sessions)
+        print(f"🔑 {len(tokens)} accounts ready, starting {args.sessions} sessions over {args.ramp:.1f}s")
+
+        sessions = [
+            Session(f"{ws_url}/ws/web?token={token}&protocol=binary&codec=pcm16_16k", speech, interrupt, args.barge_after, args.reply_timeout)
+            for token in tokens
+        ]
+        loop_lag = []
+        lag_task = asyncio.create_task(monitor_loop_lag(loop_lag))
+
+        async def start(i, session):
+            await asyncio.sleep(args.ramp * i / max(1, len(sessions)))
+            await session.run()
+
+        started = time.monotonic()
+        outcomes = await asyncio.gather(*(start(i, s) for i, s in enumerate(sessions)), return_exceptions=True)
+        elapsed = time.monotonic() - started
+        lag_task.cancel()
+        metrics = parse_metrics((await http.get("/metrics")).text)
+
+    errors = {}
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            errors[type(outcome).__name__] = errors.get(type(outcome).__name__, 0) + 1
+
+    def ms(key):
+        return {k: (round(v * 1000, 1) if k != "count" else v) for k, v in percentiles([s.results[key] for s in sessions if key in s.results]).items()}
+
+    return {
+        "sessions": args.sessions,
+        "failed": sum(errors.values()),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 1),
+        "ttfa_ms": ms("ttfa"),
+        "barge_in_reaction_ms": ms("barge_in"),
+        "ttfa_after_barge_in_ms": ms("ttfa_after_barge_in"),
+        "client_loop_lag_ms": {k: (round(v * 1000, 1) if k != "count" else v) for k, v in percentiles(loop_lag).items()},
+        # With several workers this is whichever worker answered the scrape
+        "server": server_report(metrics),
+    }
+
+
+def check(report, args):
+    failures = []
+    if report["failed"] > args.max_failed:
+        failures.append(f"{report['failed']} sessions failed (allowed {args.max_failed})")
+    for key, limit in (("ttfa_ms", args.max_ttfa_p95_ms), ("barge_in_reaction_ms", args.max_barge_in_p95_ms)):
+        p95 = report[key].get("p95")
+        if limit is not None and (p95 is None or p95 > limit):
+            failures.append(f"{key} p95 {p95} > {limit}")
+    lag = report["server"]["event_loop_lag_ms"]["p99"]
+    if args.max_loop_lag_p99_ms is not None and lag > args.max_loop_lag_p99_ms:
+        failures.append(f"server event loop lag p99 {lag:.1f}ms > {args.max_loop_lag_p99_ms}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent real-time load test for /ws/web")
+    parser.add_argument("--server", default=os.getenv("AGENT_SERVER", "http://127.0.0.1:8000"))
+    parser.add_argument("--spawn", action="store_true", help="start a local server with BRAIN_BACKEND=stub")
+    parser.add_argument("--port", type=int, default=8765, help="port for --spawn")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for --spawn")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which sessions start")
+    parser.add_argument("--speech", default="test_speech.wav")
+    parser.add_argument("--interrupt", default="interrupt.wav")
+    parser.add_argument("--barge-after", type=float, default=1.0, help="seconds of reply audio before barging in")
+    parser.add_argument("--reply-timeout", type=float, default=15.0)
+    parser.add_argument("--ready-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-failed", type=int, default=0)
+    parser.add_argument("--max-ttfa-p95-ms", type=float)
+    parser.add_argument("--max-barge-in-p95-ms", type=float)
+    parser.add_argument("--max-loop-lag-p99-ms", type=float)
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        args.server = f"http://127.0.0.1:{args.port}"
+        server = spawn_server(args.port, args.workers)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    failures = check(report, args)
+    for failure in failures:
+        print(f"❌ {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
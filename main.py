@@ -1,29 +1,95 @@
 import os
 import uvicorn
-import json
-import base64
-import wave
+import uuid
 import asyncio
+import time
 import aiosqlite
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, status, Depends, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, status, Depends, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from pydub import AudioSegment
 
-from audio_engine import VADEngine
-from state_manager import CallManager, AgentState
+from audio_engine import VADEngine, VADService
+from state_manager import CallManager, AgentState, TurnTracker, SPECULATION_START, SPECULATION_DISCARD
 from llm_engine import BrainEngine 
-from database import init_db, get_db_connection
+from storage import storage
+from context_cache import context_cache
+from analytics import analytics, read_analytics, parse_window_bound
 from auth import get_password_hash, verify_password, create_access_token, decode_token
-from textblob import TextBlob
-from collections import Counter
+from static_assets import StaticAsset
+from config import TURN_MODE, SPECULATIVE_LLM, PREROLL_MS, MAX_UTTERANCE_MS, ECHO_SUPPRESSION, WORKERS, MAX_SESSIONS_PER_WORKER, TTS_FILLER_AFTER_MS
+from metrics import REGISTRY, Gauge
+from protocol import MediaChannel, PROTOCOLS, PROTOCOL_JSON
+from audio_codecs import CODECS, pcm16_to_wav
+from audio_buffers import PreRollRing, UtteranceBuffer
+from outbound import OutboundScheduler
+from echo import EchoReference
+from tracing import TurnTrace, observe_barge_in, monitor_event_loop
+from debug_audio import DebugAudioSpill
+from vad_log import VadRecorder
+from executors import start_executors, shutdown_executors, run_blocking, run_hashing
+from cpu_tasks import warm_up as warm_up_cpu_tasks
 
 load_dotenv()
 
-app = FastAPI()
+ACTIVE_SESSIONS = Gauge("active_sessions", "Open /ws/web sessions in this worker")
+
+async def warm_up(app: FastAPI):
+    """
+    Loads everything heavy in the background so the process starts (and answers
+    /health) immediately: torch and the VAD weights from local disk, a dummy VAD
+    pass, the Groq/edge-tts SDKs and the NLP stack in the process pool.
+    The worker reports ready on /ready once all of it is done.
+    """
+    started = time.perf_counter()
+
+    async def load_vad():
+        engine = await run_blocking(VADEngine)
+        await run_blocking(engine.warm_up)
+        service = VADService(engine)
+        await service.start()
+        app.state.vad_service = service
+
+    try:
+        await asyncio.gather(
+            load_vad(),
+            run_blocking(app.state.brain_engine.warm_up),
+            start_executors(warm_up=warm_up_cpu_tasks),
+        )
+    except Exception as e:
+        print(f"❌ Warm-up failed, worker stays unready: {e!r}")
+        return
+    app.state.ready.set()
+    # Folds turns (and, on first start, existing history) into the analytics tables
+    analytics.start()
+    print(f"✅ Worker {os.getpid()} ready in {time.perf_counter() - started:.1f}s")
+    # Not needed to serve turns; slow turns just get no filler until this is done
+    await app.state.brain_engine.prerender_fillers()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker process: every worker owns its own models, pools and
+    # connections and shares nothing but the SQLite file
+    app.state.ready = asyncio.Event()
+    app.state.vad_service = None
+    app.state.brain_engine = BrainEngine()
+    app.state.active_sessions = 0
+    await storage.start()
+    warm_up_task = asyncio.create_task(warm_up(app))
+    loop_monitor = asyncio.create_task(monitor_event_loop())
+    yield
+    loop_monitor.cancel()
+    warm_up_task.cancel()
+    await analytics.stop()
+    if app.state.vad_service is not None:
+        await app.state.vad_service.stop()
+    await storage.close()
+    shutdown_executors()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,13 +99,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-vad_engine = VADEngine()
-brain_engine = BrainEngine() 
-
-@app.on_event("startup")
-async def startup_event():
-    await init_db()
-
 class UserRegister(BaseModel):
     email: str
     password: str
@@ -53,14 +112,6 @@ class Token(BaseModel):
     token_type: str
  
 
-def save_utterance_to_wav(pcm_bytes, filename="captured_utterance.wav"):
-    with wave.open(filename, 'wb') as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2) # 16-bit
-        wf.setframerate(16000) # Upgraded to 16kHz
-        wf.writeframes(pcm_bytes)
-
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
@@ -74,68 +125,49 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     return int(user_id)
 
 @app.delete("/reset-memory")
-async def reset_memory(user_id: int = Depends(get_current_user)):
-    async with aiosqlite.connect("storage.db") as db:
-        await db.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
-        await db.commit()
+async def reset_memory(request: Request, user_id: int = Depends(get_current_user)):
+    # Let finished turns reach the writer queue (sentiment runs first), then land,
+    # so none of them is written after the reset
+    await request.app.state.brain_engine.wait_persisted(user_id)
+    try:
+        await storage.flush()
+    except Exception as e:
+        # Turns that failed to commit are not in the database, so there is nothing more to delete
+        print(f"⚠️ Resetting memory for user {user_id} after a failed write: {e!r}")
+    # All or nothing: a failure must not leave turns without their summary or analytics
+    async with storage.transaction() as db:
+        for table in ("conversations", "conversation_summaries", "turn_traces", "analytics_hourly", "analytics_topics", "analytics_sentiment"):
+            await db.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+    context_cache.reset(user_id)
     return {"message": "Memory reset successfully"}
 
 @app.get("/analytics")
-async def get_analytics(user_id: int = Depends(get_current_user)):
-    async with aiosqlite.connect("storage.db") as db:
-        # Fetch data
-        async with db.execute("SELECT role, content, sentiment_score, latency_ms, timestamp FROM conversations WHERE user_id = ? ORDER BY timestamp ASC LIMIT 100", (user_id,)) as cursor:
-            rows = await cursor.fetchall()
-            
-    if not rows:
-        return {"sentiment_trend": [], "avg_latency": 0, "topics": []}
-
-    # Process Data
-    sentiment_trend = []
-    latencies = []
-    all_user_text = ""
-
-    for role, content, sentiment, latency, timestamp in rows:
-        if role == "user":
-            if sentiment is not None:
-                sentiment_trend.append({"time": timestamp, "score": sentiment})
-            all_user_text += " " + content
-        elif role == "assistant":
-            if latency is not None:
-                latencies.append(latency)
-
-    # Metrics
-    avg_latency = sum(latencies) / len(latencies) if latencies else 0
-    
-    # Topic Extraction (Noun Phrases)
-    blob = TextBlob(all_user_text)
-    noun_phrases = blob.noun_phrases
-    top_topics = Counter(noun_phrases).most_common(10) # Top 10 topics
-
-    return {
-        "sentiment_trend": sentiment_trend,
-        "avg_latency": int(avg_latency),
-        "topics": [{"topic": t, "count": c} for t, c in top_topics]
-    }
+async def get_analytics(user_id: int = Depends(get_current_user), since: str = Query(None), until: str = Query(None), resolution: str = Query("turn"), points: int = Query(500, ge=1, le=10000)):
+    # Pre-aggregated by the analytics worker; since/until are ISO 8601 (UTC if no offset)
+    try:
+        since = parse_window_bound(since) if since else None
+        until = parse_window_bound(until) if until else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be ISO 8601 timestamps")
+    if resolution not in ("turn", "hour"):
+        raise HTTPException(status_code=400, detail="resolution must be 'turn' or 'hour'")
+    return await read_analytics(user_id, since, until, resolution, points)
 
 @app.post("/register")
 async def register(user: UserRegister):
-    hashed_password = get_password_hash(user.password)
-    async with aiosqlite.connect("storage.db") as db:
-        try:
-            await db.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (user.email, hashed_password))
-            await db.commit()
-        except aiosqlite.IntegrityError:
-            raise HTTPException(status_code=400, detail="Email already registered")
+    # Hashing runs on its own capped pool, so a burst of sign-ups cannot stall live calls
+    hashed_password = await run_hashing(get_password_hash, user.password)
+    try:
+        await storage.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (user.email, hashed_password))
+    except aiosqlite.IntegrityError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"message": "User registered successfully"}
 
 @app.post("/token", response_model=Token)
 async def login(user: UserLogin):
-    async with aiosqlite.connect("storage.db") as db:
-        async with db.execute("SELECT id, password_hash FROM users WHERE email = ?", (user.email,)) as cursor:
-            row = await cursor.fetchone()
+    row = await storage.fetchone("SELECT id, password_hash FROM users WHERE email = ?", (user.email,))
     
-    if not row or not verify_password(user.password, row[1]):
+    if not row or not await run_hashing(verify_password, user.password, row[1]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -145,121 +177,285 @@ async def login(user: UserLogin):
     access_token = create_access_token(data={"sub": str(row[0])}) # Store User ID in token
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition for this worker
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health")
+async def health():
+    # Liveness: the process is up and serving, even while still warming up.
+    # Also reports per-worker capacity for a front proxy to balance new calls on.
+    active = app.state.active_sessions
+    return {
+        "status": "ok",
+        "ready": app.state.ready.is_set(),
+        "worker_pid": os.getpid(),
+        "active_sessions": active,
+        "max_sessions": MAX_SESSIONS_PER_WORKER,
+        "available_sessions": max(0, MAX_SESSIONS_PER_WORKER - active),
+    }
+
+@app.get("/ready")
+async def ready():
+    # Readiness: models are warm and there is room for another call
+    if not app.state.ready.is_set():
+        return JSONResponse({"ready": False, "reason": "warming up"}, status_code=503)
+    if app.state.active_sessions >= MAX_SESSIONS_PER_WORKER:
+        return JSONResponse({"ready": False, "reason": "at capacity"}, status_code=503)
+    return {"ready": True}
+
+# Served from memory with ETags; re-read only when the file changes
+LOGIN_PAGE = StaticAsset("login.html")
+DASHBOARD_PAGE = StaticAsset("dashboard.html")
+
 @app.get("/")
-async def get_login_page():
+async def get_login_page(request: Request):
     # Landing page is now Login
-    with open("login.html", "r", encoding="utf-8") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content)
+    return LOGIN_PAGE.response(request)
 
 @app.get("/dashboard")
-async def get_dashboard():
-    with open("dashboard.html", "r", encoding="utf-8") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content)
+async def get_dashboard(request: Request):
+    return DASHBOARD_PAGE.response(request)
 
 
 @app.websocket("/ws/web")
-async def websocket_web_endpoint(websocket: WebSocket, token: str = Query(...)):
+async def websocket_web_endpoint(websocket: WebSocket, token: str = Query(...), protocol: str = Query(PROTOCOL_JSON), codec: str = Query("pcm16_16k")):
     user_id = decode_token(token)
-    if not user_id:
+    if not user_id or protocol not in PROTOCOLS or codec not in CODECS:
         await websocket.close(code=4003) # Forbidden
         return
     user_id = int(user_id)
+    if not websocket.app.state.ready.is_set() or websocket.app.state.active_sessions >= MAX_SESSIONS_PER_WORKER:
+        await websocket.close(code=1013) # Try again later (warming up or full)
+        return
+
+    vad_service = websocket.app.state.vad_service
+    brain_engine = websocket.app.state.brain_engine
+    websocket.app.state.active_sessions += 1
+    ACTIVE_SESSIONS.inc()
+    try:
+        await serve_session(websocket, user_id, protocol, codec, vad_service, brain_engine)
+    finally:
+        websocket.app.state.active_sessions -= 1
+        ACTIVE_SESSIONS.dec()
 
+
+async def serve_session(websocket: WebSocket, user_id: int, protocol: str, codec: str, vad_service: VADService, brain_engine: BrainEngine):
     await websocket.accept()
-    print("✅ Browser Client Connected [16kHz PCM Full Duplex]")
+    channel = MediaChannel(websocket, protocol, CODECS[codec])
+    print(f"✅ Client Connected [{codec} Full Duplex, {protocol} frames]")
+    # Confirm the negotiated framing and codec; legacy clients ignore unknown events
+    await channel.send_event({"event": "protocol", "protocol": protocol, "codec": codec})
     
+    # Load the conversation once; turns then read and extend it in memory
+    await context_cache.acquire(user_id)
     call_manager = CallManager()
-    user_audio_buffer = bytearray() 
-    outbound_audio_queue = asyncio.Queue()
+    vad_session = vad_service.create_session()
+    turns = TurnTracker()
+    session_id = uuid.uuid4().hex[:12]
+    spill = DebugAudioSpill(session_id)
+    vad_log = VadRecorder(session_id)
+    # Both preallocated once per session; no per-frame allocation
+    preroll = PreRollRing(PREROLL_MS)
+    user_audio_buffer = UtteranceBuffer(MAX_UTTERANCE_MS)
+    speculation = None  # STT started during trailing silence, committed at the endpoint
+    # Paced, bounded sender: stays ~150ms ahead of playback, so "clear" has little to drop
+    # Everything sent is kept as an echo reference so the agent cannot barge in on itself
+    echo = EchoReference() if ECHO_SUPPRESSION else None
+    outbound = OutboundScheduler(channel, reference=echo)
+    outbound.start()
+
+    async def queue_pcm(pcm_bytes, reply_audio=None, trace=None):
+        """Queues PCM for paced sending (waits while the queue is full). Returns False if playback was interrupted."""
+        if reply_audio is not None:
+            reply_audio.extend(pcm_bytes)
+        return await outbound.put(pcm_bytes, interrupted=lambda: call_manager.state != AgentState.SPEAKING, trace=trace)
+
+    async def finish_speaking():
+        # Wait until the client has (by the playback clock) played everything
+        await outbound.wait_played()
 
-    async def send_audio_task():
+        if call_manager.state == AgentState.SPEAKING:
+            call_manager.state = AgentState.LISTENING
+            await channel.send_event({"event": "state", "state": AgentState.LISTENING.value})
+            # Off the critical path: fold older turns into the rolling summary
+            brain_engine.schedule_compaction(user_id)
+
+    async def play_filler(trace):
+        """Plays a pre-rendered filler phrase if the turn is still thinking TTS_FILLER_AFTER_MS after the user stopped."""
+        await asyncio.sleep(max(0.0, trace.started + TTS_FILLER_AFTER_MS / 1000 - time.monotonic()))
+        pcm = brain_engine.filler()
+        if pcm is not None and call_manager.state == AgentState.THINKING and "tts_first_pcm" not in trace.marks:
+            print("💬 Slow turn, playing a filler")
+            # The reply queues up behind it; whatever has not fit in the queue once the reply starts is dropped
+            await outbound.put(pcm, interrupted=lambda: call_manager.state != AgentState.THINKING)
+
+    async def traced_turn(trace, turn_id, turn):
+        """
+        Runs a turn coroutine (True if the reply was fully spoken) and records its trace.
+        A turn that ends without handing the floor back (no audio, or an STT/LLM/TTS
+        error) leaves the session THINKING or SPEAKING, where the user's speech is
+        ignored; it goes back to LISTENING here.
+        """
+        outcome = "failed"
+        filler = asyncio.create_task(play_filler(trace)) if brain_engine.fillers else None
         try:
-            while True:
-                chunk = await outbound_audio_queue.get()
-                payload = base64.b64encode(chunk).decode("utf-8")
-                await websocket.send_text(json.dumps({
-                    "event": "media",
-                    "media": {"payload": payload}
-                }))
-                outbound_audio_queue.task_done()
-                await asyncio.sleep(0.01)
+            outcome = "completed" if await turn else "interrupted"
         except asyncio.CancelledError:
-            pass
-
-    sender_task = asyncio.create_task(send_audio_task())
+            # Barge-in, a newer turn or the client leaving: they own the state now
+            outcome = "interrupted"
+            raise
+        finally:
+            if filler is not None:
+                filler.cancel()
+            trace.finish(outcome)
+            if outcome != "interrupted" and turns.is_current(turn_id) and call_manager.state in (AgentState.THINKING, AgentState.SPEAKING):
+                call_manager.state = AgentState.LISTENING
+                await channel.send_event({"event": "state", "state": AgentState.LISTENING.value})
+
+    async def process_brain_task(audio_bytes_to_process, turn_id, speculation, trace):
+        try:
+            await channel.send_event({"event": "state", "state": AgentState.THINKING.value})
+            await spill.save(turn_id, "user", audio_bytes_to_process)
+            user_text, ai_text, pcm_stream = await brain_engine.process_turn(pcm16_to_wav(audio_bytes_to_process), user_id, speculation, trace)
+        finally:
+            # The turn owns the committed speculation, even if it is cancelled before process_turn runs
+            if speculation is not None:
+                speculation.cancel()
 
-    async def process_brain_task(audio_bytes_to_process):
-        await websocket.send_text(json.dumps({"event": "state", "state": AgentState.THINKING.value}))
-        save_utterance_to_wav(audio_bytes_to_process)
-        
-        user_text, ai_text, mp3_file = await brain_engine.process_turn("captured_utterance.wav", user_id)
-        
         # Send transcripts to UI
-        await websocket.send_text(json.dumps({"event": "transcript", "role": "user", "text": user_text}))
-        await websocket.send_text(json.dumps({"event": "transcript", "role": "ai", "text": ai_text}))
+        await channel.send_event({"event": "transcript", "role": "user", "text": user_text})
+        await channel.send_event({"event": "transcript", "role": "ai", "text": ai_text})
         
-        if call_manager.state == AgentState.RECEIVING:
-            return
+        # Only the newest turn may speak, and never over the user
+        if call_manager.state == AgentState.RECEIVING or not turns.is_current(turn_id):
+            return False
 
         call_manager.state = AgentState.SPEAKING
-        await websocket.send_text(json.dumps({"event": "state", "state": AgentState.SPEAKING.value}))
-        
-        # Convert MP3 straight to 16kHz PCM
-        audio = AudioSegment.from_mp3(mp3_file)
-        audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
-        pcm_bytes = audio.raw_data
-        
-        chunk_size = 6400 # 200ms of 16kHz 16-bit audio = 6400 bytes
-        for i in range(0, len(pcm_bytes), chunk_size):
-            if call_manager.state != AgentState.SPEAKING:
-                break
-            chunk = pcm_bytes[i:i+chunk_size]
-            await outbound_audio_queue.put(chunk)
+        await channel.send_event({"event": "state", "state": AgentState.SPEAKING.value})
         
-        # Wait for all chunks to actually be sent over WebSocket
-        await outbound_audio_queue.join()
-
-        if call_manager.state == AgentState.SPEAKING:
-            call_manager.state = AgentState.LISTENING
-            await websocket.send_text(json.dumps({"event": "state", "state": AgentState.LISTENING.value}))
+        # 16kHz PCM arrives chunk by chunk while the MP3 is still streaming in
+        reply_audio = bytearray() if spill.enabled else None
+        try:
+            async with aclosing(pcm_stream):
+                async for pcm_bytes in pcm_stream:
+                    if not await queue_pcm(pcm_bytes, reply_audio, trace):
+                        return False
+            await finish_speaking()
+            return True
+        finally:
+            await spill.save(turn_id, "ai", reply_audio)
+
+    async def process_brain_task_streaming(audio_bytes_to_process, turn_id, speculation, trace):
+        reply_audio = bytearray() if spill.enabled else None
+        try:
+            await channel.send_event({"event": "state", "state": AgentState.THINKING.value})
+            await spill.save(turn_id, "user", audio_bytes_to_process)
+            return await speak_streaming_turn(audio_bytes_to_process, turn_id, reply_audio, speculation, trace)
+        finally:
+            # Closing a generator that never started runs none of stream_turn, so the turn owns the speculation
+            if speculation is not None:
+                speculation.cancel()
+            await spill.save(turn_id, "ai", reply_audio)
+
+    async def speak_streaming_turn(audio_bytes_to_process, turn_id, reply_audio, speculation, trace):
+        speaking = False
+        async with aclosing(brain_engine.stream_turn(pcm16_to_wav(audio_bytes_to_process), user_id, speculation, trace)) as turn:
+            async for kind, payload in turn:
+                if kind == "user_text":
+                    await channel.send_event({"event": "transcript", "role": "user", "text": payload})
+                elif kind == "ai_text":
+                    await channel.send_event({"event": "transcript", "role": "ai", "text": payload})
+                elif kind == "audio":
+                    if not speaking:
+                        # User started talking again before the first segment was ready
+                        if call_manager.state == AgentState.RECEIVING or not turns.is_current(turn_id):
+                            return False
+                        speaking = True
+                        call_manager.state = AgentState.SPEAKING
+                        await channel.send_event({"event": "state", "state": AgentState.SPEAKING.value})
+                    # Segments keep arriving while earlier ones are already playing
+                    if not await queue_pcm(payload, reply_audio, trace):
+                        return False
+
+        if speaking:
+            await finish_speaking()
+        return True
 
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-
-            if message.get("event") == "media":
-                audio_bytes = base64.b64decode(message["media"]["payload"])
+            kind, audio_bytes = await channel.receive()
+            received_at = time.monotonic()
+
+            if kind == "audio":
+                was_speaking = call_manager.state == AgentState.SPEAKING
+                raw_prob = prob = await vad_session.process(audio_bytes)
+                if echo is not None:
+                    # Down-weight frames that are our own playback picked up by the mic
+                    prob = echo.adjust(audio_bytes, prob, received_at)
+                # 16kHz PCM16 = 32 bytes per ms
+                state_changed = call_manager.process_vad_frame(prob, len(audio_bytes) / 32)
+                vad_log.frame(audio_bytes, raw_prob, prob, call_manager.state, was_speaking, received_at)
+                preroll.write(audio_bytes)
 
-                prob = vad_engine.process(audio_bytes)
-                state_changed = call_manager.process_vad_frame(prob)
+                if call_manager.state == AgentState.RECEIVING:
+                    if state_changed:
+                        # Speech onset: start with the audio VAD needed to confirm it
+                        user_audio_buffer.reset()
+                        preroll.drain_into(user_audio_buffer)
+                    else:
+                        user_audio_buffer.extend(audio_bytes)
+                    if user_audio_buffer.full:
+                        state_changed = call_manager.force_endpoint()
+
+                if call_manager.speculation_event == SPECULATION_START:
+                    # Trailing silence: start STT now instead of at the endpoint
+                    speculation = brain_engine.speculate(pcm16_to_wav(user_audio_buffer.view()), user_id, with_llm=SPECULATIVE_LLM and TURN_MODE == "streaming")
+                elif call_manager.speculation_event == SPECULATION_DISCARD and speculation is not None:
+                    # The user kept talking
+                    speculation.cancel()
+                    speculation = None
 
                 if state_changed:
-                    await websocket.send_text(json.dumps({"event": "state", "state": call_manager.state.value}))
+                    await channel.send_event({"event": "state", "state": call_manager.state.value})
 
                 if call_manager.state == AgentState.RECEIVING:
-                    user_audio_buffer.extend(audio_bytes) 
-                    
                     if state_changed:
                         print("\n🛑 [BARGE-IN] User interrupted!")
                         # Fire a "clear" event to the browser to instantly stop playback
-                        await websocket.send_text(json.dumps({"event": "clear"}))
-                        while not outbound_audio_queue.empty():
-                            outbound_audio_queue.get_nowait()
-                            outbound_audio_queue.task_done()
+                        await channel.send_event({"event": "clear"})
+                        # Stop paying for STT/LLM/TTS of a reply nobody will hear
+                        turns.cancel()
+                        outbound.clear()
+                        if was_speaking:
+                            # From the first speech frame the VAD confirmed to silenced playback
+                            observe_barge_in(received_at - call_manager.speech_ms / 1000)
 
                 if state_changed and call_manager.state == AgentState.THINKING:
                     print("\n🧠 Processing audio...")
-                    buffer_copy = bytes(user_audio_buffer)
-                    user_audio_buffer.clear() 
-                    asyncio.create_task(process_brain_task(buffer_copy))
+                    # Stages are timed from when the user actually went quiet
+                    trace = TurnTrace(user_id, speech_ended_at=received_at - call_manager.silence_ms / 1000)
+                    trace.mark("speech_end_detected", received_at)
+                    # The turn gets its own copy; the preallocated buffer is reused
+                    buffer_copy = user_audio_buffer.take()
+                    # The speculative STT (if any) now belongs to the turn
+                    committed, speculation = speculation, None
+                    if TURN_MODE == "streaming":
+                        turns.start(lambda turn_id: traced_turn(trace, turn_id, process_brain_task_streaming(buffer_copy, turn_id, committed, trace)))
+                    else:
+                        turns.start(lambda turn_id: traced_turn(trace, turn_id, process_brain_task(buffer_copy, turn_id, committed, trace)))
 
     except WebSocketDisconnect:
-        print("\n🔌 Client disconnected.")
+        print(f"\n🔌 Client disconnected. ({channel.frames_lost} uplink frames lost, {channel.frames_rejected} malformed, max send lag {outbound.max_lag * 1000:.0f}ms)")
     finally:
-        sender_task.cancel() 
+        turns.cancel()
+        if speculation is not None:
+            speculation.cancel()
+        outbound.stop()
+        context_cache.release(user_id)
+        await vad_log.close()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # With WORKERS > 1 uvicorn forks that many shared-nothing worker processes
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
\ No newline at end of file
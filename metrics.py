@@ -0,0 +1,172 @@
+import threading
+from collections import deque
+
+# Minimal in-process metrics registry rendered in the Prometheus text format.
+# Metrics are per worker process; a scraper aggregates across workers.
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram (Prometheus semantics)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets, labelnames=()):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["counts"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def get(self, **labels):
+        entry = self.values.get(self._key(labels))
+        return dict(entry) if entry else {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(key, dict(entry, counts=list(entry["counts"]))) for key, entry in self.values.items()]
+        for key, entry in items:
+            for bound, count in zip(self.buckets, entry["counts"]):
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', bound))} {count}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {entry['count']}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {entry['sum']}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {entry['count']}")
+        return lines
+
+
+class Summary(_Metric):
+    """
+    Quantiles over a sliding window of the most recent observations, plus a
+    running sum and count (Prometheus summary semantics).
+    """
+    kind = "summary"
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, name: str, help_text: str, labelnames=(), window: int = 2048):
+        self.window = window
+        super().__init__(name, help_text, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"recent": deque(maxlen=self.window), "sum": 0.0, "count": 0}
+            entry["recent"].append(value)
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @classmethod
+    def _quantiles(cls, recent):
+        ordered = sorted(recent)
+        if not ordered:
+            return {q: 0.0 for q in cls.QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in cls.QUANTILES}
+
+    def get(self, **labels):
+        entry = self.values.get(self._key(labels))
+        if not entry:
+            return {"quantiles": self._quantiles(()), "sum": 0.0, "count": 0}
+        with self.lock:
+            recent = list(entry["recent"])
+        return {"quantiles": self._quantiles(recent), "sum": entry["sum"], "count": entry["count"]}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(key, list(entry["recent"]), entry["sum"], entry["count"]) for key, entry in self.values.items()]
+        for key, recent, total, count in items:
+            for q, value in self._quantiles(recent).items():
+                lines.append(f"{self.name}{self._format_labels(key, ('quantile', q))} {value}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
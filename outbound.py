@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from config import OUTBOUND_CHUNK_MS, OUTBOUND_LEAD_MS, OUTBOUND_MAX_QUEUED_MS
+from metrics import Histogram
+
+BYTES_PER_MS = 32  # 16kHz mono PCM16
+
+OUTBOUND_SEND_LAG = Histogram(
+    "outbound_send_lag_seconds", "How late each outbound audio chunk left compared to its pacing deadline",
+    [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+)
+
+
+class OutboundScheduler:
+    """
+    Paces one session's reply audio against a real-time playback clock.
+    A chunk is sent no earlier than lead_ms before the client will need it, so
+    the client never holds more than ~lead_ms + one chunk of unplayed audio and
+    a barge-in silences the agent almost immediately. The queue is bounded:
+    put() blocks once max_queued_ms is waiting, which holds back TTS instead of
+    buffering a whole reply in memory.
+    Sent chunks are recorded in `reference` (an echo.EchoReference), if given,
+    at the time the client is expected to play them.
+    """
+    def __init__(self, channel, chunk_ms: float = OUTBOUND_CHUNK_MS, lead_ms: float = OUTBOUND_LEAD_MS, max_queued_ms: float = OUTBOUND_MAX_QUEUED_MS, reference=None):
+        self.channel = channel
+        self.reference = reference
+        self.chunk_bytes = int(chunk_ms * BYTES_PER_MS) & ~1
+        self.lead = lead_ms / 1000.0
+        self.queue = asyncio.Queue(maxsize=max(1, int(max_queued_ms // chunk_ms)))
+        self.epoch = 0             # Bumped by clear(); chunks from older epochs are dropped
+        self.clock_start = None    # Monotonic time at which the current stream starts playing
+        self.clock_audio = 0.0     # Seconds of audio sent since clock_start
+        self.max_lag = 0.0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def put(self, pcm: bytes, interrupted=None, trace=None):
+        """
+        Queues PCM in chunk_ms pieces, waiting while the queue is full.
+        Returns False as soon as interrupted() is true or clear() was called.
+        The first chunk actually sent is marked on `trace` as "first_audio_sent".
+        """
+        epoch = self.epoch
+        for i in range(0, len(pcm), self.chunk_bytes):
+            if epoch != self.epoch or (interrupted is not None and interrupted()):
+                return False
+            await self.queue.put((epoch, pcm[i:i + self.chunk_bytes], trace))
+        return epoch == self.epoch
+
+    def clear(self):
+        """Drops everything not yet sent (barge-in) and restarts the playback clock."""
+        self.epoch += 1
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+        self.clock_start = None
+        self.clock_audio = 0.0
+        if self.reference is not None:
+            self.reference.truncate(time.monotonic())
+
+    async def wait_played(self):
+        """Waits until every queued chunk is sent and the client should have played it."""
+        await self.queue.join()
+        if self.clock_start is not None:
+            remaining = self.clock_start + self.clock_audio - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+    async def _run(self):
+        try:
+            while True:
+                epoch, chunk, trace = await self.queue.get()
+                try:
+                    if epoch != self.epoch:
+                        continue
+                    now = time.monotonic()
+                    if self.clock_start is None or now > self.clock_start + self.clock_audio:
+                        # The client ran dry (or this is a new reply): restart the clock
+                        self.clock_start = now
+                        self.clock_audio = 0.0
+                    # Due lead seconds before the client plays it, but never before the clock started
+                    due = max(self.clock_start + self.clock_audio - self.lead, self.clock_start)
+                    if due > now:
+                        await asyncio.sleep(due - now)
+                    if epoch != self.epoch:
+                        continue
+                    await self.channel.send_audio(chunk)
+                    if trace is not None:
+                        trace.mark("first_audio_sent")
+                    # Includes the socket write, so a slow client shows up here too
+                    lag = max(0.0, time.monotonic() - due)
+                    OUTBOUND_SEND_LAG.observe(lag)
+                    self.max_lag = max(self.max_lag, lag)
+                    if self.reference is not None:
+                        self.reference.write(chunk, self.clock_start + self.clock_audio)
+                    self.clock_audio += len(chunk) / (BYTES_PER_MS * 1000)
+                finally:
+                    self.queue.task_done()
+        except asyncio.CancelledError:
+            pass
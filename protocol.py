@@ -0,0 +1,124 @@
+import json
+import base64
+import struct
+from fastapi import WebSocketDisconnect
+
+from audio_codecs import CODEC_PCM16_16K, StreamTranscoder
+from metrics import Counter
+
+# Wire protocol for /ws/web.
+#
+# "json" (legacy): every message is text; audio travels as
+#     {"event": "media", "media": {"payload": <base64 PCM>}}
+# "binary": audio travels as binary WebSocket frames with a fixed 12-byte
+#     little-endian header followed by the raw payload; control events
+#     (state, transcript, clear, ...) stay as JSON text frames.
+#
+#     offset  size  field
+#     0       1     version   (1)
+#     1       1     codec id  (see audio_codecs.CODECS)
+#     2       2     flags     (reserved, 0)
+#     4       4     sequence number, per direction, wraps at 2^32
+#     8       4     timestamp in ms of stream audio (sample clock, not wall clock)
+#
+# The codec (?codec=pcm16_16k|pcm16_8k|mulaw|alaw) applies to both directions
+# and both framings; the pipeline behind the channel always sees 16kHz PCM16.
+
+PROTOCOL_JSON = "json"
+PROTOCOL_BINARY = "binary"
+PROTOCOLS = (PROTOCOL_JSON, PROTOCOL_BINARY)
+
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("<BBHII")
+
+UPLINK_FRAMES_REJECTED = Counter("uplink_frames_rejected_total", "Malformed client messages dropped by the media channel")
+
+
+def pack_audio(sequence: int, timestamp_ms: int, codec_id: int, payload: bytes):
+    return HEADER.pack(PROTOCOL_VERSION, codec_id, 0, sequence & 0xFFFFFFFF, timestamp_ms & 0xFFFFFFFF) + payload
+
+
+def unpack_audio(frame: bytes):
+    """Returns (sequence, timestamp_ms, codec_id, payload) or raises ValueError."""
+    if len(frame) < HEADER.size:
+        raise ValueError("Audio frame shorter than header")
+    version, codec_id, _flags, sequence, timestamp_ms = HEADER.unpack_from(frame)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported audio frame version {version}")
+    return sequence, timestamp_ms, codec_id, memoryview(frame)[HEADER.size:]
+
+
+class MediaChannel:
+    """
+    Wraps the client WebSocket so the handler never deals with framing or codecs.
+    Inbound audio is accepted in either framing and decoded to 16kHz PCM16;
+    outbound 16kHz PCM16 is encoded with the negotiated codec and framing.
+    """
+    def __init__(self, websocket, protocol: str = PROTOCOL_JSON, codec=CODEC_PCM16_16K):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.codec = codec
+        self.transcoder = StreamTranscoder(codec)
+        self.send_sequence = 0
+        self.send_timestamp_ms = 0
+        self.receive_sequence = None
+        self.frames_lost = 0
+        self.frames_rejected = 0
+
+    async def send_event(self, event: dict):
+        await self.websocket.send_text(json.dumps(event))
+
+    async def send_audio(self, pcm16_16k: bytes):
+        chunk = self.transcoder.encode(pcm16_16k)
+        if self.protocol == PROTOCOL_BINARY:
+            await self.websocket.send_bytes(pack_audio(self.send_sequence, self.send_timestamp_ms, self.codec.id, chunk))
+        else:
+            payload = base64.b64encode(chunk).decode("utf-8")
+            await self.websocket.send_text(json.dumps({
+                "event": "media",
+                "media": {"payload": payload}
+            }))
+        self.send_sequence += 1
+        self.send_timestamp_ms += len(pcm16_16k) // 32  # 16kHz PCM16 = 32 bytes per ms
+
+    async def receive(self):
+        """
+        Returns ("audio", pcm16_16k_bytes) or ("event", dict).
+        Malformed messages are dropped and counted, never raised: one bad frame
+        must not end the call.
+        Raises WebSocketDisconnect when the client goes away.
+        """
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            try:
+                return self._parse(message)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.frames_rejected += 1
+                UPLINK_FRAMES_REJECTED.inc()
+                # The first one, then every 100th, so a broken client cannot flood the log
+                if self.frames_rejected % 100 == 1:
+                    print(f"⚠️ Dropped malformed client message ({self.frames_rejected} so far): {e!r}")
+
+    def _parse(self, message):
+        if message.get("bytes") is not None:
+            sequence, _timestamp_ms, codec_id, payload = unpack_audio(message["bytes"])
+            if codec_id != self.codec.id:
+                raise ValueError(f"Frame codec id {codec_id} does not match negotiated {self.codec.name}")
+            pcm = self._decode(payload.tobytes())
+            if self.receive_sequence is not None:
+                # Count gaps so dropped uplink frames show up in logs
+                self.frames_lost += (sequence - self.receive_sequence - 1) & 0xFFFFFFFF
+            self.receive_sequence = sequence
+            return "audio", pcm
+
+        event = json.loads(message["text"])
+        if event.get("event") == "media":
+            return "audio", self._decode(base64.b64decode(event["media"]["payload"], validate=True))
+        return "event", event
+
+    def _decode(self, payload: bytes):
+        if len(payload) % self.codec.bytes_per_sample:
+            raise ValueError(f"{len(payload)}-byte payload is not whole {self.codec.name} samples")
+        return self.transcoder.decode(payload)
@@ -1,49 +1,123 @@
+import asyncio
 from enum import Enum
 
+from config import ENDPOINT_SPEECH_PROB, ENDPOINT_SPEECH_MS, ENDPOINT_SILENCE_MS, ENDPOINT_SPECULATE_MS
+
 class AgentState(Enum):
     LISTENING = "LISTENING"  # Waiting for user to speak
     RECEIVING = "RECEIVING"  # User is actively speaking
     THINKING = "THINKING"    # Waiting for LLM response
     SPEAKING = "SPEAKING"    # AI is talking
 
+SPECULATION_START = "start"
+SPECULATION_DISCARD = "discard"
+
 class CallManager:
-    def __init__(self):
+    """
+    Turn-taking state machine driven by per-frame VAD probabilities.
+    Thresholds are durations, accumulated from each frame's real length, so they
+    mean the same thing for 20ms telephony frames and 32ms browser frames.
+    """
+    def __init__(self, speech_ms=ENDPOINT_SPEECH_MS, silence_ms=ENDPOINT_SILENCE_MS, speculate_ms=ENDPOINT_SPECULATE_MS, speech_prob=ENDPOINT_SPEECH_PROB):
         self.state = AgentState.LISTENING
-        self.speech_streak = 0
-        self.silence_streak = 0
-        
-        # Thresholds (Tuning these is the secret to good voice AI)
-        self.SPEECH_THRESHOLD = 3   # 3 frames (60ms) of speech to trigger "Barge-In"
-        self.SILENCE_THRESHOLD = 25 # 25 frames (500ms) of silence to trigger "Thinking"
-
-    def process_vad_frame(self, speech_prob: float):
+        self.speech_ms = 0.0   # Length of the current run of speech frames
+        self.silence_ms = 0.0  # Length of the current run of silence frames
+
+        # Thresholds (Tuning these is the secret to good voice AI; see vad_replay.py)
+        self.SPEECH_PROB = speech_prob  # VAD probability above which a frame is speech
+        self.SPEECH_MS = speech_ms      # Speech needed to trigger "Barge-In"
+        self.SILENCE_MS = silence_ms    # Silence needed to trigger "Thinking"
+        self.SPECULATE_MS = speculate_ms  # Silence after which STT may start early (0 = off)
+
+        # Speculative endpointing: set for the frame on which a speculative turn
+        # should start (SPECULATION_START) or be thrown away (SPECULATION_DISCARD)
+        self.speculating = False
+        self.speculation_event = None
+
+    def process_vad_frame(self, speech_prob: float, frame_ms: float = 20.0):
         """
         Takes the probability from Silero VAD and updates the state machine.
+        frame_ms is the duration of the audio the probability was computed on.
         Returns a boolean indicating if a state change just happened.
         """
-        is_speaking_now = speech_prob > 0.6
+        is_speaking_now = speech_prob > self.SPEECH_PROB
         state_changed = False
+        self.speculation_event = None
 
         if is_speaking_now:
-            self.speech_streak += 1
-            self.silence_streak = 0
+            self.speech_ms += frame_ms
+            self.silence_ms = 0.0
         else:
-            self.silence_streak += 1
-            self.speech_streak = 0
+            self.silence_ms += frame_ms
+            self.speech_ms = 0.0
 
         # State Transitions
         if self.state in [AgentState.LISTENING, AgentState.SPEAKING]:
             # BARGE-IN LOGIC: If AI was speaking, and user interrupts
-            if self.speech_streak >= self.SPEECH_THRESHOLD:
+            if self.speech_ms >= self.SPEECH_MS:
                 self.state = AgentState.RECEIVING
                 state_changed = True
                 print("\n🛑 [BARGE-IN DETECTED] AI stopped. User is speaking...")
 
         elif self.state == AgentState.RECEIVING:
+            if is_speaking_now:
+                # The user kept talking: whatever was started early is stale
+                if self.speculating:
+                    self.speculating = False
+                    self.speculation_event = SPECULATION_DISCARD
+            elif 0 < self.SPECULATE_MS < self.SILENCE_MS and not self.speculating and self.silence_ms >= self.SPECULATE_MS:
+                self.speculating = True
+                self.speculation_event = SPECULATION_START
+
             # END OF SPEECH LOGIC: User finished their sentence
-            if self.silence_streak >= self.SILENCE_THRESHOLD:
+            if self.silence_ms >= self.SILENCE_MS:
                 self.state = AgentState.THINKING
+                self.speculating = False
                 state_changed = True
                 print("\n🧠 [END OF SPEECH] User finished. AI is thinking...")
 
-        return state_changed
\ No newline at end of file
+        return state_changed
+
+    def force_endpoint(self):
+        """Ends the user's turn regardless of VAD (e.g. the utterance hit its length cap)."""
+        if self.state != AgentState.RECEIVING:
+            return False
+        self.state = AgentState.THINKING
+        self.speculating = False
+        print("\n🧠 [FORCED END OF SPEECH] Utterance too long. AI is thinking...")
+        return True
+
+
+class TurnTracker:
+    """
+    Owns the single in-flight STT -> LLM -> TTS turn of a session.
+    Starting a new turn or a barge-in cancels the previous one, so stale
+    pipelines stop paying for upstream calls and can never reach SPEAKING.
+    """
+    def __init__(self):
+        self.task = None
+        self.turn_id = 0
+
+    def start(self, turn_factory):
+        """Cancels any running turn and starts turn_factory(turn_id) as the new one."""
+        self.cancel()
+        self.turn_id += 1
+        self.task = asyncio.create_task(turn_factory(self.turn_id))
+        self.task.add_done_callback(self._report_failure)
+        return self.turn_id
+
+    def cancel(self):
+        """Cancels the running turn. Returns True if there was one."""
+        if self.task and not self.task.done():
+            self.task.cancel()
+            print(f"\n✂️ [TURN {self.turn_id}] Cancelled in-flight pipeline")
+            return True
+        return False
+
+    def is_current(self, turn_id: int):
+        return turn_id == self.turn_id
+
+    @staticmethod
+    def _report_failure(task):
+        if not task.cancelled() and task.exception():
+            print(f"\n❌ Turn failed: {task.exception()!r}")
@@ -0,0 +1,75 @@
+import os
+import gzip
+import hashlib
+
+from fastapi import Request
+from fastapi.responses import Response
+
+
+def accepted_codings(header: str):
+    """Accept-Encoding -> {coding: q}, e.g. "gzip;q=0.5, identity" -> {"gzip": 0.5, "identity": 1.0}."""
+    codings = {}
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def prefers_gzip(header: str):
+    """True if the client accepts gzip at least as much as the uncompressed page."""
+    codings = accepted_codings(header)
+    wildcard = codings.get("*")
+    gzip_q = codings.get("gzip", wildcard if wildcard is not None else 0.0)
+    identity_q = codings.get("identity", wildcard if wildcard is not None else 1.0)
+    return gzip_q > 0 and gzip_q >= identity_q
+
+
+class StaticAsset:
+    """
+    A page served from memory, with a strong ETag per encoding and a
+    pre-compressed gzip copy. The file is only stat'ed per request and re-read
+    when its mtime changes, so an edited page is served without a restart.
+    Clients revalidate on every load (no-cache); an unchanged page costs a 304.
+    """
+    def __init__(self, path: str, media_type: str = "text/html; charset=utf-8"):
+        self.path = path
+        self.media_type = media_type
+        self.mtime = None
+        self._load()
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return
+        with open(self.path, "rb") as f:
+            self.body = f.read()
+        self.gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.mtime = mtime
+
+    def response(self, request: Request):
+        self._load()
+        gzipped = prefers_gzip(request.headers.get("accept-encoding", ""))
+        etag = self.gzip_etag if gzipped else self.etag
+        # Vary on the 304 too, so shared caches keep the two encodings apart
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gzipped, media_type=self.media_type, headers=headers)
+        return Response(self.body, media_type=self.media_type, headers=headers)
@@ -0,0 +1,193 @@
+import asyncio
+import sqlite3
+from contextlib import asynccontextmanager
+import aiosqlite
+
+from config import DB_POOL_SIZE, DB_WRITE_BATCH, DB_WRITE_INTERVAL_MS, DB_WRITE_RETRIES, DB_WRITE_BACKOFF_MS
+from database import DB_NAME, init_db, configure_connection
+
+
+def transient(error: Exception):
+    """SQLITE_BUSY / SQLITE_LOCKED: another connection held the write lock past busy_timeout."""
+    return isinstance(error, sqlite3.OperationalError) and any(word in str(error) for word in ("locked", "busy"))
+
+
+class Storage:
+    """
+    Conversation store on top of database.py.
+    Reads and small ad-hoc writes borrow a connection from a fixed pool of
+    long-lived, tuned connections. Turn inserts are queued with enqueue() and a
+    single background writer commits them in grouped transactions, so the reply
+    path never waits on SQLite. If a grouped transaction fails, each queued
+    group (e.g. the two rows of one turn) is retried on its own, so a bad
+    statement only loses its own group.
+    """
+    def __init__(self, path: str = DB_NAME, pool_size: int = DB_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.pool = asyncio.Queue()
+        self.connections = []
+        self.writes = asyncio.Queue()
+        self.writer_db = None
+        self.writer_task = None
+
+    async def start(self):
+        await init_db()
+        for _ in range(self.pool_size):
+            db = await aiosqlite.connect(self.path)
+            await configure_connection(db)
+            self.connections.append(db)
+            self.pool.put_nowait(db)
+        self.writer_db = await aiosqlite.connect(self.path)
+        await configure_connection(self.writer_db)
+        self.writer_task = asyncio.create_task(self._write_loop())
+        print(f"✅ Storage ready ({self.pool_size} pooled connections + background writer)")
+
+    async def close(self):
+        if self.writer_task is not None:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Shutting down with unwritten turns: {e!r}")
+            self.writer_task.cancel()
+            self.writer_task = None
+        for db in self.connections:
+            await db.close()
+        self.connections.clear()
+        if self.writer_db is not None:
+            await self.writer_db.close()
+            self.writer_db = None
+
+    @asynccontextmanager
+    async def connection(self):
+        db = await self.pool.get()
+        try:
+            yield db
+        finally:
+            self.pool.put_nowait(db)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """A pooled connection inside BEGIN IMMEDIATE; commits on success, rolls back on error."""
+        async with self.connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+
+    async def fetchall(self, sql: str, params=()):
+        async with self.connection() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def fetchone(self, sql: str, params=()):
+        async with self.connection() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def execute(self, sql: str, params=()):
+        """Runs one write immediately and commits it. Returns the last row id."""
+        async with self.connection() as db:
+            try:
+                cursor = await db.execute(sql, params)
+                await db.commit()
+                return cursor.lastrowid
+            except Exception:
+                await db.rollback()
+                raise
+
+    def enqueue(self, sql: str, params=()):
+        """Queues a write for the background writer."""
+        self.enqueue_many([(sql, params)])
+
+    def enqueue_many(self, statements):
+        """Queues (sql, params) statements that must commit together or not at all."""
+        self.writes.put_nowait((list(statements), None))
+
+    async def flush(self):
+        """
+        Waits until everything queued so far is committed.
+        Raises the error of the last write that could not be committed, if any.
+        """
+        done = asyncio.get_running_loop().create_future()
+        self.writes.put_nowait((None, done))
+        await done
+
+    async def _write_loop(self):
+        interval = DB_WRITE_INTERVAL_MS / 1000.0
+        while True:
+            batch = [await self.writes.get()]
+            # Let a burst of turns accumulate into one transaction
+            await asyncio.sleep(interval)
+            while len(batch) < DB_WRITE_BATCH and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+
+            groups = [statements for statements, _ in batch if statements is not None]
+            error = await self._commit_groups(groups) if groups else None
+            for _, done in batch:
+                if done is not None and not done.done():
+                    if error is None:
+                        done.set_result(None)
+                    else:
+                        done.set_exception(error)
+
+    async def _commit_groups(self, groups):
+        """Commits the groups in one transaction, else one by one. Returns the last error, or None."""
+        try:
+            await self._commit_retrying([statement for group in groups for statement in group])
+            return None
+        except Exception as e:
+            if len(groups) == 1:
+                print(f"❌ Background write failed: {e!r}")
+                return e
+            print(f"⚠️ Background write of {len(groups)} groups failed ({e!r}), committing them one by one")
+
+        error, lost = None, 0
+        for i, group in enumerate(groups):
+            try:
+                await self._commit(group)
+            except Exception as e:
+                error = e
+                if transient(e):
+                    # Still locked after the retries: the rest would only wait out busy_timeout too
+                    lost += len(groups) - i
+                    break
+                lost += 1
+        if lost:
+            print(f"❌ {lost} of {len(groups)} queued groups were not written: {error!r}")
+        return error
+
+    async def _commit_retrying(self, statements):
+        for attempt in range(DB_WRITE_RETRIES + 1):
+            try:
+                return await self._commit(statements)
+            except Exception as e:
+                if not transient(e) or attempt == DB_WRITE_RETRIES:
+                    raise
+                delay = DB_WRITE_BACKOFF_MS / 1000 * 2 ** attempt
+                print(f"⏳ Database locked, retrying the write in {delay * 1000:.0f}ms ({attempt + 1}/{DB_WRITE_RETRIES})")
+                await asyncio.sleep(delay)
+
+    async def _commit(self, statements):
+        db = self.writer_db
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # Consecutive identical statements go through executemany
+            i = 0
+            while i < len(statements):
+                sql = statements[i][0]
+                j = i
+                while j < len(statements) and statements[j][0] == sql:
+                    j += 1
+                await db.executemany(sql, [params for _, params in statements[i:j]])
+                i = j
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+
+storage = Storage()
@@ -0,0 +1,107 @@
+"""
+Local stand-ins for Groq (STT + LLM) and edge-tts, for load tests and CI.
+Selected with BRAIN_BACKEND=stub. Nothing here touches the network: STT and the
+LLM answer canned text after configurable delays, and TTS streams a real MP3
+(encoded once with PyAV) so the decode path costs what it does in production.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+
+from config import (
+    STUB_STT_MS, STUB_LLM_FIRST_TOKEN_MS, STUB_LLM_TOKEN_MS,
+    STUB_TTS_FIRST_BYTE_MS, STUB_TTS_SPEEDUP,
+)
+
+STUB_TRANSCRIPT = "Hey, can you tell me something interesting about the ocean?"
+STUB_REPLY = "The ocean holds about ninety seven percent of Earth's water. Most of it is still unexplored, so there is plenty left to discover."
+
+MP3_RATE = 24000         # edge-tts streams 24kHz mono MP3
+MP3_CHUNK_BYTES = 1440     # A few MP3 frames, about what edge-tts sends per message
+SECONDS_PER_WORD = 0.3   # Roughly conversational speaking rate
+
+_clip = None
+
+
+def _encode_clip(seconds: float = 1.0):
+    """One second of speech-like audio (amplitude-modulated harmonics) as MP3 bytes."""
+    import av
+    t = np.arange(int(seconds * MP3_RATE)) / MP3_RATE
+    pitch = 140.0 + 30.0 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / MP3_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3.0 * t)
+    samples = (voiced * envelope * 6000).astype(np.int16)
+
+    # Bare MP3 frames (no ID3 tag or Xing header) so copies can be concatenated
+    encoder = av.CodecContext.create("mp3", "w")
+    encoder.sample_rate = MP3_RATE
+    encoder.layout = "mono"
+    encoder.format = "s16p"
+    encoder.bit_rate = 48000
+    frame = av.AudioFrame.from_ndarray(samples[None, :], format="s16p", layout="mono")
+    frame.sample_rate = MP3_RATE
+    return b"".join(bytes(packet) for packet in [*encoder.encode(frame), *encoder.encode(None)])
+
+
+def mp3_clip():
+    global _clip
+    if _clip is None:
+        _clip = _encode_clip()
+    return _clip
+
+
+async def tts_stream(text: str):
+    """Same chunk shape as edge_tts.Communicate.stream(): ~0.3s of MP3 per word."""
+    clip = mp3_clip()
+    seconds = max(1, round(len(text.split()) * SECONDS_PER_WORD))
+    data = clip * seconds
+    # Bytes arrive STUB_TTS_SPEEDUP times faster than they play
+    chunk_seconds = MP3_CHUNK_BYTES / len(clip) / STUB_TTS_SPEEDUP
+    await asyncio.sleep(STUB_TTS_FIRST_BYTE_MS / 1000)
+    for i in range(0, len(data), MP3_CHUNK_BYTES):
+        yield {"type": "audio", "data": data[i:i + MP3_CHUNK_BYTES]}
+        await asyncio.sleep(chunk_seconds)
+
+
+class _Transcriptions:
+    async def create(self, file=None, model=None, response_format=None, **kwargs):
+        await asyncio.sleep(STUB_STT_MS / 1000)
+        return STUB_TRANSCRIPT
+
+
+class _ReplyStream:
+    """Async iterator of chat.completion.chunk-shaped objects, like the SDK's AsyncStream."""
+    def __init__(self, text: str):
+        self.tokens = [word + " " for word in text.split()]
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(STUB_LLM_FIRST_TOKEN_MS / 1000)
+        for token in self.tokens:
+            if self.closed:
+                return
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+            await asyncio.sleep(STUB_LLM_TOKEN_MS / 1000)
+
+    async def close(self):
+        self.closed = True
+
+
+class _Completions:
+    async def create(self, messages=None, model=None, stream=False, **kwargs):
+        if stream:
+            return _ReplyStream(STUB_REPLY)
+        await asyncio.sleep((STUB_LLM_FIRST_TOKEN_MS + STUB_LLM_TOKEN_MS * len(STUB_REPLY.split())) / 1000)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=STUB_REPLY))])
+
+
+class StubGroqClient:
+    """The slice of AsyncGroq that BrainEngine uses."""
+    def __init__(self):
+        self.audio = SimpleNamespace(transcriptions=_Transcriptions())
+        self.chat = SimpleNamespace(completions=_Completions())
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Settings are read when config is first imported, by whichever test module
+# comes first: a scratch database and no speculative STT
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["ENDPOINT_SPECULATE_MS"] = "0"
+os.environ["TURN_MODE"] = "streaming"
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
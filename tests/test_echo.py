@@ -0,0 +1,40 @@
+import numpy as np
+
+from echo import EchoReference, SAMPLE_RATE
+
+FRAME = 320          # 20ms
+DELAY = 1600         # 100ms of playback-to-mic delay
+PLAY_AT = 100.0      # Monotonic time the reply starts playing
+
+
+def pcm(samples):
+    return np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+
+
+def setup():
+    rng = np.random.default_rng(0)
+    reply = rng.normal(0, 3000, SAMPLE_RATE)
+    echo = EchoReference()
+    echo.write(pcm(reply), PLAY_AT)
+    return echo, reply, rng
+
+
+def frame_at(reply, start):
+    """The reply as the mic hears it for the frame that ends DELAY samples after reply[start + FRAME]."""
+    return 0.3 * reply[start:start + FRAME], PLAY_AT + (start + FRAME + DELAY) / SAMPLE_RATE
+
+
+def test_pure_echo_is_gated():
+    echo, reply, _ = setup()
+    for start in range(4000, 8000, FRAME):
+        leaked, received_at = frame_at(reply, start)
+        assert echo.adjust(pcm(leaked), 0.9, received_at) == 0.0
+
+
+def test_double_talk_keeps_barge_in():
+    echo, reply, rng = setup()
+    for start in range(4000, 8000, FRAME):
+        leaked, received_at = frame_at(reply, start)
+        # The user talks over the agent at about the echo's level
+        user = rng.normal(0, 900, FRAME)
+        assert echo.adjust(pcm(leaked + user), 0.9, received_at) == 0.9
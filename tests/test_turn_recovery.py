@@ -0,0 +1,193 @@
+import json
+import base64
+import asyncio
+import functools
+
+import numpy as np
+
+# Settings (scratch database, no speculative STT) come from conftest.py
+import main
+from llm_engine import BrainEngine
+from storage import storage
+from state_manager import AgentState, CallManager
+from upstream import upstream
+
+FRAME_BYTES = 640  # 20ms of 16kHz PCM16
+SPEECH = np.full(FRAME_BYTES // 2, 3000, dtype=np.int16).tobytes()
+SILENCE = bytes(FRAME_BYTES)
+
+
+class FakeWebSocket:
+    """Feeds queued client messages to the handler and records what it sends."""
+    def __init__(self, hold=None):
+        self.inbox = asyncio.Queue()
+        self.states = []
+        self.state_changed = asyncio.Event()
+        self.hold = hold  # (key, value, nth): the nth such event blocks until the session is torn down
+        self.held = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send_text(self, text):
+        event = json.loads(text)
+        if self.hold is not None and event.get(self.hold[0]) == self.hold[1]:
+            key, value, nth = self.hold
+            self.hold = (key, value, nth - 1) if nth > 1 else None
+            if nth == 1:
+                self.held.set()
+                await asyncio.Event().wait()
+        if event.get("event") == "state":
+            self.states.append(event["state"])
+            self.state_changed.set()
+
+    async def send_bytes(self, data):
+        pass
+
+    def send_frames(self, pcm, count):
+        payload = base64.b64encode(pcm).decode("ascii")
+        for _ in range(count):
+            self.inbox.put_nowait({"type": "websocket.receive", "text": json.dumps({"event": "media", "media": {"payload": payload}})})
+
+    async def wait_for_state(self, state, timeout=5.0):
+        async def wait():
+            while state not in self.states:
+                self.state_changed.clear()
+                await self.state_changed.wait()
+        await asyncio.wait_for(wait(), timeout)
+
+
+class FakeVadSession:
+    async def process(self, pcm):
+        return 1.0 if any(pcm) else 0.0
+
+
+class FakeVadService:
+    def create_session(self):
+        return FakeVadSession()
+
+
+class FakeBrain:
+    """Streams a turn that fails or produces no audio."""
+    fillers = []
+
+    def __init__(self, fail: bool):
+        self.fail = fail
+        self.turns = 0
+
+    async def stream_turn(self, utterance_wav, user_id, speculation=None, trace=None):
+        self.turns += 1
+        yield "user_text", "hello"
+        if self.fail:
+            raise RuntimeError("LLM unavailable")
+        yield "ai_text", ""
+
+    def schedule_compaction(self, user_id):
+        pass
+
+
+# One event loop for the module: the storage singleton's queues belong to it
+runner = asyncio.Runner()
+
+
+def setup_module():
+    runner.run(storage.start())
+
+
+def teardown_module():
+    runner.run(storage.close())
+    runner.close()
+
+
+async def run_session(fail: bool):
+    user_id = await storage.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (f"recovery-{fail}@test", "x"))
+    websocket = FakeWebSocket()
+    brain = FakeBrain(fail)
+    session = asyncio.create_task(main.serve_session(websocket, user_id, "json", "pcm16_16k", FakeVadService(), brain))
+    try:
+        # One utterance: speech, then enough silence to end the turn
+        websocket.send_frames(SPEECH, 10)
+        websocket.send_frames(SILENCE, 40)
+        await websocket.wait_for_state(AgentState.THINKING.value)
+        await websocket.wait_for_state(AgentState.LISTENING.value)
+
+        # The session still takes the floor from the user afterwards
+        websocket.states.clear()
+        websocket.send_frames(SPEECH, 10)
+        websocket.send_frames(SILENCE, 40)
+        await websocket.wait_for_state(AgentState.RECEIVING.value)
+        await websocket.wait_for_state(AgentState.LISTENING.value)
+        assert brain.turns == 2
+    finally:
+        websocket.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await session
+
+
+def test_failed_streaming_turn_returns_to_listening():
+    runner.run(run_session(fail=True))
+
+
+def test_silent_streaming_turn_returns_to_listening():
+    runner.run(run_session(fail=False))
+
+
+async def new_user(email):
+    return await storage.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (email, "x"))
+
+
+async def settle(speculation):
+    """Lets the speculation's tasks, and the stream close they may spawn, run to the end."""
+    await asyncio.gather(*(task for task in (speculation.transcript, speculation.reply) if task is not None), return_exceptions=True)
+    await asyncio.gather(*speculation.brain.background_tasks, return_exceptions=True)
+
+
+async def run_cancelled_speculative_turn(hold):
+    """Cancels a turn that committed a speculative LLM stream while the turn is blocked sending `hold`."""
+    user_id = await new_user(f"speculation-{hold[1]}-{hold[2]}@test")
+    websocket = FakeWebSocket(hold)
+    brain = BrainEngine("stub")
+    speculations = []
+    speculate = brain.speculate
+    brain.speculate = lambda *args, **kwargs: speculations.append(speculate(*args, **kwargs)) or speculations[-1]
+    session = asyncio.create_task(main.serve_session(websocket, user_id, "json", "pcm16_16k", FakeVadService(), brain))
+    try:
+        websocket.send_frames(SPEECH, 10)
+        websocket.send_frames(SILENCE, 40)
+        await asyncio.wait_for(websocket.held.wait(), 5.0)
+    finally:
+        # The client leaving cancels the turn where it stands
+        websocket.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await session
+    assert len(speculations) == 1
+    await settle(speculations[0])
+    assert upstream.stages["llm"].active == 0
+
+
+def test_turn_cancelled_before_streaming_releases_speculative_llm(monkeypatch):
+    monkeypatch.setattr(main, "SPECULATIVE_LLM", True)
+    monkeypatch.setattr(main, "CallManager", functools.partial(CallManager, speculate_ms=200))
+    # The turn's own THINKING event (the first is the endpoint's): stream_turn has not run at all
+    runner.run(run_cancelled_speculative_turn(("state", AgentState.THINKING.value, 2)))
+    # The user's transcript: the generator is closed at its "user_text" yield
+    runner.run(run_cancelled_speculative_turn(("role", "user", 1)))
+
+
+async def close_at_user_text():
+    user_id = await new_user("speculation-brain@test")
+    brain = BrainEngine("stub")
+    speculation = brain.speculate(main.pcm16_to_wav(SPEECH * 10), user_id, with_llm=True)
+    await speculation.reply
+    assert upstream.stages["llm"].active == 1
+    turn = brain.stream_turn(main.pcm16_to_wav(SPEECH * 10), user_id, speculation)
+    kind, _ = await turn.__anext__()
+    assert kind == "user_text"
+    await turn.aclose()
+    await settle(speculation)
+    assert upstream.stages["llm"].active == 0
+
+
+def test_stream_turn_closed_at_user_text_releases_speculative_llm():
+    runner.run(close_at_user_text())
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import uuid
+
+from metrics import Summary
+from storage import storage
+
+# Stages of one turn, in pipeline order. Every stage is timed from the moment
+# the user actually stopped speaking, so "speech_end_detected" is the
+# endpointing wait and "first_audio_sent" is what the caller feels.
+STAGES = (
+    "speech_end_detected",
+    "stt_done",
+    "llm_first_token",
+    "tts_first_byte",
+    "tts_first_pcm",
+    "first_audio_sent",
+)
+
+STAGE_LATENCY = Summary("turn_stage_latency_seconds", "Time from end of user speech to each pipeline stage", ["stage"])
+TURN_DURATION = Summary("turn_duration_seconds", "Time from end of user speech until the turn finished, by outcome", ["outcome"])
+BARGE_IN_REACTION = Summary("barge_in_reaction_seconds", "Time from user speech onset during playback until playback was cleared")
+EVENT_LOOP_LAG = Summary("event_loop_lag_seconds", "How late a periodic timer fires on the event loop (time other callbacks held it)")
+
+
+class TurnTrace:
+    """
+    Timestamps the stages of one STT -> LLM -> TTS turn.
+    mark() keeps the first occurrence of each stage; finish() feeds the
+    latency summaries and queues the per-turn breakdown for the turn_traces table.
+    turn_id is also stored on the turn's conversations rows, to join the two.
+    """
+    def __init__(self, user_id: int, speech_ended_at: float = None):
+        self.user_id = user_id
+        self.turn_id = uuid.uuid4().hex
+        self.started = time.monotonic() if speech_ended_at is None else speech_ended_at
+        self.marks = {}
+        self.finished = False
+
+    def mark(self, stage: str, at: float = None):
+        if stage not in self.marks:
+            self.marks[stage] = (time.monotonic() if at is None else at) - self.started
+
+    def finish(self, outcome: str):
+        """Records the turn once; outcome is "completed", "interrupted" or "failed"."""
+        if self.finished:
+            return
+        self.finished = True
+        total = time.monotonic() - self.started
+        for stage, seconds in self.marks.items():
+            STAGE_LATENCY.observe(seconds, stage=stage)
+        TURN_DURATION.observe(total, outcome=outcome)
+
+        def ms(stage):
+            seconds = self.marks.get(stage)
+            return None if seconds is None else int(seconds * 1000)
+
+        storage.enqueue(
+            f"INSERT INTO turn_traces (user_id, turn_id, outcome, total_ms, {', '.join(stage + '_ms' for stage in STAGES)}) "
+            f"VALUES (?, ?, ?, ?, {', '.join('?' for _ in STAGES)})",
+            (self.user_id, self.turn_id, outcome, int(total * 1000), *(ms(stage) for stage in STAGES)),
+        )
+        print("⏱️ Turn " + ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.marks.items()) + f" ({outcome})")
+
+
+def observe_barge_in(speech_started_at: float):
+    BARGE_IN_REACTION.observe(time.monotonic() - speech_started_at)
+
+
+async def monitor_event_loop(interval: float = 0.1):
+    """Samples event-loop lag until cancelled: a blocked loop delays every session at once."""
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.monotonic() - expected))
@@ -0,0 +1,177 @@
+import os
+import mmap
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+
+from config import (
+    TTS_CACHE_MEMORY_MB, TTS_CACHE_DIR, TTS_CACHE_DISK_MB,
+    TTS_CACHE_MAX_CHARS, TTS_CACHE_ADMIT_AFTER,
+)
+from executors import run_blocking
+from metrics import Counter, Gauge
+
+TTS_CACHE_LOOKUPS = Counter("tts_cache_lookups_total", "TTS cache lookups by outcome (memory, disk, miss)", ["outcome"])
+TTS_CACHE_MEMORY = Gauge("tts_cache_memory_bytes", "PCM bytes held by the in-memory TTS cache")
+
+OUTPUT_FORMAT = "pcm16_16k"  # What a cached phrase holds: 16kHz mono PCM16, as sent downstream
+SEEN_LIMIT = 4096  # Uncached phrases whose synthesis count is remembered for admission
+
+
+def normalize(text: str):
+    """NFKC with whitespace runs collapsed. Case and punctuation are kept: both change the prosody."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(text: str, voice: str, output_format: str = OUTPUT_FORMAT):
+    return hashlib.sha256(f"{voice}\0{output_format}\0{normalize(text)}".encode("utf-8")).hexdigest()
+
+
+def _read(path: str):
+    """Maps a stored phrase read-only. None if it is gone (evicted by another worker)."""
+    try:
+        with open(path, "rb") as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        os.utime(path)  # Recently used, so trimmed last
+    except (FileNotFoundError, ValueError):
+        return None
+    return view
+
+
+def _trim(directory: str, limit: int, keep=frozenset()):
+    """Deletes the least recently used phrases until the store fits in `limit` bytes. Returns (kept, removed) keys."""
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(".pcm"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.name[:-4]))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    kept, removed = set(), set()
+    for _, size, key in entries:
+        if total <= limit or key in keep:
+            kept.add(key)
+            continue
+        try:
+            os.remove(os.path.join(directory, key + ".pcm"))
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed.add(key)
+    return kept, removed
+
+
+def _write(directory: str, key: str, pcm: bytes, limit: int, keep=frozenset()):
+    """Stores one phrase atomically (readers never see a partial file), then trims the store."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, key + ".pcm")
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(pcm)
+    os.replace(temp, path)
+    return _trim(directory, limit, keep)
+
+
+class TtsCache:
+    """
+    Content-addressed cache of synthesized phrases, stored as the PCM that is
+    sent downstream, so a hit skips both synthesis and MP3 decoding.
+    In memory: an LRU of memoryviews bounded by `memory_bytes`. Phrases loaded
+    from the disk store are views of a read-only mmap, so they are served
+    without a copy. On disk (optional): one <key>.pcm file per phrase, shared
+    by every worker (a memory miss checks for the file, so phrases stored by
+    other workers are found) and trimmed to `disk_bytes`, least recently used first.
+    Pinned phrases (fillers) are never evicted.
+    """
+    def __init__(self, memory_bytes: int = int(TTS_CACHE_MEMORY_MB * 1024 * 1024), directory: str = TTS_CACHE_DIR,
+                 disk_bytes: int = int(TTS_CACHE_DISK_MB * 1024 * 1024), max_chars: int = TTS_CACHE_MAX_CHARS,
+                 admit_after: int = TTS_CACHE_ADMIT_AFTER):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.max_chars = max_chars
+        self.admit_after = max(1, admit_after)
+        self.entries = OrderedDict()  # key -> memoryview, least recently used first
+        self.memory = 0
+        self.pinned = set()
+        self.seen = OrderedDict()  # key -> syntheses while not cached
+        self.disk_keys = set()
+        self.writes = set()  # Background disk writes (kept referenced until they finish)
+
+    def cacheable(self, text: str):
+        return 0 < len(normalize(text)) <= self.max_chars
+
+    def load_index(self):
+        """Lists (and trims) the disk store (blocking; run off the event loop)."""
+        if self.directory and os.path.isdir(self.directory):
+            self.disk_keys, _ = _trim(self.directory, self.disk_bytes)
+
+    async def get(self, key: str):
+        """The cached PCM for `key` as a memoryview, or None."""
+        view = self.entries.get(key)
+        if view is not None:
+            self.entries.move_to_end(key)
+            TTS_CACHE_LOOKUPS.inc(outcome="memory")
+            return view
+        # disk_keys only knows this worker's writes (and the store at startup), so
+        # look for a phrase another worker stored as well
+        if self.directory:
+            view = await run_blocking(_read, os.path.join(self.directory, key + ".pcm"))
+            if view is not None:
+                self.disk_keys.add(key)
+                self._remember(key, view)
+                TTS_CACHE_LOOKUPS.inc(outcome="disk")
+                return view
+            self.disk_keys.discard(key)
+        TTS_CACHE_LOOKUPS.inc(outcome="miss")
+        return None
+
+    def admit(self, key: str):
+        """Counts one synthesis of an uncached phrase. True once it has been said often enough to store."""
+        count = self.seen.pop(key, 0) + 1
+        self.seen[key] = count
+        if len(self.seen) > SEEN_LIMIT:
+            self.seen.popitem(last=False)
+        return count >= self.admit_after
+
+    def put(self, key: str, pcm: bytes, pin: bool = False):
+        """Stores a completely synthesized phrase; the disk write happens in the background."""
+        if not pcm:
+            return
+        self.seen.pop(key, None)
+        if pin:
+            self.pinned.add(key)
+        self._remember(key, memoryview(pcm))
+        if self.directory and key not in self.disk_keys:
+            self.disk_keys.add(key)
+            task = asyncio.create_task(self._store(key, pcm))
+            self.writes.add(task)
+            task.add_done_callback(self.writes.discard)
+
+    async def _store(self, key: str, pcm: bytes):
+        try:
+            _, removed = await run_blocking(_write, self.directory, key, pcm, self.disk_bytes, frozenset(self.pinned))
+        except OSError as e:
+            self.disk_keys.discard(key)
+            print(f"⚠️ TTS cache write failed: {e!r}")
+            return
+        self.disk_keys -= removed
+
+    def _remember(self, key: str, view: memoryview):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.memory -= previous.nbytes
+        if view.nbytes <= self.memory_bytes or key in self.pinned:
+            self.entries[key] = view
+            self.memory += view.nbytes
+        for old_key in list(self.entries):
+            if self.memory <= self.memory_bytes:
+                break
+            if old_key not in self.pinned:
+                self.memory -= self.entries.pop(old_key).nbytes
+        TTS_CACHE_MEMORY.set(self.memory)
+
+
+tts_cache = TtsCache()
@@ -0,0 +1,255 @@
+import time
+import random
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from config import (
+    UPSTREAM_STT_CONCURRENCY, UPSTREAM_LLM_CONCURRENCY, UPSTREAM_TTS_CONCURRENCY,
+    UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF_BASE_MS, UPSTREAM_BACKOFF_MAX_MS,
+)
+from metrics import Counter, Gauge, Summary
+
+# Who is waiting on an upstream call, most urgent first
+PRIORITY_INTERACTIVE = 0  # A caller has stopped talking and is waiting for the reply
+PRIORITY_SPECULATIVE = 1  # Started during trailing silence; may still be thrown away
+PRIORITY_BACKGROUND = 2   # Nobody is waiting (rolling summaries)
+PRIORITY_NAMES = ("interactive", "speculative", "background")
+
+UPSTREAM_QUEUED = Gauge("upstream_queued", "Upstream calls waiting for a slot, by stage", ["stage"])
+UPSTREAM_IN_FLIGHT = Gauge("upstream_in_flight", "Upstream calls holding a slot, by stage", ["stage"])
+UPSTREAM_WAIT = Summary("upstream_wait_seconds", "Time an upstream call waited for a slot", ["stage", "priority"])
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Upstream calls retried after a rate limit (HTTP 429), by stage", ["stage"])
+
+
+class StageScheduler:
+    """
+    Concurrency limit for one upstream stage (STT, LLM or TTS) in this worker.
+    Waiters are served strictly by priority; within a priority, users take turns
+    (round-robin over per-user FIFO queues), so a user with many queued calls
+    cannot hold back a user with one.
+    """
+    def __init__(self, stage: str, limit: int):
+        self.stage = stage
+        self.limit = max(1, limit)
+        self.active = 0
+        self.waiting = [OrderedDict() for _ in PRIORITY_NAMES]  # user_id -> deque of (future, enqueued_at)
+
+    @asynccontextmanager
+    async def slot(self, user_id, priority: int = PRIORITY_INTERACTIVE):
+        await self.acquire(user_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id, priority: int = PRIORITY_INTERACTIVE):
+        if self.active < self.limit and not any(self.waiting):
+            self._grant()
+            UPSTREAM_WAIT.observe(0.0, stage=self.stage, priority=PRIORITY_NAMES[priority])
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, time.monotonic())
+        self.waiting[priority].setdefault(user_id, deque()).append(entry)
+        UPSTREAM_QUEUED.inc(stage=self.stage)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Granted just as we were cancelled: hand the slot on
+            else:
+                self._forget(user_id, entry)
+            raise
+
+    def _forget(self, user_id, entry):
+        # promote() may have moved the entry to another priority
+        for users in self.waiting:
+            queue = users.get(user_id)
+            if queue is not None and entry in queue:
+                queue.remove(entry)
+                if not queue:
+                    del users[user_id]
+                UPSTREAM_QUEUED.dec(stage=self.stage)
+                return
+
+    def promote(self, user_id):
+        """
+        Moves the user's queued speculative calls up to interactive (a speculative
+        turn was committed). Background calls stay where they are.
+        """
+        queue = self.waiting[PRIORITY_SPECULATIVE].pop(user_id, None)
+        if queue:
+            self.waiting[PRIORITY_INTERACTIVE].setdefault(user_id, deque()).extend(queue)
+
+    def release(self):
+        self.active -= 1
+        UPSTREAM_IN_FLIGHT.dec(stage=self.stage)
+        self._dispatch()
+
+    def _grant(self):
+        self.active += 1
+        UPSTREAM_IN_FLIGHT.inc(stage=self.stage)
+
+    def _dispatch(self):
+        for priority, users in enumerate(self.waiting):
+            while users and self.active < self.limit:
+                user_id, queue = next(iter(users.items()))
+                future, enqueued_at = queue.popleft()
+                if queue:
+                    users.move_to_end(user_id)  # Next waiter of this priority is another user
+                else:
+                    del users[user_id]
+                UPSTREAM_QUEUED.dec(stage=self.stage)
+                self._grant()
+                UPSTREAM_WAIT.observe(time.monotonic() - enqueued_at, stage=self.stage, priority=PRIORITY_NAMES[priority])
+                future.set_result(None)
+
+
+def rate_limited(error: Exception):
+    """True for HTTP 429 from the Groq SDK (httpx) or edge-tts (aiohttp)."""
+    return getattr(error, "status_code", None) == 429 or getattr(error, "status", None) == 429
+
+
+def backoff_seconds(error: Exception, attempt: int):
+    """Retry-After if the server sent one, otherwise full-jitter exponential backoff."""
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), UPSTREAM_BACKOFF_MAX_MS / 1000)
+    except ValueError:
+        pass
+    ceiling = min(UPSTREAM_BACKOFF_MAX_MS, UPSTREAM_BACKOFF_BASE_MS * 2 ** attempt) / 1000
+    return random.uniform(0, ceiling)
+
+
+class ScheduledStream:
+    """
+    An LLM stream that keeps its slot until it is exhausted or closed.
+    Iterate it or close() it; both give the slot back exactly once.
+    """
+    def __init__(self, stream, scheduler: StageScheduler):
+        self.stream = stream
+        self.scheduler = scheduler
+        self.released = False
+
+    def _release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler.release()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        finally:
+            self._release()
+
+    async def close(self):
+        try:
+            await self.stream.close()
+        finally:
+            self._release()
+
+
+class Ticket:
+    """The priority of one call across its retries; promote() can raise it mid-call."""
+    def __init__(self, priority: int):
+        self.priority = priority
+
+
+class UpstreamScheduler:
+    """Shared by every session of a worker: one StageScheduler per stage plus 429 retries."""
+    def __init__(self):
+        self.stages = {
+            "stt": StageScheduler("stt", UPSTREAM_STT_CONCURRENCY),
+            "llm": StageScheduler("llm", UPSTREAM_LLM_CONCURRENCY),
+            "tts": StageScheduler("tts", UPSTREAM_TTS_CONCURRENCY),
+        }
+        self.speculative = {}  # user_id -> tickets of speculative calls in progress
+
+    def promote(self, user_id):
+        """A speculative turn became the real one: its queued calls (and their retries) are now interactive."""
+        for ticket in self.speculative.pop(user_id, ()):
+            ticket.priority = PRIORITY_INTERACTIVE
+        for scheduler in self.stages.values():
+            scheduler.promote(user_id)
+
+    def _ticket(self, user_id, priority: int):
+        ticket = Ticket(priority)
+        if priority == PRIORITY_SPECULATIVE:
+            self.speculative.setdefault(user_id, set()).add(ticket)
+        return ticket
+
+    def _done(self, user_id, ticket: Ticket):
+        tickets = self.speculative.get(user_id)
+        if tickets is not None:
+            tickets.discard(ticket)
+            if not tickets:
+                del self.speculative[user_id]
+
+    async def call(self, stage: str, user_id, priority: int, request, hold: bool = False):
+        """
+        Awaits request() inside a slot of `stage`, retrying rate-limited
+        attempts with backoff (waiting outside the slot). With hold=True the
+        result is a stream that keeps the slot (see ScheduledStream).
+        """
+        scheduler = self.stages[stage]
+        ticket = self._ticket(user_id, priority)
+        attempt = 0
+        try:
+            while True:
+                await scheduler.acquire(user_id, ticket.priority)
+                try:
+                    result = await request()
+                except BaseException as e:
+                    scheduler.release()
+                    if not isinstance(e, Exception) or not rate_limited(e) or attempt >= UPSTREAM_MAX_RETRIES:
+                        raise
+                    delay = backoff_seconds(e, attempt)
+                else:
+                    if hold:
+                        return ScheduledStream(result, scheduler)
+                    scheduler.release()
+                    return result
+                attempt += 1
+                UPSTREAM_RETRIES.inc(stage=stage)
+                print(f"⏳ {stage.upper()} rate limited, retry {attempt}/{UPSTREAM_MAX_RETRIES} in {delay * 1000:.0f}ms")
+                await asyncio.sleep(delay)
+        finally:
+            self._done(user_id, ticket)
+
+    async def stream(self, stage: str, user_id, priority: int, open_stream):
+        """
+        Iterates open_stream() inside a slot of `stage` for its whole length.
+        A rate limit before the first item is retried with backoff; after that
+        the error propagates, since part of the stream was already consumed.
+        """
+        scheduler = self.stages[stage]
+        ticket = self._ticket(user_id, priority)
+        attempt = 0
+        try:
+            while True:
+                started = False
+                async with scheduler.slot(user_id, ticket.priority):
+                    try:
+                        async for item in open_stream():
+                            started = True
+                            yield item
+                        return
+                    except Exception as e:
+                        if started or not rate_limited(e) or attempt >= UPSTREAM_MAX_RETRIES:
+                            raise
+                        delay = backoff_seconds(e, attempt)
+                attempt += 1
+                UPSTREAM_RETRIES.inc(stage=stage)
+                print(f"⏳ {stage.upper()} rate limited, retry {attempt}/{UPSTREAM_MAX_RETRIES} in {delay * 1000:.0f}ms")
+                await asyncio.sleep(delay)
+        finally:
+            self._done(user_id, ticket)
+
+
+upstream = UpstreamScheduler()
@@ -0,0 +1,112 @@
+import os
+import asyncio
+import struct
+
+import numpy as np
+
+from config import VAD_LOG_DIR
+from executors import run_blocking
+from state_manager import AgentState
+
+# Binary per-session log of the uplink as the endpointing saw it, for replay
+# and threshold sweeps (vad_replay.py).
+#
+# File header: magic b"VADL", version (u16), sample rate (u16)
+# Then one record per uplink frame, little-endian:
+#
+#     offset  size  field
+#     0       4     ms since session start (u32, wall clock)
+#     4       4     raw VAD probability (f32)
+#     8       4     probability after echo suppression, as fed to CallManager (f32)
+#     12      1     CallManager state after the frame (index into AgentState)
+#     13      1     flags: bit 0 = agent audio was playing when the frame arrived
+#     14      2     payload length in bytes (u16)
+#     16      n     16kHz PCM16 payload
+#
+# State transitions are the records where the state byte changes.
+
+MAGIC = b"VADL"
+VERSION = 1
+SAMPLE_RATE = 16000
+FILE_HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<IffBBH")
+FLAG_PLAYING = 1
+STATES = list(AgentState)
+FLUSH_BYTES = 64 * 1024
+
+
+def _append(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+class VadRecorder:
+    """Buffers one session's frame records and appends them to VAD_LOG_DIR/<session id>.vadlog off the event loop."""
+    def __init__(self, session_id: str, directory: str = VAD_LOG_DIR):
+        self.path = os.path.join(directory, f"{session_id}.vadlog") if directory else ""
+        self.buffer = bytearray(FILE_HEADER.pack(MAGIC, VERSION, SAMPLE_RATE))
+        self.flushing = None
+        self.started = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def frame(self, pcm, raw_prob: float, prob: float, state: AgentState, playing: bool, received_at: float):
+        if not self.enabled:
+            return
+        if self.started is None:
+            self.started = received_at
+        self.buffer += RECORD.pack(
+            int((received_at - self.started) * 1000), raw_prob, prob,
+            STATES.index(state), FLAG_PLAYING if playing else 0, len(pcm),
+        )
+        self.buffer += pcm
+        # One write in flight at a time keeps the records in order
+        if len(self.buffer) >= FLUSH_BYTES and (self.flushing is None or self.flushing.done()):
+            data, self.buffer = bytes(self.buffer), bytearray()
+            self.flushing = asyncio.create_task(run_blocking(_append, self.path, data))
+
+    async def close(self):
+        if not self.enabled:
+            return
+        if self.flushing is not None:
+            await self.flushing
+        if self.buffer:
+            await run_blocking(_append, self.path, bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def read_log(path: str):
+    """
+    Loads a .vadlog into whole-file NumPy arrays:
+    time_ms, raw_prob, prob, state (AgentState index), playing (bool),
+    frame_ms (audio length of each frame) and pcm (all payloads, concatenated int16).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, sample_rate = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a version {VERSION} VAD log")
+
+    fields, payloads = [], []
+    offset = FILE_HEADER.size
+    while offset + RECORD.size <= len(data):
+        record = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        fields.append(record)
+        payloads.append(data[offset:offset + record[5]])
+        offset += record[5]
+
+    columns = np.array(fields, dtype=np.float64).reshape(-1, 6)
+    return {
+        "sample_rate": sample_rate,
+        "time_ms": columns[:, 0],
+        "raw_prob": columns[:, 1],
+        "prob": columns[:, 2],
+        "state": columns[:, 3].astype(np.int8),
+        "playing": (columns[:, 4].astype(np.int64) & FLAG_PLAYING) != 0,
+        "frame_ms": columns[:, 5] / (2 * sample_rate / 1000),
+        "pcm": np.frombuffer(b"".join(payloads), dtype=np.int16),
+    }
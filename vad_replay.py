@@ -0,0 +1,286 @@
+"""
+Offline replay of recorded sessions (VAD_LOG_DIR=... on the server) through
+the VAD and the CallManager endpointing, with threshold sweeps.
+
+    python vad_replay.py logs/*.vadlog --speech-prob 0.4,0.5,0.6,0.7 \\
+        --speech-ms 40,60,100 --silence-ms 300,500,700
+
+For every combination it reports, over all logs:
+  endpoint latency    time from the end of reference speech to the endpoint
+  early endpoints     endpoints that fired inside reference speech (user cut off)
+  false barge-ins     onsets during agent playback with no reference speech
+  clipped onsets      utterances whose captured audio (PREROLL_MS before the
+                      onset) starts after the reference speech did, or missed
+
+Reference speech is an offline, non-causal segmentation of the same
+probabilities (hysteresis plus gap merging), so the numbers say how close the
+causal online endpointing gets to what hindsight would have chosen.
+
+--rescore runs the recorded PCM through VADEngine again (batched across all
+files in lock-step) instead of using the recorded probabilities; the recorded
+echo suppression factor is reapplied and the energy pre-gate is not simulated.
+The endpointing itself is vectorized per file with NumPy; --verify checks it
+against the real CallManager stepped frame by frame.
+"""
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+from config import ENDPOINT_SPEECH_PROB, ENDPOINT_SPEECH_MS, ENDPOINT_SILENCE_MS, PREROLL_MS
+from state_manager import CallManager, AgentState
+from vad_log import read_log
+
+WINDOW_SAMPLES = 512
+EPSILON = 1e-6  # Duration sums are compared with a little slack for float rounding
+
+
+def rescore(logs, engine):
+    """Recomputes every log's per-frame probabilities with Silero, one batched pass per window index."""
+    windows = []
+    for log in logs:
+        audio = log["pcm"].astype(np.float32) / 32768.0
+        n = audio.size // WINDOW_SAMPLES
+        windows.append(audio[:n * WINDOW_SAMPLES].reshape(n, WINDOW_SAMPLES))
+    window_probs = [np.zeros(len(w), dtype=np.float64) for w in windows]
+    states = [engine.initial_state() for _ in logs]
+
+    for k in range(max((len(w) for w in windows), default=0)):
+        active = [i for i, w in enumerate(windows) if k < len(w)]
+        probs, new_states, new_contexts = engine.infer_batch(
+            np.stack([windows[i][k] for i in active]),
+            [states[i][0] for i in active],
+            [states[i][1] for i in active],
+        )
+        for i, prob, state, context in zip(active, probs, new_states, new_contexts):
+            window_probs[i][k] = prob
+            states[i] = (state, context)
+
+    rescored = []
+    for log, probs in zip(logs, window_probs):
+        frame_probs = frame_probs_from_windows(probs, np.round(log["frame_ms"] * 16).astype(np.int64))
+        # Keep the echo suppression the server applied to each frame
+        factor = np.where(log["raw_prob"] > 0, log["prob"] / np.maximum(log["raw_prob"], EPSILON), 1.0)
+        rescored.append(frame_probs * np.clip(factor, 0.0, 1.0))
+    return rescored
+
+
+def frame_probs_from_windows(window_probs, frame_samples):
+    """
+    Maps 512-sample window probabilities back onto uplink frames the way
+    VADSession does: the max over windows completed in the frame, or the
+    previous frame's value when a frame completes none.
+    """
+    completed = np.cumsum(frame_samples) // WINDOW_SAMPLES
+    completed = np.minimum(completed, len(window_probs))
+    before = np.concatenate(([0], completed[:-1]))
+    has_window = completed > before
+    probs = np.zeros(len(frame_samples), dtype=np.float64)
+    if has_window.any():
+        probs[has_window] = np.maximum.reduceat(window_probs[:completed[-1]], before[has_window])
+    # Forward-fill frames without a complete window
+    last = np.where(has_window, np.arange(len(probs)), -1)
+    last = np.maximum.accumulate(last)
+    return np.where(last >= 0, probs[np.maximum(last, 0)], 0.0)
+
+
+def run_lengths(flags, frame_ms):
+    """Duration (ms) of the current run of equal flags up to and including each frame."""
+    ends = np.cumsum(frame_ms)
+    change = np.ones(len(flags), dtype=bool)
+    change[1:] = flags[1:] != flags[:-1]
+    run_start = (ends - frame_ms)[change]
+    return ends - run_start[np.cumsum(change) - 1]
+
+
+def simulate(probs, frame_ms, speech_prob, speech_ms, silence_ms):
+    """
+    CallManager's onset/endpoint decisions for a whole file, vectorized.
+    Returns (onset frame indices, endpoint frame indices). After an endpoint the
+    agent is treated as listening again at once (the THINKING time depends on
+    upstream latency, which a replay does not have).
+    """
+    speech = probs > speech_prob
+    run = run_lengths(speech, frame_ms)
+    previous = run - frame_ms
+    onset_candidates = np.flatnonzero(speech & (run >= speech_ms - EPSILON) & (previous < speech_ms - EPSILON))
+    endpoint_candidates = np.flatnonzero(~speech & (run >= silence_ms - EPSILON) & (previous < silence_ms - EPSILON))
+
+    onsets, endpoints = [], []
+    cursor = 0
+    while True:
+        i = np.searchsorted(onset_candidates, cursor)
+        if i == len(onset_candidates):
+            break
+        onset = onset_candidates[i]
+        onsets.append(onset)
+        j = np.searchsorted(endpoint_candidates, onset, side="right")
+        if j == len(endpoint_candidates):
+            break
+        endpoints.append(endpoint_candidates[j])
+        cursor = endpoint_candidates[j] + 1
+    return np.array(onsets, dtype=np.int64), np.array(endpoints, dtype=np.int64)
+
+
+def step_call_manager(probs, frame_ms, speech_prob, speech_ms, silence_ms):
+    """Reference for simulate(): the real CallManager, one frame at a time."""
+    manager = CallManager(speech_ms=speech_ms, silence_ms=silence_ms, speculate_ms=0, speech_prob=speech_prob)
+    onsets, endpoints = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, (prob, ms) in enumerate(zip(probs, frame_ms)):
+            if manager.process_vad_frame(prob, ms):
+                if manager.state == AgentState.RECEIVING:
+                    onsets.append(i)
+                elif manager.state == AgentState.THINKING:
+                    endpoints.append(i)
+                    manager.state = AgentState.LISTENING
+    return np.array(onsets, dtype=np.int64), np.array(endpoints, dtype=np.int64)
+
+
+def reference_segments(probs, frame_ms, on=0.5, off=0.35, min_speech_ms=250, min_gap_ms=300):
+    """Offline speech segments (start_ms, end_ms) in audio time: hysteresis, then gap merging and a minimum length."""
+    ends = np.cumsum(frame_ms)
+    starts = ends - frame_ms
+    marks = np.where(probs >= on, 1, np.where(probs < off, 0, -1))
+    last = np.maximum.accumulate(np.where(marks >= 0, np.arange(len(marks)), -1))
+    active = np.where(last >= 0, marks[np.maximum(last, 0)], 0) == 1
+    if not active.any():
+        return np.zeros(0), np.zeros(0)
+
+    edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+    seg_start = starts[np.flatnonzero(edges == 1)]
+    seg_end = ends[np.flatnonzero(edges == -1) - 1]
+    # Merge segments separated by short pauses
+    keep = np.concatenate(([True], seg_start[1:] - seg_end[:-1] >= min_gap_ms))
+    merged_start = seg_start[keep]
+    merged_end = np.maximum.reduceat(seg_end, np.flatnonzero(keep))
+    long_enough = merged_end - merged_start >= min_speech_ms
+    return merged_start[long_enough], merged_end[long_enough]
+
+
+def score(log, onsets, endpoints, segments, preroll_ms):
+    """Counts for one log and one configuration (summed across logs by the caller)."""
+    ends = np.cumsum(log["frame_ms"])
+    seg_start, seg_end = segments
+    onset_at, endpoint_at = ends[onsets], ends[endpoints]
+    # Index -1 (nothing before) lands on the -inf / inf padding
+    padded_end = np.append(seg_end, -np.inf)
+
+    def inside(times):
+        return times <= padded_end[np.searchsorted(seg_start, times, side="right") - 1]
+
+    # Endpoints: early if inside reference speech, otherwise late by the distance to the last speech end
+    early = inside(endpoint_at)
+    late = endpoint_at[~early]
+    latencies = late - padded_end[np.searchsorted(seg_end, late, side="right") - 1]
+    latencies = latencies[np.isfinite(latencies)]
+
+    # Onsets while the agent was playing that no reference speech explains
+    during_playback = log["playing"][onsets]
+    real = inside(onset_at)
+
+    # Reference utterances that start while the simulated agent is listening,
+    # and the first onset at or after each start
+    receiving_until = np.append(np.concatenate((endpoint_at, np.full(len(onset_at) - len(endpoint_at), np.inf))), -np.inf)
+    fresh = seg_start >= receiving_until[np.searchsorted(onset_at, seg_start, side="right") - 1]
+    first_onset = np.append(onset_at, np.inf)[np.searchsorted(onset_at, seg_start)]
+    detected = first_onset <= seg_end
+    clipped = detected & (first_onset - preroll_ms > seg_start + EPSILON)
+
+    return {
+        "endpoints": len(endpoints),
+        "early_endpoints": int(early.sum()),
+        "latencies": latencies.tolist(),
+        "barge_ins": int(during_playback.sum()),
+        "false_barge_ins": int((during_playback & ~real).sum()),
+        "utterances": int(fresh.sum()),
+        "clipped_onsets": int((fresh & clipped).sum()),
+        "missed_onsets": int((fresh & ~detected).sum()),
+    }
+
+
+def sweep(logs, probs_per_log, grid, preroll_ms, reference):
+    segments = [reference_segments(probs, log["frame_ms"], **reference) for log, probs in zip(logs, probs_per_log)]
+    rows = []
+    for speech_prob, speech_ms, silence_ms in grid:
+        total = {"latencies": []}
+        for log, probs, segs in zip(logs, probs_per_log, segments):
+            onsets, endpoints = simulate(probs, log["frame_ms"], speech_prob, speech_ms, silence_ms)
+            for key, value in score(log, onsets, endpoints, segs, preroll_ms).items():
+                total[key] = total.get(key, 0) + value
+        latencies = np.array(total.pop("latencies"))
+        rate = lambda a, b: round(total[a] / total[b], 4) if total.get(b) else None
+        rows.append({
+            "speech_prob": speech_prob, "speech_ms": speech_ms, "silence_ms": silence_ms,
+            "endpoint_latency_p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+            "endpoint_latency_p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+            "early_endpoint_rate": rate("early_endpoints", "endpoints"),
+            "false_barge_in_rate": rate("false_barge_ins", "barge_ins"),
+            "clipped_onset_rate": rate("clipped_onsets", "utterances"),
+            "missed_onset_rate": rate("missed_onsets", "utterances"),
+            **total,
+        })
+    return rows
+
+
+def floats(text):
+    return [float(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay .vadlog files through the endpointing and sweep its thresholds")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--speech-prob", type=floats, default=[ENDPOINT_SPEECH_PROB])
+    parser.add_argument("--speech-ms", type=floats, default=[ENDPOINT_SPEECH_MS])
+    parser.add_argument("--silence-ms", type=floats, default=[ENDPOINT_SILENCE_MS])
+    parser.add_argument("--preroll-ms", type=float, default=PREROLL_MS)
+    parser.add_argument("--rescore", action="store_true", help="recompute probabilities with VADEngine instead of using the recorded ones")
+    parser.add_argument("--verify", action="store_true", help="check the vectorized replay against CallManager for every configuration")
+    parser.add_argument("--ref-on", type=float, default=0.5)
+    parser.add_argument("--ref-off", type=float, default=0.35)
+    parser.add_argument("--ref-min-speech-ms", type=float, default=250)
+    parser.add_argument("--ref-min-gap-ms", type=float, default=300)
+    parser.add_argument("--json", help="also write the rows to this file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    logs = [read_log(path) for path in args.logs]
+    audio_seconds = sum(log["frame_ms"].sum() for log in logs) / 1000
+    if args.rescore:
+        from audio_engine import VADEngine
+        probs_per_log = rescore(logs, VADEngine())
+    else:
+        probs_per_log = [log["prob"] for log in logs]
+
+    grid = [(p, s, q) for p in args.speech_prob for s in args.speech_ms for q in args.silence_ms]
+    if args.verify:
+        for path, log, probs in zip(args.logs, logs, probs_per_log):
+            for config in grid:
+                fast = simulate(probs, log["frame_ms"], *config)
+                exact = step_call_manager(probs, log["frame_ms"], *config)
+                if not all(np.array_equal(a, b) for a, b in zip(fast, exact)):
+                    print(f"❌ Replay diverges from CallManager on {path} at {config}")
+                    sys.exit(1)
+        print(f"✅ Vectorized replay matches CallManager on {len(logs)} logs x {len(grid)} configurations")
+
+    reference = {"on": args.ref_on, "off": args.ref_off, "min_speech_ms": args.ref_min_speech_ms, "min_gap_ms": args.ref_min_gap_ms}
+    rows = sweep(logs, probs_per_log, grid, args.preroll_ms, reference)
+    elapsed = time.perf_counter() - started
+
+    columns = ["speech_prob", "speech_ms", "silence_ms", "endpoint_latency_p50_ms", "endpoint_latency_p95_ms",
+               "early_endpoint_rate", "false_barge_in_rate", "clipped_onset_rate", "missed_onset_rate"]
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("-" if row[c] is None else str(row[c]) for c in columns))
+    print(f"⏱️ {len(logs)} logs, {audio_seconds:.0f}s of audio, {len(grid)} configurations in {elapsed:.2f}s ({audio_seconds * len(grid) / max(elapsed, EPSILON):.0f}x real time)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()